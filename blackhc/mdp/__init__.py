@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import time
 import typing
 from collections import defaultdict
 
@@ -19,6 +20,7 @@ import gym.spaces
 import networkx as nx
 import numpy as np
 
+from blackhc.mdp import instrumentation
 from blackhc.mdp.version import VERSION as __version__
 
 
@@ -107,7 +109,7 @@ class MDPSpec(object):
             else:
                 name = 'T%s' % self.num_states
 
-        if name not in self.states:
+        if name not in self._states:
             new_state = State(name, self.num_states, terminal_state=terminal_state)
             self._states[name] = new_state
             self.states.append(new_state)
@@ -117,7 +119,7 @@ class MDPSpec(object):
         if not name:
             name = 'A%s' % self.num_actions
 
-        if name not in self.actions:
+        if name not in self._actions:
             new_action = Action(name, self.num_actions)
             self._actions[name] = new_action
             self.actions.append(new_action)
@@ -165,12 +167,6 @@ class MDPSpec(object):
             attributes = graph.node[state]
             if state.terminal_state:
                 attributes['shape'] = 'doublecircle'
-            if state == highlight_state:
-                attributes['fillcolor'] = 'yellow'
-                attributes['style'] = 'filled'
-            if state == highlight_next_state:
-                attributes['fillcolor'] = 'red'
-                attributes['style'] = 'filled'
 
         for state in self.states:
             if not state.terminal_state:
@@ -197,30 +193,51 @@ class MDPSpec(object):
                             if not prob:
                                 continue
                             graph.add_edge(transition, next_state, label='%3.2f%%' % (prob * 100))
-
-                        if state == highlight_state and action == highlight_action:
-                            attributes = graph.node[transition]
-                            attributes['style'] = 'bold'
-
-                            attributes = graph.edge[state][transition][0]
-                            attributes['style'] = 'bold'
-                            attributes['color'] = 'green'
-                            if highlight_next_state:
-                                # Could also check that highlight_next_state is really a next state.
-                                attributes = graph.edge[transition][highlight_next_state][0]
-                                attributes['style'] = 'bold'
-                                attributes['color'] = 'red'
                     else:
                         next_state, _ = list(next_states)[0]
                         graph.add_edge(state, next_state, key=action,
                                        label=action_label)
-                        if state == highlight_state and action == highlight_action:
-                            attributes = graph.edge[state][next_state][action]
-                            attributes['style'] = 'bold'
-                            attributes['color'] = 'red'
+
+        node_highlights, edge_highlights = self.graph_highlights(highlight_state, highlight_action,
+                                                                 highlight_next_state, transitions)
+        for node, highlight in node_highlights.items():
+            graph.node[node].update(highlight)
+        for (u, v, key), highlight in edge_highlights.items():
+            if graph.has_edge(u, v, key):
+                graph.edge[u][v][key].update(highlight)
 
         return graph
 
+    def graph_highlights(self, highlight_state: State = None, highlight_action: Action = None,
+                         highlight_next_state: State = None, transitions: 'Transitions' = None):
+        """Return the attributes that `to_graph` sets to highlight a transition.
+
+        Returns a tuple of a Dict[node, attributes] and a Dict[(u, v, key), attributes].
+        This allows renderers to update a cached graph without rebuilding it.
+        """
+        node_highlights = {}
+        edge_highlights = {}
+        if highlight_state is not None:
+            node_highlights[highlight_state] = dict(fillcolor='yellow', style='filled')
+        if highlight_next_state is not None:
+            node_highlights[highlight_next_state] = dict(fillcolor='red', style='filled')
+
+        if highlight_state is not None and highlight_action is not None and not highlight_state.terminal_state:
+            transitions = transitions or Transitions(self)
+            next_states = transitions.next_states[highlight_state, highlight_action]
+            if len(next_states) > 1:
+                transition = (highlight_state, highlight_action)
+                node_highlights[transition] = dict(style='bold')
+                edge_highlights[highlight_state, transition, 0] = dict(style='bold', color='green')
+                if highlight_next_state:
+                    # Could also check that highlight_next_state is really a next state.
+                    edge_highlights[transition, highlight_next_state, 0] = dict(style='bold', color='red')
+            else:
+                next_state, _ = list(next_states.items())[0]
+                edge_highlights[highlight_state, next_state, highlight_action] = dict(style='bold', color='red')
+
+        return node_highlights, edge_highlights
+
     def to_env(self):
         return MDPEnv(self)
 
@@ -231,10 +248,164 @@ class MDPSpec(object):
         return self
 
 
+class Variable(object):
+    """A state variable of a `FactoredMDPSpec` with a finite list of values."""
+
+    def __init__(self, name, index, values):
+        self.name = name
+        self.index = index
+        self.values = list(values)
+
+    @property
+    def num_values(self):
+        return len(self.values)
+
+    def value_index(self, value):
+        """Return the index of `value`, which is either a value or an index."""
+        if value in self.values:
+            return self.values.index(value)
+        if isinstance(value, (int, np.integer)) and 0 <= value < self.num_values:
+            return int(value)
+        raise ValueError('%s is not a value of %s!' % (value, self))
+
+    def __repr__(self):
+        return 'Variable(%s, %s, %s)' % (self.name, self.index, self.values)
+
+
+class Condition(object):
+    """A partial assignment of value indices to state variables.
+
+    As trigger of a factored transition, it selects all joint states that match. As next state outcome,
+    it has to assign a single variable.
+    """
+    # Conditions stand in for states in the DSL, which checks this.
+    terminal_state = False
+
+    def __init__(self, assignment: typing.Dict[Variable, int]):
+        self.assignment = {variable: variable.value_index(value) for variable, value in assignment.items()}
+
+    @property
+    def key(self):
+        return tuple(sorted((variable.index, value) for variable, value in self.assignment.items()))
+
+    def __and__(self, other: 'Condition'):
+        for variable, value in other.assignment.items():
+            if self.assignment.get(variable, value) != value:
+                raise ValueError('%s and %s assign different values to %s!' % (self, other, variable.name))
+        assignment = dict(self.assignment)
+        assignment.update(other.assignment)
+        return Condition(assignment)
+
+    def __repr__(self):
+        return 'Condition(%s)' % ', '.join('%s=%s' % (variable.name, variable.values[value])
+                                           for variable, value in sorted(self.assignment.items(),
+                                                                         key=lambda item: item[0].index))
+
+
+class FactoredMDPSpec(object):
+    """An MDP whose states are all joint values of several state variables.
+
+    Every variable transitions independently given the action and the values of the variables in the
+    conditions of its transitions (its parents): `transition(condition, action, NextState(Condition))`
+    adds weighted next values of a single variable for all joint states matching `condition`. Weights of
+    overlapping conditions add up and are normalized like in `MDPSpec`, and variables without any matching
+    transition keep their value. Rewards of all matching conditions add up.
+
+    Joint states are indexed in C order of the variables (see `state_index`) and start at `start`.
+    """
+
+    def __init__(self):
+        self._variables = {}
+        self._actions = {}
+        self.variables = []
+        self.actions = []
+        self.value_outcomes: typing.Dict[tuple, typing.List[NextState]] = defaultdict(list)
+        self.reward_outcomes: typing.Dict[tuple, typing.List[Reward]] = defaultdict(list)
+        self.terminal_conditions: typing.List[Condition] = []
+        self.start = {}
+        self.discount = 1.0
+
+    def variable(self, name, values):
+        """Add a state variable with `values` (a list of values or their number)."""
+        if isinstance(values, int):
+            values = range(values)
+        if name not in self._variables:
+            new_variable = Variable(name, len(self.variables), values)
+            self._variables[name] = new_variable
+            self.variables.append(new_variable)
+        return self._variables[name]
+
+    def action(self, name=None):
+        if not name:
+            name = 'A%s' % self.num_actions
+
+        if name not in self._actions:
+            new_action = Action(name, self.num_actions)
+            self._actions[name] = new_action
+            self.actions.append(new_action)
+        return self._actions[name]
+
+    def transition(self, condition: Condition, action: Action, outcome: Outcome):
+        """Specify either a weighted next value of a single variable or a reward as `outcome`."""
+        if isinstance(outcome, NextState):
+            next_value = outcome.outcome
+            if not isinstance(next_value, Condition) or len(next_value.assignment) != 1:
+                raise ValueError('%s must assign the next value of a single variable!' % next_value)
+            (variable, value), = next_value.assignment.items()
+            self.value_outcomes[variable, action, condition.key].append(NextState(value, outcome.weight))
+        elif isinstance(outcome, Reward):
+            self.reward_outcomes[action, condition.key].append(outcome)
+        else:
+            raise NotImplementedError()
+
+    def terminal(self, condition: Condition):
+        """Make all joint states that match `condition` terminal."""
+        self.terminal_conditions.append(condition)
+
+    @property
+    def shape(self):
+        return tuple(variable.num_values for variable in self.variables)
+
+    @property
+    def num_states(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def num_actions(self):
+        return len(self.actions)
+
+    def state_index(self, assignment: typing.Dict[Variable, typing.Any]):
+        """Return the joint state index of a full assignment {variable: value}."""
+        values = Condition(assignment).assignment
+        if len(values) != len(self.variables):
+            raise ValueError('%s does not assign all variables!' % assignment)
+        return int(np.ravel_multi_index([values[variable] for variable in self.variables], self.shape))
+
+    def assignment(self, state_index):
+        """Return the {variable: value} assignment of a joint state index."""
+        return {variable: variable.values[value] for variable, value in
+                zip(self.variables, np.unravel_index(state_index, self.shape))}
+
+    def to_env(self):
+        from blackhc.mdp import factored
+
+        return factored.FactoredMDPEnv(self)
+
+    def validate(self):
+        from blackhc.mdp import factored
+
+        factored.CompiledFactoredMDP(self)
+        return self
+
+
 class Transitions(object):
     """Container for transition probabilities."""
 
     def __init__(self, mdp: MDPSpec):
+        with instrumentation.timer('transitions.compile'):
+            self._compile(mdp)
+
+    def _compile(self, mdp: MDPSpec):
         self.next_states = {}
         self.rewards = {}
         for state in mdp.states:
@@ -258,8 +429,11 @@ class Transitions(object):
 class MDPEnv(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array', 'png']}
 
-    def __init__(self, mdp: MDPSpec, start_state: State = None):
+    def __init__(self, mdp: MDPSpec, start_state: State = None, start_distribution=None):
         self.render_widget = None
+        self._graph_renderer = None
+        # Optional `render.GraphView` to render a reduced graph (used by default for large MDPs).
+        self.graph_view = None
 
         self.mdp = mdp
         self.transitions = Transitions(mdp)
@@ -271,12 +445,26 @@ class MDPEnv(gym.Env):
         self.observation_space = gym.spaces.Discrete(self.mdp.num_states)
         self.action_space = gym.spaces.Discrete(self.mdp.num_actions)
         self.start_state = start_state or list(self.mdp.states)[0]
+        # Optional dict from states to probabilities or vector of probabilities that replaces `start_state`.
+        self._start_cumprobs = None
+        if start_distribution is not None:
+            from blackhc.mdp import compiled
+
+            start_distribution = compiled.get_start_distribution(self.mdp.num_states, start_distribution)
+            self._start_cumprobs = np.cumsum(start_distribution)
+            self.start_state = self.mdp.states[int(np.argmax(start_distribution))]
 
     def reset(self):
         self._previous_state = None
         self._previous_action = None
-        self._state = self.start_state
+        if self._start_cumprobs is not None:
+            start_index = np.searchsorted(self._start_cumprobs, np.random.random_sample(), side='right')
+            self._state = self.mdp.states[min(start_index, self.mdp.num_states - 1)]
+        else:
+            self._state = self.start_state
         self._is_done = self._state.terminal_state
+        if instrumentation.enabled:
+            instrumentation.count('env.resets')
         return self._state.index
 
     def step(self, action_index):
@@ -284,6 +472,9 @@ class MDPEnv(gym.Env):
         self._previous_state = self._state
         self._previous_action = action
 
+        if instrumentation.enabled:
+            start_time = time.perf_counter()
+
         if not self._is_done:
             reward_probs = self.transitions.rewards[self._state, action]
             reward = np.random.choice(list(reward_probs.keys()), p=list(reward_probs.values()))
@@ -294,6 +485,10 @@ class MDPEnv(gym.Env):
         else:
             reward = 0
 
+        if instrumentation.enabled:
+            instrumentation.record_time('env.sample', time.perf_counter() - start_time)
+            instrumentation.count('env.steps')
+
         return self._state.index, reward, self._is_done, None
 
     def to_graph(self):
@@ -307,8 +502,7 @@ class MDPEnv(gym.Env):
                 self.render_widget.close()
             return
 
-        png_data = graph_to_png(self.to_graph())
-
+        renderer, highlights = self._render_frame()
         if mode == 'human':
             # TODO: use OpenAI's SimpleImageViewer wrapper when not running in IPython.
             if not self.render_widget:
@@ -318,13 +512,41 @@ class MDPEnv(gym.Env):
                 self.render_widget = widgets.Image()
                 display(self.render_widget)
 
-            self.render_widget.value = png_data
+            self.render_widget.value = renderer.render_png(*highlights)
         elif mode == 'rgb_array':
-            from matplotlib import pyplot
-            import io
-            return pyplot.imread(io.BytesIO(png_data))
+            # The frame buffer is reused across calls.
+            return renderer.render(*highlights)
         elif mode == 'png':
-            return png_data
+            return renderer.render_png(*highlights)
+
+    def _render_frame(self):
+        """Return the renderer and the graph highlights for the current step."""
+        from blackhc.mdp import render
+
+        if not self.graph_view and self.mdp.num_states > render.LARGE_MDP_NUM_STATES:
+            self.graph_view = render.GraphView(self.mdp, radius=2, transitions=self.transitions)
+
+        if self.graph_view:
+            renderer = self.graph_view.renderer(self._state or self.start_state)
+            highlights = self.graph_view.graph_highlights(highlight_state=self._previous_state,
+                                                          highlight_action=self._previous_action,
+                                                          highlight_next_state=self._state)
+            return renderer, highlights
+        return self.graph_renderer, self._graph_highlights()
+
+    @property
+    def graph_renderer(self):
+        """Renderer for the graph of the MDP. Graphviz only lays the graph out once."""
+        if not self._graph_renderer:
+            from blackhc.mdp import render
+            self._graph_renderer = render.GraphRenderer(render.GraphLayout.from_graph(self.mdp.to_graph()))
+        return self._graph_renderer
+
+    def _graph_highlights(self):
+        return self.mdp.graph_highlights(highlight_state=self._previous_state,
+                                         highlight_action=self._previous_action,
+                                         highlight_next_state=self._state,
+                                         transitions=self.transitions)
 
 
 def graph_to_png(graph):
@@ -0,0 +1,117 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reference tabular agents for validating learners against exact Q-tables.
+
+The agents are updated with a whole batch of transitions at once from a `compiled.BatchEnv`.
+"""
+import abc
+
+import numpy as np
+
+from blackhc.mdp import compiled
+
+
+class TabularAgent(abc.ABC):
+    """Epsilon-greedy tabular agent; subclasses define the bootstrap values in `next_values`.
+
+    With `learning_rate=None`, the learning rate is 1 / number of visits of (state, action).
+    Ties between greedy actions are broken uniformly at random.
+    """
+
+    def __init__(self, num_states, num_actions, discount, learning_rate=None, epsilon=0.1, random_state=None):
+        self.discount = discount
+        self.learning_rate = learning_rate
+        self.epsilon = epsilon
+        self.random_state = compiled.get_random_state(random_state)
+        self.q_table = np.zeros((num_states, num_actions))
+        self.visits = np.zeros((num_states, num_actions), dtype=np.int64)
+
+    def _greedy_mask(self, states):
+        q_values = self.q_table[states]
+        return q_values == q_values.max(axis=-1, keepdims=True)
+
+    def act(self, states):
+        greedy_mask = self._greedy_mask(states)
+        greedy_actions = np.where(greedy_mask, self.random_state.random_sample(greedy_mask.shape), -1.).argmax(axis=-1)
+        random_actions = self.random_state.randint(self.q_table.shape[1], size=len(states))
+        explore = self.random_state.random_sample(len(states)) < self.epsilon
+        return np.where(explore, random_actions, greedy_actions)
+
+    def policy(self, states):
+        """Return the epsilon-greedy action probabilities of `states` that `act` samples from."""
+        num_actions = self.q_table.shape[1]
+        greedy_mask = self._greedy_mask(states)
+        return self.epsilon / num_actions + (1. - self.epsilon) * greedy_mask / greedy_mask.sum(axis=-1, keepdims=True)
+
+    @abc.abstractmethod
+    def next_values(self, next_states, next_actions):
+        """Return the values to bootstrap from after (next state, next action)."""
+
+    def update(self, states, actions, rewards, next_states, dones, next_actions):
+        targets = rewards + self.discount * np.where(dones, 0., self.next_values(next_states, next_actions))
+        td_errors = targets - self.q_table[states, actions]
+
+        # Duplicate (state, action) pairs in a batch are averaged into a single update.
+        pairs = np.asarray(states) * self.q_table.shape[1] + np.asarray(actions)
+        counts = np.bincount(pairs, minlength=self.q_table.size)
+        updated = np.flatnonzero(counts)
+        mean_td_errors = np.bincount(pairs, td_errors, minlength=self.q_table.size)[updated] / counts[updated]
+
+        visits = self.visits.reshape(-1)
+        visits[updated] += counts[updated]
+        if self.learning_rate is None:
+            # The sample average over all visits, including the ones in this batch.
+            learning_rates = counts[updated] / visits[updated]
+        else:
+            learning_rates = self.learning_rate
+        self.q_table.reshape(-1)[updated] += learning_rates * mean_td_errors
+
+
+class QLearning(TabularAgent):
+    def next_values(self, next_states, next_actions):
+        return self.q_table[next_states].max(axis=-1)
+
+
+class Sarsa(TabularAgent):
+    def next_values(self, next_states, next_actions):
+        return self.q_table[next_states, next_actions]
+
+
+class ExpectedSarsa(TabularAgent):
+    def next_values(self, next_states, next_actions):
+        return (self.policy(next_states) * self.q_table[next_states]).sum(axis=-1)
+
+
+def train(agent: TabularAgent, env: compiled.BatchEnv, num_steps, exact_q_table=None, report_every=100):
+    """Train `agent` for `num_steps` batched steps.
+
+    Returns a list of (step, max-norm distance to `exact_q_table`) every `report_every` steps,
+    or an empty list if `exact_q_table` is None.
+    """
+    distances = []
+    states = env.reset()
+    actions = agent.act(states)
+    for step in range(1, num_steps + 1):
+        next_states, rewards, dones = env.step(actions)
+        next_actions = agent.act(next_states)
+        agent.update(states, actions, rewards, next_states, dones, next_actions)
+
+        states = env.states
+        if dones.any():
+            next_actions[dones] = agent.act(states[dones])
+        actions = next_actions
+
+        if exact_q_table is not None and step % report_every == 0:
+            distances.append((step, np.abs(agent.q_table - exact_q_table).max()))
+    return distances
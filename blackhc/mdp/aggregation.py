@@ -0,0 +1,115 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""State aggregation by probabilistic bisimulation minimization."""
+import numpy as np
+import scipy.sparse
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+
+
+class Aggregation(object):
+    """A minimized MDP and the mapping from the original states to its states."""
+
+    def __init__(self, mdp_spec: mdp.MDPSpec, state_mapping):
+        self.mdp_spec = mdp_spec
+        # state_mapping[original state index] = aggregated state index
+        self.state_mapping = state_mapping
+
+    def lift(self, values):
+        """Map a V vector or Q-table of the aggregated MDP back to the original states."""
+        return np.asarray(values)[self.state_mapping]
+
+
+def minimize(mdp_spec, decimals=9) -> Aggregation:
+    """Merge bisimilar states by partition refinement.
+
+    Two states are bisimilar if they are both terminal or both not, have the same reward distribution for
+    every action, and move with the same probability into every block of bisimilar states for every action.
+    Probabilities and rewards are compared after rounding to `decimals`.
+    """
+    compiled_mdp = compiled.compile_mdp(mdp_spec)
+    num_states, num_actions = compiled_mdp.num_states, compiled_mdp.num_actions
+    transition_matrix = compiled_mdp.transition_matrix()
+
+    reward_signatures = []
+    for state in range(num_states):
+        signature = [compiled_mdp.terminal_states[state]]
+        for row in range(state * num_actions, (state + 1) * num_actions):
+            entries = slice(compiled_mdp.reward_indptr[row], compiled_mdp.reward_indptr[row + 1])
+            signature.append(tuple(sorted(zip(np.round(compiled_mdp.reward_values[entries], decimals),
+                                              np.round(compiled_mdp.reward_probs[entries], decimals)))))
+        reward_signatures.append(tuple(signature))
+    blocks = _relabel(reward_signatures)
+
+    while True:
+        num_blocks = blocks.max() + 1
+        block_matrix = scipy.sparse.csr_matrix((np.ones(num_states), (np.arange(num_states), blocks)),
+                                               shape=(num_states, num_blocks))
+        block_probs = (transition_matrix @ block_matrix).tocsr()
+        block_probs.data = np.round(block_probs.data, decimals)
+        block_probs.eliminate_zeros()
+        block_probs.sort_indices()
+
+        signatures = []
+        for state in range(num_states):
+            signature = [blocks[state]]
+            for row in range(state * num_actions, (state + 1) * num_actions):
+                entries = slice(block_probs.indptr[row], block_probs.indptr[row + 1])
+                signature.append((tuple(block_probs.indices[entries]), tuple(block_probs.data[entries])))
+            signatures.append(tuple(signature))
+        new_blocks = _relabel(signatures)
+        if new_blocks.max() + 1 == num_blocks:
+            break
+        blocks = new_blocks
+
+    return Aggregation(_quotient_spec(compiled_mdp, blocks, block_probs), blocks)
+
+
+def _relabel(signatures):
+    """Number the distinct signatures in order of first occurrence."""
+    labels = {}
+    return np.array([labels.setdefault(signature, len(labels)) for signature in signatures], dtype=np.int64)
+
+
+def _quotient_spec(compiled_mdp: compiled.CompiledMDP, blocks, block_probs):
+    original_spec = compiled_mdp.mdp_spec
+    num_blocks = blocks.max() + 1
+    representatives = np.full(num_blocks, -1, dtype=np.int64)
+    for state in reversed(range(len(blocks))):
+        representatives[blocks[state]] = state
+
+    spec = mdp.MDPSpec()
+    spec.discount = original_spec.discount
+    block_sizes = np.bincount(blocks, minlength=num_blocks)
+    states = []
+    for block, representative in enumerate(representatives):
+        name = original_spec.states[representative].name
+        if block_sizes[block] > 1:
+            name = '%s+%s' % (name, block_sizes[block] - 1)
+        states.append(spec.state(name, terminal_state=bool(compiled_mdp.terminal_states[representative])))
+    actions = [spec.action(action.name) for action in original_spec.actions]
+
+    for block, representative in enumerate(representatives):
+        if compiled_mdp.terminal_states[representative]:
+            continue
+        for action in actions:
+            row = representative * compiled_mdp.num_actions + action.index
+            for entry in range(block_probs.indptr[row], block_probs.indptr[row + 1]):
+                spec.transition(states[block], action,
+                                mdp.NextState(states[block_probs.indices[entry]], block_probs.data[entry]))
+            for entry in range(compiled_mdp.reward_indptr[row], compiled_mdp.reward_indptr[row + 1]):
+                spec.transition(states[block], action,
+                                mdp.Reward(compiled_mdp.reward_values[entry], compiled_mdp.reward_probs[entry]))
+    return spec
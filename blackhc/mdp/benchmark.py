@@ -0,0 +1,147 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Solver and environment benchmarks on synthetic MDPs.
+
+Run with `python -m blackhc.mdp.benchmark --output report.json` to write a JSON report
+that can be compared across releases.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+
+DEFAULT_CONFIGS = [
+    dict(generator='random_mdp', num_states=100, num_actions=4, branching=4, seed=0),
+    dict(generator='random_mdp', num_states=1000, num_actions=4, branching=4, seed=0),
+    dict(generator='gridworld', width=10, height=10),
+    dict(generator='gridworld', width=30, height=30),
+    dict(generator='chain', num_states=100),
+    dict(generator='chain', num_states=1000),
+]
+
+
+def _measure(function, trace_memory=True):
+    """Return the result, the wall-clock seconds and the peak traced memory in bytes of `function()`.
+
+    Tracing slows down allocations, so the peak memory is measured in a separate run before the timed
+    run (and is None without `trace_memory`). The result is the one of the timed run.
+    """
+    peak_bytes = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            function()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    return result, seconds, peak_bytes
+
+
+def run_benchmark(config, num_env_steps=10000, num_batch_envs=1000, max_iterations=1000, seed=0):
+    """Benchmark one generator config and return a dict of results."""
+    config = dict(config)
+    generator = getattr(generators, config.pop('generator'))
+    spec, spec_seconds, spec_bytes = _measure(lambda: generator(**config))
+    result = dict(num_states=spec.num_states, num_actions=spec.num_actions,
+                  spec_seconds=spec_seconds, spec_peak_bytes=spec_bytes)
+
+    _, result['transitions_seconds'], result['transitions_peak_bytes'] = _measure(lambda: mdp.Transitions(spec))
+    compiled_mdp, result['compile_seconds'], result['compile_peak_bytes'] = _measure(
+        lambda: compiled.CompiledMDP(spec))
+
+    solver, result['lp_init_seconds'], result['lp_init_peak_bytes'] = _measure(
+        lambda: lp.LinearProgramming(compiled_mdp))
+    try:
+        (_, info), result['solve_seconds'], result['solve_peak_bytes'] = _measure(
+            lambda: solver.compute_v_vector(max_iterations=max_iterations, full_output=True))
+        result['solve_converged'] = True
+        result['solve_iterations'] = info.iterations
+    except ValueError:
+        result['solve_converged'] = False
+        result['solve_iterations'] = max_iterations
+
+    np.random.seed(seed)
+    env = mdp.MDPEnv(spec)
+    actions = np.random.randint(spec.num_actions, size=num_env_steps)
+
+    def step_env():
+        env.reset()
+        for action in actions:
+            _, _, is_done, _ = env.step(action)
+            if is_done:
+                env.reset()
+
+    _, seconds, _ = _measure(step_env, trace_memory=False)
+    result['env_steps_per_second'] = num_env_steps / seconds
+
+    batch_env = compiled.BatchEnv(compiled_mdp, num_batch_envs, random_state=seed)
+    batch_actions = np.random.randint(spec.num_actions, size=(num_env_steps // 100, num_batch_envs))
+
+    def step_batch_env():
+        batch_env.reset()
+        for step_actions in batch_actions:
+            batch_env.step(step_actions)
+
+    _, seconds, _ = _measure(step_batch_env, trace_memory=False)
+    result['batch_env_steps_per_second'] = batch_actions.size / seconds
+    return result
+
+
+def run_benchmarks(configs=None, **kwargs):
+    """Benchmark all `configs` and return a machine-readable report."""
+    from blackhc.mdp import __version__
+
+    results = []
+    for config in configs or DEFAULT_CONFIGS:
+        result = dict(config=config)
+        result.update(run_benchmark(config, **kwargs))
+        results.append(result)
+    return dict(version=__version__, python=platform.python_version(), numpy=np.__version__,
+                platform=platform.platform(), results=results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help='JSON report file (default: stdout)')
+    parser.add_argument('--config', action='append', type=json.loads,
+                        help='Generator config as JSON, e.g. \'{"generator": "chain", "num_states": 10}\'. '
+                             'Can be repeated. Defaults to a built-in set.')
+    parser.add_argument('--env-steps', type=int, default=10000)
+    parser.add_argument('--batch-envs', type=int, default=1000)
+    parser.add_argument('--max-iterations', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.config, num_env_steps=args.env_steps, num_batch_envs=args.batch_envs,
+                            max_iterations=args.max_iterations)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compiled array representation of MDPs.
+
+Transitions are stored per (state, action) row in CSR form, with row index
+`state * num_actions + action`. Terminal states are compiled into absorbing
+self-loops without reward, like in `lp.LinearProgramming`.
+"""
+import json
+import os
+
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import instrumentation
+
+
+class _GlobalRandomState(object):
+    """Forwards RandomState methods to the `np.random` functions, which use numpy's global state."""
+
+    def __getattr__(self, name):
+        return getattr(np.random, name)
+
+
+_GLOBAL_RANDOM_STATE = _GlobalRandomState()
+
+
+def get_random_state(seed=None) -> np.random.RandomState:
+    """Turn `seed` (None, an int or a RandomState) into a RandomState.
+
+    None returns a stand-in that samples with the `np.random` functions, so `np.random.seed` applies.
+    """
+    if seed is None:
+        return _GLOBAL_RANDOM_STATE
+    if isinstance(seed, (np.random.RandomState, _GlobalRandomState)):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def get_start_distribution(num_states, start=None):
+    """Turn `start` into a vector of start state probabilities.
+
+    `start` is None (the first state), a state or state index, a dict from states or state indices
+    to probabilities, or a vector of probabilities.
+    """
+    if start is None:
+        start = 0
+    if isinstance(start, mdp.State):
+        start = start.index
+    if isinstance(start, dict):
+        distribution = np.zeros(num_states)
+        for state, prob in start.items():
+            distribution[state.index if isinstance(state, mdp.State) else state] += prob
+    elif np.ndim(start) == 0:
+        distribution = np.zeros(num_states)
+        distribution[start] = 1.
+    else:
+        distribution = np.asarray(start, dtype=np.float64)
+    if distribution.shape != (num_states,) or np.any(distribution < 0) or not np.isclose(distribution.sum(), 1.):
+        raise ValueError('Invalid start distribution %s!' % (start,))
+    return distribution
+
+
+def compile_mdp(mdp_spec) -> 'CompiledMDP':
+    """Return `mdp_spec` compiled, or as is if it is compiled already."""
+    from blackhc.mdp import implicit
+
+    if isinstance(mdp_spec, CompiledMDP):
+        return mdp_spec
+    if isinstance(mdp_spec, implicit.ImplicitMDP):
+        return mdp_spec.compile()
+    return CompiledMDP(mdp_spec)
+
+
+class CompiledMDP(object):
+    def __init__(self, mdp_spec: mdp.MDPSpec):
+        with instrumentation.timer('compiled.compile'):
+            self._compile(mdp_spec)
+
+    def _compile(self, mdp_spec: mdp.MDPSpec):
+        self.mdp_spec = mdp_spec
+        self.discount = mdp_spec.discount
+        self.num_states = mdp_spec.num_states
+        self.num_actions = mdp_spec.num_actions
+
+        transitions = mdp.Transitions(mdp_spec)
+        self.terminal_states = np.array([state.terminal_state for state in mdp_spec.states], dtype=bool)
+
+        next_state_rows = []
+        reward_rows = []
+        for state in mdp_spec.states:
+            for action in mdp_spec.actions:
+                if state.terminal_state:
+                    next_state_rows.append({state.index: 1.})
+                    reward_rows.append({0.: 1.})
+                else:
+                    next_state_rows.append({next_state.index: prob for next_state, prob in
+                                            transitions.next_states[state, action].items()})
+                    reward_rows.append(transitions.rewards[state, action])
+
+        self._build(next_state_rows, reward_rows)
+
+    @classmethod
+    def from_rows(cls, mdp_spec, num_states, num_actions, discount, terminal_states, next_state_rows, reward_rows):
+        """Compile per-row {next state index: prob} and {reward: prob} dicts of another MDP type.
+
+        Terminal states need absorbing self-loop rows without reward.
+        """
+        compiled_mdp = cls.__new__(cls)
+        with instrumentation.timer('compiled.compile'):
+            compiled_mdp.mdp_spec = mdp_spec
+            compiled_mdp.discount = discount
+            compiled_mdp.num_states = num_states
+            compiled_mdp.num_actions = num_actions
+            compiled_mdp.terminal_states = np.asarray(terminal_states, dtype=bool)
+            compiled_mdp._build(next_state_rows, reward_rows)
+        return compiled_mdp
+
+    def _build(self, next_state_rows, reward_rows):
+        self.next_state_indptr, self.next_state_indices, self.next_state_probs = _to_csr(next_state_rows, np.int64)
+        self.reward_indptr, self.reward_values, self.reward_probs = _to_csr(reward_rows, np.float64)
+
+        self.next_state_cumprobs = _row_cumsum(self.next_state_indptr, self.next_state_probs)
+        self.reward_cumprobs = _row_cumsum(self.reward_indptr, self.reward_probs)
+
+        self.expected_rewards = _row_sum(self.reward_indptr, self.reward_values * self.reward_probs).reshape(
+            (self.num_states, self.num_actions))
+
+    @property
+    def num_rows(self):
+        return self.num_states * self.num_actions
+
+    def rows(self, states, actions):
+        """Return the CSR row indices of (state, action) index pairs."""
+        return np.asarray(states) * self.num_actions + np.asarray(actions)
+
+    def transition_matrix(self):
+        """Return the transition probabilities as sparse (num_states * num_actions, num_states) CSR matrix."""
+        import scipy.sparse
+
+        return scipy.sparse.csr_matrix((self.next_state_probs, self.next_state_indices, self.next_state_indptr),
+                                       shape=(self.num_rows, self.num_states))
+
+    def policy_matrix(self, policy):
+        """Return the sparse (num_states, num_states * num_actions) matrix that averages rows under `policy`.
+
+        `policy` is either a (num_states, num_actions) matrix of action probabilities
+        or a vector of action indices for a deterministic policy.
+        """
+        import scipy.sparse
+
+        policy = np.asarray(policy)
+        if policy.ndim == 1:
+            policy = np.eye(self.num_actions)[policy]
+        if policy.shape != (self.num_states, self.num_actions):
+            raise ValueError('Policy shape %s does not match (%s, %s)!' % (policy.shape, self.num_states,
+                                                                             self.num_actions))
+        return scipy.sparse.csr_matrix((policy.ravel(), np.arange(self.num_rows),
+                                        np.arange(0, self.num_rows + 1, self.num_actions)),
+                                       shape=(self.num_states, self.num_rows))
+
+    def sample_next_states(self, rows, uniforms):
+        """Inverse transform sampling of next states for CSR `rows` given uniforms in [0, 1)."""
+        return self.next_state_indices[_sample_entries(self.next_state_indptr, self.next_state_cumprobs, rows,
+                                                       uniforms)]
+
+    def sample_rewards(self, rows, uniforms):
+        return self.reward_values[_sample_entries(self.reward_indptr, self.reward_cumprobs, rows, uniforms)]
+
+    def sample(self, states, actions, n=1, random_state=None):
+        """Sample next states and rewards for (state, action) index pairs as a generative model.
+
+        `states` and `actions` are broadcast together. With n > 1, n independent samples are drawn per pair
+        along a new last axis. Returns (next states, rewards).
+        """
+        random_state = get_random_state(random_state)
+        rows = self.rows(states, actions)
+        if n != 1:
+            rows = np.repeat(rows[..., np.newaxis], n, axis=-1)
+        rewards = self.sample_rewards(rows, random_state.random_sample(rows.shape))
+        next_states = self.sample_next_states(rows, random_state.random_sample(rows.shape))
+        return next_states, rewards
+
+
+def _to_csr(rows, index_dtype):
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((key for row in rows for key in row), dtype=index_dtype, count=indptr[-1])
+    values = np.fromiter((value for row in rows for value in row.values()), dtype=np.float64, count=indptr[-1])
+    return indptr, indices, values
+
+
+def _row_sum(indptr, values):
+    sums = np.zeros(len(indptr) - 1)
+    np.add.at(sums, np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), values)
+    return sums
+
+
+def _row_cumsum(indptr, probs):
+    """Cumulative probabilities within each row, offset by the row index.
+
+    Entry i of row r gets r + P(entry <= i), and the last entry of each row is exactly r + 1.
+    This makes the whole array sorted, so all rows can be sampled with a single `searchsorted`.
+    """
+    row_ids = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    cumprobs = np.cumsum(probs)
+    row_starts = np.concatenate([[0.], cumprobs[indptr[1:-1] - 1]])
+    cumprobs = cumprobs - row_starts[row_ids]
+    cumprobs[indptr[1:] - 1] = 1.
+    return row_ids + np.minimum(cumprobs, 1.)
+
+
+def _sample_entries(indptr, cumprobs, rows, uniforms):
+    entries = np.searchsorted(cumprobs, rows + uniforms, side='right')
+    return np.minimum(entries, indptr[rows + 1] - 1)
+
+
+class BatchEnv(object):
+    """A batch of independent copies of an MDP stepped together on a `CompiledMDP`.
+
+    Episodes that reach a terminal state are reset to the start state automatically.
+    """
+
+    def __init__(self, compiled_mdp: CompiledMDP, num_envs, start_state=0, random_state=None,
+                 start_distribution=None):
+        self.compiled_mdp = compiled_mdp
+        self.num_envs = num_envs
+        self.start_state = start_state
+        self.random_state = get_random_state(random_state)
+        # Optional vector of start state probabilities that replaces `start_state`.
+        self.start_cumprobs = None
+        if start_distribution is not None:
+            self.start_cumprobs = np.cumsum(get_start_distribution(compiled_mdp.num_states, start_distribution))
+        self.states = np.full(num_envs, start_state, dtype=np.int64)
+
+    def _sample_start_states(self, num_envs):
+        if self.start_cumprobs is None:
+            return self.start_state
+        start_states = np.searchsorted(self.start_cumprobs, self.random_state.random_sample(num_envs), side='right')
+        return np.minimum(start_states, self.compiled_mdp.num_states - 1)
+
+    def reset(self):
+        self.states[:] = self._sample_start_states(self.num_envs)
+        return self.states.copy()
+
+    def step(self, actions):
+        """Step every env and return (next states, rewards, dones).
+
+        Done envs are reset afterwards, so `states` can differ from the returned next states.
+        """
+        next_states, rewards = self.compiled_mdp.sample(self.states, actions, random_state=self.random_state)
+        dones = self.compiled_mdp.terminal_states[next_states]
+
+        self.states = next_states.copy()
+        self.states[dones] = self._sample_start_states(np.count_nonzero(dones))
+        if instrumentation.enabled:
+            instrumentation.count('batch_env.steps', self.num_envs)
+        return next_states, rewards, dones
+
+
+class TransitionWriter(object):
+    """Write the CSR transition rows of an MDP to `directory` block by block, for `MemmappedTransitions`.
+
+    Rows have to be written in order (row index `state * num_actions + action`) and terminal states have
+    to be written as absorbing self-loops without reward, like `CompiledMDP` does. Only the rows passed
+    to a single `write_rows` call are held in memory.
+    """
+
+    def __init__(self, directory, num_states, num_actions, discount):
+        self.directory = directory
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.discount = discount
+        self.num_rows_written = 0
+        self.num_entries_written = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._files = {name: open(os.path.join(directory, '%s.bin' % name), 'wb')
+                       for name in MemmappedTransitions.ARRAYS}
+        np.zeros(1, dtype=np.int64).tofile(self._files['indptr'])
+
+    def write_rows(self, row_lengths, next_states, probs, expected_rewards):
+        """Append consecutive rows with `row_lengths[i]` entries each and their expected rewards."""
+        row_lengths = np.asarray(row_lengths, dtype=np.int64)
+        next_states = np.asarray(next_states, dtype=np.int64)
+        probs = np.asarray(probs, dtype=np.float64)
+        expected_rewards = np.asarray(expected_rewards, dtype=np.float64)
+        if not len(row_lengths) == len(expected_rewards) or not row_lengths.sum() == len(next_states) == len(probs):
+            raise ValueError('Row lengths, entries and rewards do not match!')
+        if self.num_rows_written + len(row_lengths) > self.num_states * self.num_actions:
+            raise ValueError('More than %s rows!' % (self.num_states * self.num_actions))
+
+        (self.num_entries_written + np.cumsum(row_lengths)).tofile(self._files['indptr'])
+        next_states.tofile(self._files['indices'])
+        probs.tofile(self._files['probs'])
+        expected_rewards.tofile(self._files['rewards'])
+        self.num_rows_written += len(row_lengths)
+        self.num_entries_written += len(next_states)
+
+    def close(self):
+        """Close the files and write the metadata, which marks the directory as complete."""
+        for file in self._files.values():
+            file.close()
+        if self.num_rows_written != self.num_states * self.num_actions:
+            raise ValueError('Only %s of %s rows written!' % (self.num_rows_written,
+                                                              self.num_states * self.num_actions))
+        with open(os.path.join(self.directory, MemmappedTransitions.METADATA), 'w') as metadata:
+            json.dump(dict(num_states=self.num_states, num_actions=self.num_actions, discount=self.discount,
+                           num_entries=self.num_entries_written), metadata)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self._files.values():
+                file.close()
+
+
+def save_transitions(compiled_mdp: CompiledMDP, directory):
+    """Write the transition rows and expected rewards of `compiled_mdp` for `MemmappedTransitions`."""
+    with TransitionWriter(directory, compiled_mdp.num_states, compiled_mdp.num_actions,
+                          compiled_mdp.discount) as writer:
+        writer.write_rows(np.diff(compiled_mdp.next_state_indptr), compiled_mdp.next_state_indices,
+                          compiled_mdp.next_state_probs, compiled_mdp.expected_rewards.ravel())
+
+
+class MemmappedTransitions(object):
+    """Read-only, memory-mapped CSR transition rows and expected rewards written by `TransitionWriter`.
+
+    The arrays are paged in by the OS on access, so only the blocks that are in use take up memory.
+    """
+    ARRAYS = ('indptr', 'indices', 'probs', 'rewards')
+    METADATA = 'metadata.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, self.METADATA)) as metadata:
+            metadata = json.load(metadata)
+        self.num_states = metadata['num_states']
+        self.num_actions = metadata['num_actions']
+        self.discount = metadata['discount']
+        self.num_entries = metadata['num_entries']
+
+        def memmap(name, dtype, length):
+            if not length:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(os.path.join(directory, '%s.bin' % name), dtype=dtype, mode='r', shape=(length,))
+
+        self.indptr = memmap('indptr', np.int64, self.num_rows + 1)
+        self.indices = memmap('indices', np.int64, self.num_entries)
+        self.probs = memmap('probs', np.float64, self.num_entries)
+        self.expected_rewards = memmap('rewards', np.float64, self.num_rows)
+
+    @property
+    def num_rows(self):
+        return self.num_states * self.num_actions
+
+    def block(self, start_state, stop_state):
+        """Return the transitions of the states in [start_state, stop_state) as (CSR matrix, expected rewards).
+
+        The matrix has shape ((stop_state - start_state) * num_actions, num_states) and the rewards have shape
+        (stop_state - start_state, num_actions).
+        """
+        import scipy.sparse
+
+        rows = slice(start_state * self.num_actions, stop_state * self.num_actions + 1)
+        indptr = np.asarray(self.indptr[rows])
+        entries = slice(indptr[0], indptr[-1])
+        matrix = scipy.sparse.csr_matrix((np.asarray(self.probs[entries]), np.asarray(self.indices[entries]),
+                                          indptr - indptr[0]),
+                                         shape=(len(indptr) - 1, self.num_states))
+        return matrix, np.asarray(self.expected_rewards[rows.start:rows.stop - 1]).reshape((-1, self.num_actions))
@@ -0,0 +1,149 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Exact return distributions and return variances of fixed policies."""
+import collections
+
+import numpy as np
+
+from blackhc.mdp import compiled
+from blackhc.mdp import lp
+
+
+class CategoricalEvaluation(object):
+    """Distributional dynamic programming with categorical return distributions on a fixed support.
+
+    Iterates Z(s, a) = R(s, a) + discount * Z(S', A') with A' ~ policy(S') and projects the targets back
+    onto `num_atoms` evenly spaced atoms between `v_min` and `v_max` (the C51 projection, which keeps
+    the mean within the support). Terminal states have the return 0.
+
+    `policy` is a (num_states, num_actions) matrix of action probabilities or a vector of action indices.
+    The support defaults to the range of discounted returns given by the reward range; it has to be
+    given explicitly for discount 1.
+    """
+
+    def __init__(self, mdp_spec, policy, num_atoms=51, v_min=None, v_max=None):
+        self.compiled_mdp = compiled.compile_mdp(mdp_spec)
+        compiled_mdp = self.compiled_mdp
+        self.discount = compiled_mdp.discount
+        self.num_states = compiled_mdp.num_states
+        self.num_actions = compiled_mdp.num_actions
+        self.num_atoms = num_atoms
+        self.policy_matrix = compiled_mdp.policy_matrix(policy)
+        self.transition_matrix = compiled_mdp.transition_matrix()
+
+        if v_min is None or v_max is None:
+            if self.discount >= 1.:
+                raise ValueError('v_min and v_max are required for discount 1!')
+            reward_min = min(compiled_mdp.reward_values.min(initial=0.), 0.)
+            reward_max = max(compiled_mdp.reward_values.max(initial=0.), 0.)
+            v_min = reward_min / (1. - self.discount) if v_min is None else v_min
+            v_max = reward_max / (1. - self.discount) if v_max is None else v_max
+        if v_max <= v_min:
+            v_max = v_min + 1.
+        self.atoms = np.linspace(v_min, v_max, num_atoms)
+
+        # The projection only depends on the rewards and the atoms, so it is computed once:
+        # the mass of atom j of reward entry e moves to the atoms below and above r_e + discount * z_j.
+        reward_rows = np.repeat(np.arange(compiled_mdp.num_rows), np.diff(compiled_mdp.reward_indptr))
+        self._reward_rows = reward_rows
+        self._reward_probs = compiled_mdp.reward_probs[:, np.newaxis]
+        positions = self._positions(compiled_mdp.reward_values[:, np.newaxis] + self.discount * self.atoms)
+        lower = np.floor(positions).astype(np.int64)
+        self._upper_weights = positions - lower
+        self._lower_indices = (reward_rows[:, np.newaxis] * num_atoms + lower).ravel()
+        self._upper_indices = (reward_rows[:, np.newaxis] * num_atoms +
+                               np.minimum(lower + 1, num_atoms - 1)).ravel()
+
+        self._zero_distribution = np.zeros(num_atoms)
+        zero_position = self._positions(0.)
+        self._zero_distribution[int(np.floor(zero_position))] += 1. - (zero_position - np.floor(zero_position))
+        self._zero_distribution[min(int(np.floor(zero_position)) + 1, num_atoms - 1)] += \
+            zero_position - np.floor(zero_position)
+
+    def _positions(self, values):
+        return np.clip((values - self.atoms[0]) / (self.atoms[1] - self.atoms[0]), 0, self.num_atoms - 1)
+
+    def _backup(self, q_distributions):
+        next_distributions = self.transition_matrix @ (self.policy_matrix @ q_distributions.reshape(
+            (-1, self.num_atoms)))
+        masses = (self._reward_probs * next_distributions[self._reward_rows]).ravel()
+        size = self.compiled_mdp.num_rows * self.num_atoms
+        upper_weights = self._upper_weights.ravel()
+        new_distributions = (np.bincount(self._lower_indices, masses * (1. - upper_weights), minlength=size) +
+                             np.bincount(self._upper_indices, masses * upper_weights, minlength=size))
+        new_distributions = new_distributions.reshape((self.num_states, self.num_actions, self.num_atoms))
+        new_distributions[self.compiled_mdp.terminal_states] = self._zero_distribution
+        return new_distributions
+
+    def compute_q_distributions(self, max_iterations=1000, all_close=None, callback=None, time_budget=None,
+                                target_residual=None, full_output=False):
+        """Return the (num_states, num_actions, num_atoms) probabilities of the atoms.
+
+        See `LinearProgramming.compute_q_table` for the arguments.
+        """
+        initial = np.tile(self._zero_distribution, (self.num_states, self.num_actions, 1))
+        distributions, info = lp.fix_point_iterate(initial, self._backup, max_iterations=max_iterations,
+                                                   all_close=all_close, callback=callback,
+                                                   time_budget=time_budget, target_residual=target_residual)
+        if full_output:
+            return distributions, info
+        return distributions
+
+    def v_distributions_from_q_distributions(self, q_distributions):
+        """Average the Q distributions under the policy."""
+        return (self.policy_matrix @ q_distributions.reshape((-1, self.num_atoms))).reshape(
+            (self.num_states, self.num_atoms))
+
+    def mean(self, distributions):
+        return distributions @ self.atoms
+
+    def variance(self, distributions):
+        return distributions @ self.atoms ** 2 - self.mean(distributions) ** 2
+
+
+ReturnMoments = collections.namedtuple('ReturnMoments', ['v_mean', 'v_variance', 'q_mean', 'q_variance'])
+
+
+def compute_return_moments(mdp_spec, policy) -> ReturnMoments:
+    """Compute the exact means and variances of the returns of `policy` for all states and state-actions.
+
+    Rewards and next states are independent given (s, a), so the second moments satisfy the Bellman equation
+    M(s, a) = E[R^2] + 2 discount E[R] E[V(S')] + discount^2 E[M(S')], which is solved like `lp.evaluate_policy`.
+    """
+    compiled_mdp = compiled.compile_mdp(mdp_spec)
+    discount = compiled_mdp.discount
+    shape = (compiled_mdp.num_states, compiled_mdp.num_actions)
+    policy_matrix = compiled_mdp.policy_matrix(policy)
+    transition_matrix = compiled_mdp.transition_matrix()
+
+    v_mean = lp.evaluate_policy(compiled_mdp, policy)
+    next_v_mean = transition_matrix @ v_mean
+    reward_means = compiled_mdp.expected_rewards.ravel()
+    reward_rows = np.repeat(np.arange(compiled_mdp.num_rows), np.diff(compiled_mdp.reward_indptr))
+    reward_second_moments = np.bincount(reward_rows, compiled_mdp.reward_probs * compiled_mdp.reward_values ** 2,
+                                        minlength=compiled_mdp.num_rows)
+    immediate_second_moments = reward_second_moments + 2 * discount * reward_means * next_v_mean
+
+    v_second_moments = np.zeros(compiled_mdp.num_states)
+    transient = np.flatnonzero(~compiled_mdp.terminal_states)
+    if len(transient):
+        policy_transitions = (policy_matrix @ transition_matrix).tocsr()
+        v_second_moments[transient] = lp.solve_transient(policy_transitions[transient][:, transient],
+                                                         (policy_matrix @ immediate_second_moments)[transient],
+                                                         discount ** 2)
+    q_second_moments = immediate_second_moments + discount ** 2 * (transition_matrix @ v_second_moments)
+
+    q_mean = (reward_means + discount * next_v_mean).reshape(shape)
+    return ReturnMoments(v_mean, np.maximum(v_second_moments - v_mean ** 2, 0.),
+                         q_mean, np.maximum(q_second_moments.reshape(shape) - q_mean ** 2, 0.))
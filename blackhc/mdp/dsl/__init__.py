@@ -37,6 +37,22 @@ def action(name=None):
     return ast.Action(new_action)
 
 
+def variable(name, values):
+    """Add a state variable with `values` (a list of values or their number) to a factored MDP."""
+    new_variable = dsl_context.mdp_spec.variable(name, values)
+    return ast.Variable(new_variable)
+
+
+def terminal(condition: ast.Condition):
+    """Make the states of a factored MDP that match `condition` terminal."""
+    dsl_context.mdp_spec.terminal(condition.state)
+
+
+def start(condition: ast.Condition):
+    """Set the start values of a factored MDP; unassigned variables start with their first value."""
+    dsl_context.mdp_spec.start = dict(condition.state.assignment)
+
+
 def reward(value):
     return ast.Reward(mdp.Reward(value))
 
@@ -58,3 +74,12 @@ def new():
     dsl_context.mdp_spec = mdp.MDPSpec()
     yield dsl_context.mdp_spec
     dsl_context.mdp_spec = old_context
+
+
+@contextlib.contextmanager
+def new_factored():
+    """Like `new` but for a `mdp.FactoredMDPSpec` with `variable`s instead of states."""
+    old_context = dsl_context.mdp_spec
+    dsl_context.mdp_spec = mdp.FactoredMDPSpec()
+    yield dsl_context.mdp_spec
+    dsl_context.mdp_spec = old_context
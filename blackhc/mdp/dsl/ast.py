@@ -153,6 +153,28 @@ class State(Node, SupportConjunction, SupportMapping):
         return visitor.visit_state(self)
 
 
+class Condition(State):
+    """A partial assignment of state variables of a `mdp.FactoredMDPSpec`, used like a state."""
+
+    def __init__(self, condition: mdp.Condition):
+        super().__init__(condition)
+
+    def __and__(self, other):
+        if isinstance(other, Condition):
+            return Condition(self.state & other.state)
+        return Conjunction(self, other)
+
+
+class Variable(object):
+    """A state variable; `variable[value]` is the condition that it has `value`."""
+
+    def __init__(self, variable: mdp.Variable):
+        self.variable = variable
+
+    def __getitem__(self, value):
+        return Condition(mdp.Condition({self.variable: value}))
+
+
 class WeightedState(Node):
     def __init__(self, next_state: mdp.NextState):
         super().__init__()
@@ -0,0 +1,393 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Factored MDPs stored as one conditional probability tensor per state variable.
+
+The joint transition probabilities are the products of the per-variable tensors, so backups contract
+the tensors with the V vector (reshaped to the variables) one variable at a time and never build the
+joint (num_states, num_actions, num_states) table. `ProductMDP` does the same for several compiled MDPs
+that run in lockstep, with one component per factor.
+"""
+import time
+
+import gym
+import gym.spaces
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+from blackhc.mdp import instrumentation
+from blackhc.mdp import lp
+
+
+class Factor(object):
+    """P(next value of `variable` | action, values of `parents`) as a (num_actions, *parent sizes, size) tensor."""
+
+    def __init__(self, variable: mdp.Variable, parents, probs):
+        self.variable = variable
+        self.parents = parents
+        self.probs = probs
+        self.cumprobs = np.cumsum(probs, axis=-1)
+        self.cumprobs[..., -1] = 1.
+
+
+class CompiledFactoredMDP(object):
+    """A `mdp.FactoredMDPSpec` compiled into per-variable `Factor`s and an additive reward table.
+
+    Joint state indices are the C-order indices of the variable values (see `FactoredMDPSpec.state_index`),
+    and terminal states are absorbing without reward like in `compiled.CompiledMDP`. Sampling draws the
+    next value of every variable and the reward of every matching condition independently.
+    """
+
+    def __init__(self, factored_spec: mdp.FactoredMDPSpec):
+        with instrumentation.timer('compiled.compile'):
+            self._compile(factored_spec)
+
+    def _compile(self, factored_spec: mdp.FactoredMDPSpec):
+        self.mdp_spec = factored_spec
+        self.discount = factored_spec.discount
+        self.shape = factored_spec.shape
+        self.num_states = factored_spec.num_states
+        self.num_actions = factored_spec.num_actions
+        self.variables = factored_spec.variables
+        if 2 * len(self.variables) + 1 > 52:
+            raise ValueError('At most 25 state variables are supported!')
+
+        self.factors = [self._compile_factor(factored_spec, variable) for variable in self.variables]
+
+        self.terminal_states = np.zeros(self.shape, dtype=bool)
+        for condition in factored_spec.terminal_conditions:
+            self.terminal_states[self._condition_index(condition.key)] = True
+        self.terminal_states = self.terminal_states.ravel()
+
+        expected_rewards = np.zeros(self.shape + (self.num_actions,))
+        # (action index, condition key, reward values, cumulative probabilities) of every reward condition.
+        self.reward_terms = []
+        for (action, key), rewards in factored_spec.reward_outcomes.items():
+            reward_probs = mdp.Reward.get_choices(rewards)
+            values = np.array(list(reward_probs.keys()), dtype=np.float64)
+            probs = np.array(list(reward_probs.values()))
+            expected_rewards[self._condition_index(key) + (action.index,)] += values @ probs
+            cumprobs = np.cumsum(probs)
+            cumprobs[-1] = 1.
+            self.reward_terms.append((action.index, key, values, cumprobs))
+        self.expected_rewards = expected_rewards.reshape((self.num_states, self.num_actions))
+        self.expected_rewards[self.terminal_states] = 0.
+
+        self.start_state = factored_spec.state_index(
+            {variable: factored_spec.start.get(variable, 0) for variable in self.variables})
+
+    def _condition_index(self, key, variables=None):
+        """Index the joint values of `variables` (all by default) where the condition `key` holds."""
+        values = dict(key)
+        variables = self.variables if variables is None else variables
+        return tuple(values.get(variable.index, slice(None)) for variable in variables)
+
+    def _compile_factor(self, factored_spec: mdp.FactoredMDPSpec, variable: mdp.Variable):
+        outcomes = [(action, key, next_values) for (outcome_variable, action, key), next_values in
+                    factored_spec.value_outcomes.items() if outcome_variable is variable]
+        parent_indices = {variable.index}
+        for _, key, _ in outcomes:
+            parent_indices.update(index for index, _ in key)
+        parents = [self.variables[index] for index in sorted(parent_indices)]
+
+        weights = np.zeros((self.num_actions,) + tuple(parent.num_values for parent in parents) +
+                           (variable.num_values,))
+        for action, key, next_values in outcomes:
+            condition_index = (action.index,) + self._condition_index(key, parents)
+            for next_value in next_values:
+                weights[condition_index + (next_value.outcome,)] += next_value.weight
+
+        # Values without any transition stay the same.
+        total_weights = weights.sum(axis=-1, keepdims=True)
+        unspecified = (total_weights == 0.)[..., 0]
+        value_axis = 1 + parents.index(variable)
+        current_values = np.arange(variable.num_values).reshape(
+            (variable.num_values,) + (1,) * (len(parents) - value_axis))
+        identity = np.broadcast_to(np.arange(variable.num_values) == current_values[..., np.newaxis],
+                                   weights.shape)
+        weights[unspecified] = identity[unspecified]
+        total_weights[total_weights == 0.] = 1.
+        return Factor(variable, parents, weights / total_weights)
+
+    def expected_next_values(self, v_vector):
+        """Return E[V(s') | s, a] as a (num_states, num_actions) array by contracting the factors with V.
+
+        Terminal states keep their own value.
+        """
+        num_variables = len(self.variables)
+        operands = []
+        for factor in self.factors:
+            operands += [factor.probs, [0] + [1 + parent.index for parent in factor.parents] +
+                         [1 + num_variables + factor.variable.index]]
+        operands += [np.reshape(v_vector, self.shape), list(range(1 + num_variables, 1 + 2 * num_variables))]
+        next_values = np.einsum(*operands, list(range(1 + num_variables)), optimize=True)
+        next_values = next_values.reshape((self.num_actions, self.num_states)).T
+        next_values[self.terminal_states] = np.asarray(v_vector)[self.terminal_states, np.newaxis]
+        return next_values
+
+    def q_table_from_v_vector(self, v_vector):
+        return self.expected_rewards + self.discount * self.expected_next_values(v_vector)
+
+    def sample(self, states, actions, n=1, random_state=None):
+        """Sample next states and rewards for (state, action) index pairs like `compiled.CompiledMDP.sample`."""
+        random_state = compiled.get_random_state(random_state)
+        states, actions = np.broadcast_arrays(np.asarray(states, dtype=np.int64), np.asarray(actions, dtype=np.int64))
+        if n != 1:
+            states = np.repeat(states[..., np.newaxis], n, axis=-1)
+            actions = np.repeat(actions[..., np.newaxis], n, axis=-1)
+        values = np.unravel_index(states, self.shape)
+        next_values = []
+        for factor in self.factors:
+            cumprobs = factor.cumprobs[(actions,) + tuple(values[parent.index] for parent in factor.parents)]
+            uniforms = random_state.random_sample(states.shape)
+            next_values.append((cumprobs <= uniforms[..., np.newaxis]).sum(axis=-1))
+        next_states = np.ravel_multi_index(next_values, self.shape) if self.shape else np.zeros_like(states)
+        terminal = self.terminal_states[states]
+        next_states = np.where(terminal, states, next_states)
+        return next_states, self._sample_rewards(values, actions, terminal, random_state)
+
+    def _sample_rewards(self, values, actions, terminal, random_state):
+        rewards = np.zeros(actions.shape)
+        for action, key, reward_values, cumprobs in self.reward_terms:
+            matches = (actions == action) & ~terminal
+            for variable_index, value in key:
+                matches &= values[variable_index] == value
+            if len(reward_values) == 1:
+                rewards[matches] += reward_values[0]
+            else:
+                uniforms = random_state.random_sample(np.count_nonzero(matches))
+                rewards[matches] += reward_values[np.searchsorted(cumprobs, uniforms, side='right')]
+        return rewards
+
+
+class ProductMDP(object):
+    """Several compiled MDPs stepped in lockstep as one MDP, without building the product transitions.
+
+    Joint states are mixed-radix indices of the component states (the first component is the most
+    significant digit). With `actions='product'`, joint actions are mixed-radix indices of the component
+    actions; with `actions='shared'`, all components take the same action. Rewards add up.
+
+    With `terminal='any'`, a joint state is terminal (and absorbing without reward) as soon as one
+    component is terminal; with `terminal='all'`, finished components stay in their terminal state
+    until all are.
+
+    Backups apply the sparse transition matrix of each component along its axis of the V tensor, and
+    sampling samples every component on its own compiled tables.
+    """
+    ACTIONS = ('product', 'shared')
+    TERMINALS = ('any', 'all')
+
+    def __init__(self, mdp_specs, actions='product', terminal='any', start_states=None):
+        if actions not in self.ACTIONS:
+            raise ValueError('Unknown actions %s! Must be one of %s.' % (actions, self.ACTIONS))
+        if terminal not in self.TERMINALS:
+            raise ValueError('Unknown terminal %s! Must be one of %s.' % (terminal, self.TERMINALS))
+        self.components = [compiled.compile_mdp(mdp_spec) for mdp_spec in mdp_specs]
+        if not self.components:
+            raise ValueError('A product needs at least one MDP!')
+        discounts = {component.discount for component in self.components}
+        if len(discounts) != 1:
+            raise ValueError('All MDPs need the same discount, not %s!' % sorted(discounts))
+        self.discount, = discounts
+        self.shape = tuple(component.num_states for component in self.components)
+        self.num_states = int(np.prod(self.shape))
+
+        self.action_shape = tuple(component.num_actions for component in self.components)
+        self._shared_actions = actions == 'shared'
+        transition_matrices = [component.transition_matrix() for component in self.components]
+        if self._shared_actions:
+            if len(set(self.action_shape)) != 1:
+                raise ValueError('Shared actions need the same number of actions, not %s!' % (self.action_shape,))
+            self.num_actions = self.action_shape[0]
+            self.action_table = np.repeat(np.arange(self.num_actions)[:, np.newaxis], len(self.components), axis=1)
+            # The (num_states_i, num_states_i) transitions of every component for every shared action.
+            self._transition_matrices = [[transition_matrix[action::self.num_actions]
+                                          for transition_matrix in transition_matrices]
+                                         for action in range(self.num_actions)]
+        else:
+            self.num_actions = int(np.prod(self.action_shape))
+            self.action_table = np.stack(np.unravel_index(np.arange(self.num_actions), self.action_shape), axis=1)
+            self._transition_matrices = transition_matrices
+
+        combine = np.logical_or if terminal == 'any' else np.logical_and
+        terminal_states = np.full(self.shape, terminal == 'all')
+        for i, component in enumerate(self.components):
+            terminal_states = combine(terminal_states, component.terminal_states.reshape(
+                (-1,) + (1,) * (len(self.components) - i - 1)))
+        self.terminal_states = terminal_states.ravel()
+        self._absorbing = terminal == 'any'
+
+        self.expected_rewards = self._sum_rewards()
+        if self._absorbing:
+            self.expected_rewards[self.terminal_states] = 0.
+
+        if start_states is None:
+            start_states = [0] * len(self.components)
+        self.start_state = self.state_index([start_state.index if isinstance(start_state, mdp.State) else start_state
+                                             for start_state in start_states])
+
+    def state_index(self, component_states):
+        return int(np.ravel_multi_index(component_states, self.shape))
+
+    def component_states(self, states):
+        """Return the tuple of component state indices of joint state indices."""
+        return np.unravel_index(states, self.shape)
+
+    def _sum_rewards(self):
+        """Sum the expected rewards of all components into a (num_states, num_actions) table."""
+        num_components = len(self.components)
+        if self._shared_actions:
+            total = np.zeros(self.shape + (self.num_actions,))
+        else:
+            total = np.zeros(self.shape + self.action_shape)
+        for i, component in enumerate(self.components):
+            shape = [1] * total.ndim
+            shape[i] = self.shape[i]
+            shape[-1 if self._shared_actions else num_components + i] = self.action_shape[i]
+            total += component.expected_rewards.reshape(shape)
+        return total.reshape((self.num_states, self.num_actions))
+
+    def _contract(self, values, transition_matrices):
+        """Apply the i-th matrix along the i-th axis of `values`; returns an array of shape (rows_1, ..., rows_k)."""
+        for i, transition_matrix in enumerate(transition_matrices):
+            # The next states of component i are the first axis; its rows go last.
+            rest_shape = values.shape[1:]
+            values = transition_matrix @ values.reshape((self.shape[i], -1))
+            values = np.moveaxis(values.reshape((-1,) + rest_shape), 0, -1)
+        return values
+
+    def expected_next_values(self, v_vector):
+        """Return E[V(s') | s, a] as a (num_states, num_actions) array by contracting each component with V.
+
+        Terminal states keep their own value.
+        """
+        values = np.reshape(v_vector, self.shape)
+        if self._shared_actions:
+            next_values = np.stack([self._contract(values, transition_matrices).ravel()
+                                    for transition_matrices in self._transition_matrices], axis=-1)
+        else:
+            num_components = len(self.components)
+            next_values = self._contract(values, self._transition_matrices)
+            # Split the (state, action) rows of every component and move the actions last.
+            next_values = next_values.reshape(tuple(size for sizes in zip(self.shape, self.action_shape)
+                                                    for size in sizes))
+            next_values = next_values.transpose(list(range(0, 2 * num_components, 2)) +
+                                                list(range(1, 2 * num_components, 2)))
+            next_values = next_values.reshape((self.num_states, self.num_actions))
+        if self._absorbing:
+            next_values[self.terminal_states] = np.asarray(v_vector)[self.terminal_states, np.newaxis]
+        return next_values
+
+    def q_table_from_v_vector(self, v_vector):
+        return self.expected_rewards + self.discount * self.expected_next_values(v_vector)
+
+    def sample(self, states, actions, n=1, random_state=None):
+        """Sample next states and rewards for (state, action) index pairs like `compiled.CompiledMDP.sample`."""
+        random_state = compiled.get_random_state(random_state)
+        states, actions = np.broadcast_arrays(np.asarray(states, dtype=np.int64), np.asarray(actions, dtype=np.int64))
+        if n != 1:
+            states = np.repeat(states[..., np.newaxis], n, axis=-1)
+            actions = np.repeat(actions[..., np.newaxis], n, axis=-1)
+        component_actions = self.action_table[actions]
+        next_component_states = []
+        rewards = np.zeros(states.shape)
+        for i, (component, component_states) in enumerate(zip(self.components, self.component_states(states))):
+            next_states, component_rewards = component.sample(component_states, component_actions[..., i],
+                                                              random_state=random_state)
+            next_component_states.append(next_states)
+            rewards += component_rewards
+        next_states = np.ravel_multi_index(next_component_states, self.shape)
+        if self._absorbing:
+            terminal = self.terminal_states[states]
+            next_states = np.where(terminal, states, next_states)
+            rewards[terminal] = 0.
+        return next_states, rewards
+
+    def to_env(self, random_state=None):
+        return FactoredMDPEnv(self, random_state)
+
+
+class FactoredValueIteration(object):
+    """Value iteration on a `CompiledFactoredMDP` or `ProductMDP` with backups computed by tensor contractions."""
+
+    def __init__(self, factored_spec):
+        if isinstance(factored_spec, mdp.FactoredMDPSpec):
+            factored_spec = CompiledFactoredMDP(factored_spec)
+        self.factored_mdp = factored_spec
+        self.discount = factored_spec.discount
+        self.num_states = factored_spec.num_states
+        self.num_actions = factored_spec.num_actions
+
+    def compute_v_vector(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                         target_residual=None, full_output=False):
+        """See `lp.LinearProgramming.compute_q_table` for the arguments."""
+        def iterate(v_vector):
+            return self.factored_mdp.q_table_from_v_vector(v_vector).max(axis=-1)
+
+        value, info = lp.fix_point_iterate(np.zeros(self.num_states), iterate, max_iterations=max_iterations,
+                                           all_close=all_close, callback=callback, time_budget=time_budget,
+                                           target_residual=target_residual, discount=self.discount)
+        if full_output:
+            return value, info
+        return value
+
+    def compute_q_table(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                        target_residual=None, full_output=False):
+        """Compute the Q-table from the V vector of `compute_v_vector`."""
+        v_vector, info = self.compute_v_vector(max_iterations, all_close, callback, time_budget, target_residual,
+                                               full_output=True)
+        q_table = self.factored_mdp.q_table_from_v_vector(v_vector)
+        if full_output:
+            return q_table, info
+        return q_table
+
+
+class FactoredMDPEnv(gym.Env):
+    """Environment for a `mdp.FactoredMDPSpec` or `ProductMDP`; observations are joint state indices."""
+    metadata = {'render.modes': []}
+
+    def __init__(self, factored_spec, random_state=None):
+        if isinstance(factored_spec, mdp.FactoredMDPSpec):
+            factored_spec = CompiledFactoredMDP(factored_spec)
+        self.factored_mdp = factored_spec
+        self.random_state = compiled.get_random_state(random_state)
+        self._state = None
+        self._is_done = True
+        self.observation_space = gym.spaces.Discrete(self.factored_mdp.num_states)
+        self.action_space = gym.spaces.Discrete(self.factored_mdp.num_actions)
+
+    def reset(self):
+        self._state = self.factored_mdp.start_state
+        self._is_done = bool(self.factored_mdp.terminal_states[self._state])
+        if instrumentation.enabled:
+            instrumentation.count('env.resets')
+        return self._state
+
+    def step(self, action_index):
+        if instrumentation.enabled:
+            start_time = time.perf_counter()
+
+        if not self._is_done:
+            next_state, reward = self.factored_mdp.sample(self._state, action_index, random_state=self.random_state)
+            self._state = int(next_state)
+            reward = float(reward)
+            self._is_done = bool(self.factored_mdp.terminal_states[self._state])
+        else:
+            reward = 0
+
+        if instrumentation.enabled:
+            instrumentation.record_time('env.sample', time.perf_counter() - start_time)
+            instrumentation.count('env.steps')
+
+        return self._state, reward, self._is_done, None
@@ -0,0 +1,91 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Seeded generators of synthetic MDPs of configurable size."""
+from blackhc import mdp
+from blackhc.mdp import compiled
+
+
+def random_mdp(num_states, num_actions, branching=2, discount=0.9, seed=None):
+    """Random sparse MDP: every (state, action) leads to `branching` random next states.
+
+    Transition probabilities are Dirichlet distributed and rewards are standard normal.
+    """
+    random_state = compiled.get_random_state(seed)
+
+    spec = mdp.MDPSpec()
+    spec.discount = discount
+    states = [spec.state() for _ in range(num_states)]
+    actions = [spec.action() for _ in range(num_actions)]
+    for state in states:
+        for action in actions:
+            next_states = random_state.choice(num_states, size=min(branching, num_states), replace=False)
+            probs = random_state.dirichlet([1.] * len(next_states))
+            for next_state, prob in zip(next_states, probs):
+                spec.transition(state, action, mdp.NextState(states[next_state], prob))
+            spec.transition(state, action, mdp.Reward(random_state.randn()))
+    return spec
+
+
+def gridworld(width, height, slip=0.1, step_reward=-0.01, discount=0.95):
+    """Grid with the actions up, down, left and right and a terminal goal in the far corner.
+
+    With probability `slip` a move goes in a uniformly random direction instead.
+    The reward depends on the intended move, not on the state actually reached: a move aimed at the goal
+    gives reward 1 even if it slips, and all other moves give `step_reward`, even if they slip into the goal.
+    """
+    spec = mdp.MDPSpec()
+    spec.discount = discount
+    states = {}
+    for y in range(height):
+        for x in range(width):
+            states[x, y] = spec.state('%s_%s' % (x, y), terminal_state=(x, y) == (width - 1, height - 1))
+    moves = [(spec.action(name), delta) for name, delta in
+             [('up', (0, -1)), ('down', (0, 1)), ('left', (-1, 0)), ('right', (1, 0))]]
+
+    def move(x, y, delta):
+        return states[min(max(x + delta[0], 0), width - 1), min(max(y + delta[1], 0), height - 1)]
+
+    for (x, y), state in states.items():
+        if state.terminal_state:
+            continue
+        for action, delta in moves:
+            spec.transition(state, action, mdp.NextState(move(x, y, delta), 1. - slip))
+            for _, slip_delta in moves:
+                spec.transition(state, action, mdp.NextState(move(x, y, slip_delta), slip / len(moves)))
+            spec.transition(state, action, mdp.Reward(1. if move(x, y, delta).terminal_state else step_reward))
+    return spec
+
+
+def chain(num_states, num_actions=2, slip=0., discount=0.95):
+    """Chain where action 0 moves one state forward and all other actions reset to the start.
+
+    Moving forward into the terminal end of the chain gives reward 1 and resetting gives reward 0.01.
+    With probability `slip` an action has the effect of a different action. Rewards are drawn with the
+    same probabilities as the next states but independently of them, so with `slip > 0` the reward need
+    not match the state actually reached; only the expected rewards are exact.
+    """
+    spec = mdp.MDPSpec()
+    spec.discount = discount
+    states = [spec.state() for _ in range(num_states - 1)] + [spec.state(terminal_state=True)]
+    actions = [spec.action() for _ in range(num_actions)]
+    for i, state in enumerate(states[:-1]):
+        forward_reward = 1. if i + 1 == num_states - 1 else 0.
+        for action in actions:
+            forward_prob = 1. - slip if action.index == 0 else slip
+            for next_state, reward, prob in [(states[i + 1], forward_reward, forward_prob),
+                                             (states[0], 0.01, 1. - forward_prob)]:
+                if prob:
+                    spec.transition(state, action, mdp.NextState(next_state, prob))
+                    spec.transition(state, action, mdp.Reward(reward, prob))
+    return spec
@@ -0,0 +1,182 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implicit MDPs that are expanded lazily from a successor function.
+
+    def successors(n):
+        if n == 10:
+            return {}  # Terminal.
+        return {'inc': [(0.9, n + 1, -1.), (0.1, n, -1.)], 'stay': [(1., n, -2.)]}
+
+    counter = implicit.ImplicitMDP(successors, start_state=0, actions=['inc', 'stay'])
+    env = counter.to_env()
+    q_table = lp.LinearProgramming(counter).compute_q_table()
+"""
+import collections
+import time
+
+import gym
+import gym.spaces
+import numpy as np
+
+from blackhc.mdp import compiled
+from blackhc.mdp import instrumentation
+
+
+class ImplicitMDP(object):
+    """An MDP given by `successors(state) -> {action: [(probability, next state, reward), ...]}`.
+
+    States can be any hashable objects and are interned to integer indices when they are first seen;
+    `states[index]` maps back. States without actions are terminal, and actions that are missing for
+    a state keep the state unchanged without reward. Only the `cache_size` most recently used expansions
+    are kept, so memory grows with the number of visited states, not with the size of the state space.
+
+    Solvers compile the states that are reachable from `start_state` (see `compile`).
+    """
+
+    def __init__(self, successors, start_state, actions, discount=1., cache_size=10000):
+        self.successors = successors
+        self.actions = list(actions)
+        self.num_actions = len(self.actions)
+        self.discount = discount
+        self.cache_size = cache_size
+        self.num_expansions = 0
+
+        self.states = []
+        self._state_indices = {}
+        self._expansions = collections.OrderedDict()
+        self.start_state = self.intern(start_state)
+
+    @property
+    def num_states(self):
+        """The number of states seen so far."""
+        return len(self.states)
+
+    def intern(self, state):
+        """Return the index of `state`."""
+        index = self._state_indices.get(state)
+        if index is None:
+            index = self._state_indices[state] = len(self.states)
+            self.states.append(state)
+        return index
+
+    def expand(self, state_index):
+        """Return the transitions of a state as a tuple with (next state indices, probs, rewards) arrays per action.
+
+        The tuple is empty for terminal states.
+        """
+        expansion = self._expansions.get(state_index)
+        if expansion is not None:
+            self._expansions.move_to_end(state_index)
+            return expansion
+
+        state = self.states[state_index]
+        outcomes_by_action = self.successors(state)
+        expansion = []
+        if outcomes_by_action:
+            for action in self.actions:
+                probs, next_states, rewards = zip(*(outcomes_by_action.get(action) or [(1., state, 0.)]))
+                expansion.append((np.array([self.intern(next_state) for next_state in next_states], dtype=np.int64),
+                                  np.array(probs, dtype=np.float64), np.array(rewards, dtype=np.float64)))
+        expansion = tuple(expansion)
+        self.num_expansions += 1
+
+        self._expansions[state_index] = expansion
+        if len(self._expansions) > self.cache_size:
+            self._expansions.popitem(last=False)
+        return expansion
+
+    def is_terminal(self, state_index):
+        return not self.expand(state_index)
+
+    def explore(self, max_states=100000):
+        """Intern all states that are reachable from `start_state` and return their number.
+
+        Raises ValueError if there are more than `max_states`.
+        """
+        state_index = 0
+        while state_index < self.num_states:
+            self.expand(state_index)
+            state_index += 1
+            if self.num_states > max_states:
+                raise ValueError('More than %s reachable states!' % max_states)
+        return self.num_states
+
+    def compile(self, max_states=100000) -> compiled.CompiledMDP:
+        """Compile the reachable states for the solvers.
+
+        Rewards and next states are compiled into separate distributions, which keeps all expectations
+        (and thus all solver results) exact but drops their correlation when sampling from the compiled MDP.
+        """
+        num_states = self.explore(max_states)
+        terminal_states = np.zeros(num_states, dtype=bool)
+        next_state_rows = []
+        reward_rows = []
+        for state_index in range(num_states):
+            expansion = self.expand(state_index)
+            if not expansion:
+                terminal_states[state_index] = True
+                next_state_rows.extend({state_index: 1.} for _ in range(self.num_actions))
+                reward_rows.extend({0.: 1.} for _ in range(self.num_actions))
+                continue
+            for next_states, probs, rewards in expansion:
+                next_state_row = collections.defaultdict(float)
+                reward_row = collections.defaultdict(float)
+                for next_state, prob, reward in zip(next_states, probs, rewards):
+                    next_state_row[next_state] += prob
+                    reward_row[reward] += prob
+                next_state_rows.append(next_state_row)
+                reward_rows.append(reward_row)
+        return compiled.CompiledMDP.from_rows(self, num_states, self.num_actions, self.discount, terminal_states,
+                                              next_state_rows, reward_rows)
+
+    def to_env(self):
+        return ImplicitMDPEnv(self)
+
+
+class ImplicitMDPEnv(gym.Env):
+    """Environment for an `ImplicitMDP` with the interface of `MDPEnv`; observations are state indices."""
+    metadata = {'render.modes': []}
+
+    def __init__(self, implicit_mdp: ImplicitMDP, max_states=np.iinfo(np.int32).max):
+        self.mdp = implicit_mdp
+        self._state = None
+        self._is_done = True
+        self.observation_space = gym.spaces.Discrete(max_states)
+        self.action_space = gym.spaces.Discrete(self.mdp.num_actions)
+
+    def reset(self):
+        self._state = self.mdp.start_state
+        self._is_done = self.mdp.is_terminal(self._state)
+        if instrumentation.enabled:
+            instrumentation.count('env.resets')
+        return self._state
+
+    def step(self, action_index):
+        if instrumentation.enabled:
+            start_time = time.perf_counter()
+
+        if not self._is_done:
+            next_states, probs, rewards = self.mdp.expand(self._state)[action_index]
+            outcome = np.random.choice(len(probs), p=probs)
+            self._state = int(next_states[outcome])
+            reward = rewards[outcome]
+            self._is_done = self.mdp.is_terminal(self._state)
+        else:
+            reward = 0
+
+        if instrumentation.enabled:
+            instrumentation.record_time('env.sample', time.perf_counter() - start_time)
+            instrumentation.count('env.steps')
+
+        return self._state, reward, self._is_done, None
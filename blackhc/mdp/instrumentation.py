@@ -0,0 +1,107 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in instrumentation of environments and solvers.
+
+Instrumented code checks `enabled` before doing any work, so the overhead is a single
+attribute lookup while instrumentation is disabled. Metrics are either accumulated and read
+with `snapshot()`, or forwarded as (name, value) events to observers:
+
+    instrumentation.add_observer(lambda name, value: my_metrics.record(name, value))
+
+Events:
+    env.steps, env.resets, batch_env.steps: counts
+    env.sample, transitions.compile, compiled.compile, solver.iteration: seconds
+    solver.residual: max-norm change of the last solver iteration
+"""
+import contextlib
+import time
+
+enabled = False
+# Whether `add_observer` enabled instrumentation, so that removing the last observer disables it again.
+_enabled_by_observers = False
+
+_observers = []
+_counters = {}
+_timers = {}
+_gauges = {}
+
+
+def enable():
+    global enabled, _enabled_by_observers
+    enabled = True
+    _enabled_by_observers = False
+
+
+def disable():
+    global enabled, _enabled_by_observers
+    enabled = False
+    _enabled_by_observers = False
+
+
+def add_observer(observer):
+    """Call `observer(name, value)` for every event. Also enables instrumentation until the last observer is removed."""
+    global _enabled_by_observers
+    if not enabled:
+        enable()
+        _enabled_by_observers = True
+    _observers.append(observer)
+
+
+def remove_observer(observer):
+    _observers.remove(observer)
+    if not _observers and _enabled_by_observers:
+        disable()
+
+
+def count(name, increment=1):
+    _counters[name] = _counters.get(name, 0) + increment
+    for observer in _observers:
+        observer(name, increment)
+
+
+def record_time(name, seconds):
+    num_calls, total_seconds = _timers.get(name, (0, 0.))
+    _timers[name] = (num_calls + 1, total_seconds + seconds)
+    for observer in _observers:
+        observer(name, seconds)
+
+
+def gauge(name, value):
+    _gauges[name] = value
+    for observer in _observers:
+        observer(name, value)
+
+
+@contextlib.contextmanager
+def timer(name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    yield
+    record_time(name, time.perf_counter() - start)
+
+
+def snapshot():
+    """Return all metrics accumulated since the last `reset()` as a dict."""
+    return dict(counters=dict(_counters),
+                timers={name: dict(count=num_calls, total_seconds=total_seconds)
+                        for name, (num_calls, total_seconds) in _timers.items()},
+                gauges=dict(_gauges))
+
+
+def reset():
+    _counters.clear()
+    _timers.clear()
+    _gauges.clear()
@@ -16,69 +16,532 @@
 This is a very basic solver.
 """
 
+import collections
+import concurrent.futures
+import os
+import time
+import warnings
+
 import numpy as np
 
 from blackhc import mdp
+from blackhc.mdp import compiled
+from blackhc.mdp import instrumentation
+from blackhc.mdp import structure
 
 
 class LinearProgramming(object):
-    def __init__(self, mdp_spec: mdp.MDPSpec):
-        self.discount = mdp_spec.discount
-        self.num_states = mdp_spec.num_states
-        self.num_actions = mdp_spec.num_actions
-        self.mdp_spec = mdp_spec
-
-        transitions = mdp.Transitions(mdp_spec)
-        next_states = np.zeros(shape=(self.num_states, self.num_actions, self.num_states))
-        expected_rewards = np.zeros(shape=(self.num_states, self.num_actions))
-        for (state, action), choices in transitions.next_states.items():
-            for next_state, prob in choices.items():
-                next_states[state.index, action.index, next_state.index] = prob
-        for state in mdp_spec.states:
-            if state.terminal_state:
-                next_states[state.index, :, state.index] = 1.
-
-        for (state, action), choices in transitions.rewards.items():
-            expected_rewards[state.index, action.index] = sum(value * prob for value, prob in choices.items())
-
-        self.next_states = next_states
-        self.expected_rewards = expected_rewards
-
-    def compute_q_table(self, max_iterations=100, all_close=None):
-        return _fix_point_iterate(self.expected_rewards.copy(),
-                                  lambda q_table: self.q_table_from_v_vector(self.v_vector_from_q_table(q_table)),
-                                  max_iterations=max_iterations,
-                                  all_close=all_close
-                                  )
-
-    def compute_v_vector(self, max_iterations=100, all_close=None):
-        return _fix_point_iterate(np.zeros((self.num_states,)),
-                                  lambda v_vector: self.v_vector_from_q_table(self.q_table_from_v_vector(v_vector)),
-                                  max_iterations=max_iterations,
-                                  all_close=all_close)
+    """Value iteration on dense arrays.
+
+    `dtype` sets the precision of the transition and reward arrays, and thus of the results:
+    np.float32 halves the memory and bandwidth of large solves.
+    """
+
+    def __init__(self, mdp_spec: mdp.MDPSpec, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.compiled_mdp = compiled.compile_mdp(mdp_spec)
+        self.mdp_spec = self.compiled_mdp.mdp_spec
+        self.discount = self.compiled_mdp.discount
+        self.num_states = self.compiled_mdp.num_states
+        self.num_actions = self.compiled_mdp.num_actions
+
+        # Terminal states are absorbing self-loops in the compiled MDP.
+        self.next_states = self.compiled_mdp.transition_matrix().astype(self.dtype).toarray().reshape(
+            (self.num_states, self.num_actions, self.num_states))
+        self.expected_rewards = self.compiled_mdp.expected_rewards.astype(self.dtype)
+
+    def compute_q_table(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                        target_residual=None, full_output=False):
+        """Compute the optimal Q-table by value iteration.
+
+        `callback(iteration, q_table, residual)` is called after every iteration and can return True to stop.
+        Iteration also stops early once `time_budget` seconds have passed or the max-norm residual drops below
+        `target_residual`, and the best Q-table so far is returned. With `full_output`, a tuple
+        (q_table, FixPointInfo) with the residual and an error bound is returned instead.
+        Raises ValueError if there is no convergence after `max_iterations`.
+
+        Iterations write into preallocated buffers, so the array passed to `callback` is only valid during
+        the call.
+        """
+        q_buffers = _PingPongBuffers((self.num_states, self.num_actions), self.dtype)
+        v_buffer = np.empty(self.num_states, dtype=self.dtype)
+        return self._solve(self.expected_rewards.copy(),
+                           lambda q_table: self.q_table_from_v_vector(
+                               self.v_vector_from_q_table(q_table, out=v_buffer), out=q_buffers.other(q_table)),
+                           max_iterations, all_close, callback, time_budget, target_residual, full_output)
+
+    def compute_v_vector(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                         target_residual=None, full_output=False):
+        """Compute the optimal V vector by value iteration. See `compute_q_table` for the arguments."""
+        v_buffers = _PingPongBuffers((self.num_states,), self.dtype)
+        q_buffer = np.empty((self.num_states, self.num_actions), dtype=self.dtype)
+        return self._solve(np.zeros((self.num_states,), dtype=self.dtype),
+                           lambda v_vector: self.v_vector_from_q_table(
+                               self.q_table_from_v_vector(v_vector, out=q_buffer), out=v_buffers.other(v_vector)),
+                           max_iterations, all_close, callback, time_budget, target_residual, full_output)
+
+    def _solve(self, initial, iterate, max_iterations, all_close, callback, time_budget, target_residual,
+               full_output):
+        value, info = fix_point_iterate(initial, iterate, max_iterations=max_iterations, all_close=all_close,
+                                        callback=callback, time_budget=time_budget,
+                                        target_residual=target_residual, discount=self.discount)
+        if full_output:
+            return value, info
+        return value
+
+    def compute_finite_horizon_q_table(self, horizon, num_slices=None, dtype=np.float64):
+        """Compute the time-indexed Q-table of a finite horizon by backward induction.
+
+        Returns a (num_slices, num_states, num_actions) array where slice t is the Q-table at time step t,
+        i.e. with `horizon - t` steps to go. By default all `horizon` slices are kept; otherwise only the
+        first `num_slices` time steps are stored. Takes exactly `horizon` backups.
+        """
+        num_slices = horizon if num_slices is None else min(num_slices, horizon)
+        q_tables = np.empty((num_slices, self.num_states, self.num_actions), dtype=dtype)
+
+        transition_matrix = self.compiled_mdp.transition_matrix()
+        v_vector = np.zeros(self.num_states)
+        for t in reversed(range(horizon)):
+            q_table = self.expected_rewards + self.discount * (transition_matrix @ v_vector).reshape(
+                (self.num_states, self.num_actions))
+            if t < num_slices:
+                q_tables[t] = q_table
+            v_vector = q_table.max(axis=-1)
+        return q_tables
+
+    def compute_v_vector_by_components(self, start_state=None, max_iterations=100, all_close=None):
+        """Compute the V vector one strongly connected component at a time.
+
+        Components are solved in reverse topological order (see `structure.StructuralIndex`). All acyclic
+        components of a layer are solved together by a single backup, and cyclic components are iterated to
+        a fix point on their own. States that are unreachable from `start_state` are skipped and set to NaN.
+        """
+        index = structure.StructuralIndex(self.compiled_mdp, start_state)
+        transition_matrix = self.compiled_mdp.transition_matrix()
+        v_vector = np.full(self.num_states, np.nan)
+
+        def backup(states, state_transitions):
+            q_table = self.expected_rewards[states] + self.discount * (state_transitions @ v_vector).reshape(
+                (len(states), self.num_actions))
+            return q_table.max(axis=-1)
+
+        for layer in index.layers:
+            acyclic = layer[~index.cyclic_components[layer]]
+            if len(acyclic):
+                states = index.component_states(acyclic)
+                v_vector[states] = backup(states, transition_matrix[self._rows(states)])
+
+            for component in layer[index.cyclic_components[layer]]:
+                states = index.component_states([component])
+                if self.compiled_mdp.terminal_states[states].all():
+                    v_vector[states] = 0.
+                    continue
+                state_transitions = transition_matrix[self._rows(states)]
+
+                def iterate(component_v_vector):
+                    v_vector[states] = component_v_vector
+                    return backup(states, state_transitions)
+
+                v_vector[states], _ = fix_point_iterate(np.zeros(len(states)), iterate,
+                                                        max_iterations=max_iterations, all_close=all_close)
+        return v_vector
+
+    def compute_q_table_by_components(self, start_state=None, max_iterations=100, all_close=None):
+        v_vector = self.compute_v_vector_by_components(start_state, max_iterations, all_close)
+        q_table = self.expected_rewards + self.discount * (self.compiled_mdp.transition_matrix() @ v_vector).reshape(
+            (self.num_states, self.num_actions))
+        q_table[np.isnan(v_vector)] = np.nan
+        return q_table
+
+    def _rows(self, states):
+        return (states[:, None] * self.num_actions + np.arange(self.num_actions)).ravel()
+
+    def compute_episodic_v_vector(self):
+        return self.v_vector_from_q_table(self.compute_episodic_q_table())
+
+    def compute_episodic_q_table(self):
+        """Solve an episodic MDP exactly by policy iteration on the absorbing Markov chain.
+
+        Every policy evaluation is a sparse linear solve restricted to the transient (non-terminal) states,
+        so discount 1 needs no iteration limit. Raises ValueError if some states cannot reach a terminal state
+        or if the optimal policy is improper (a reward cycle that never terminates).
+        """
+        policy = _proper_policy(self.compiled_mdp)
+        while True:
+            v_vector = evaluate_policy(self.compiled_mdp, policy)
+            q_table = self.q_table_from_v_vector(v_vector)
+
+            # Only switch actions on a strict improvement, so ties cannot make the policy cycle.
+            current_q = q_table[np.arange(self.num_states), policy]
+            greedy = q_table.argmax(axis=-1)
+            improved = q_table[np.arange(self.num_states), greedy] > current_q + 1e-9 * (1 + np.abs(current_q))
+            if not improved.any():
+                return q_table
+            policy = np.where(improved, greedy, policy)
+            improper = _improper_states(self.compiled_mdp, policy)
+            if improper.any():
+                raise ValueError('Improving the policy makes it improper for states %s: rewards can be collected '
+                                 'forever!' % [self.mdp_spec.states[i] for i in np.flatnonzero(improper)])
 
     # noinspection PyMethodMayBeStatic
-    def v_vector_from_q_table(self, q_table):
-        v_vector = q_table.max(axis=-1)
+    def v_vector_from_q_table(self, q_table, out=None):
+        v_vector = q_table.max(axis=-1, out=out)
         return v_vector
 
-    def q_table_from_v_vector(self, v_vector):
+    def q_table_from_v_vector(self, v_vector, out=None):
         # TODO: somebody said that q table converges faster than v table
         # Is that true? What if take computation cost into account?
-        # TODO: support passing it in as a parameter
-        q_table = self.expected_rewards + self.discount * (
-            self.next_states * v_vector.reshape((1, 1, self.num_states))).sum(axis=-1)
+        if out is None:
+            out = np.empty((self.num_states, self.num_actions), dtype=self.dtype)
+        # A single matrix-vector product into `out` without any temporaries.
+        np.dot(self.next_states.reshape((-1, self.num_states)), v_vector.astype(self.dtype, copy=False),
+               out=out.reshape(-1))
+        out *= self.discount
+        out += self.expected_rewards
+        return out
+
+
+class _PingPongBuffers(object):
+    """Two preallocated arrays for iterations that read one and write the other."""
+
+    def __init__(self, shape, dtype):
+        self.buffers = (np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype))
+
+    def other(self, array):
+        return self.buffers[1] if array is self.buffers[0] else self.buffers[0]
+
+
+class ParallelValueIteration(object):
+    """Value iteration on the sparse compiled transitions with backups computed in a thread pool.
+
+    States are partitioned into chunks of `chunk_size` states, and each chunk's backup is a sparse
+    matrix-vector product, which releases the GIL. With the 'synchronous' schedule every sweep reads
+    the previous V vector; with the 'asynchronous' schedule chunks update the V vector in place and
+    see the updates of chunks that finished before them (chunk-wise Gauss-Seidel).
+    """
+    SCHEDULES = ('synchronous', 'asynchronous')
+
+    def __init__(self, mdp_spec, num_workers=None, chunk_size=None, schedule='synchronous'):
+        if schedule not in self.SCHEDULES:
+            raise ValueError('Unknown schedule %s! Must be one of %s.' % (schedule, self.SCHEDULES))
+        self.compiled_mdp = compiled.compile_mdp(mdp_spec)
+        self.discount = self.compiled_mdp.discount
+        self.num_states = self.compiled_mdp.num_states
+        self.num_actions = self.compiled_mdp.num_actions
+        self.schedule = schedule
+        self.num_workers = num_workers or os.cpu_count() or 1
+        chunk_size = chunk_size or max(1, -(-self.num_states // (4 * self.num_workers)))
+
+        transition_matrix = self.compiled_mdp.transition_matrix()
+        self.chunks = []
+        for start in range(0, self.num_states, chunk_size):
+            states = slice(start, min(start + chunk_size, self.num_states))
+            self.chunks.append((states, transition_matrix[states.start * self.num_actions:
+                                                          states.stop * self.num_actions],
+                                self.compiled_mdp.expected_rewards[states]))
+
+    def _backup(self, chunk, v_vector, out):
+        states, chunk_transitions, chunk_rewards = chunk
+        q_table = (chunk_transitions @ v_vector).reshape(chunk_rewards.shape)
+        q_table *= self.discount
+        q_table += chunk_rewards
+        q_table.max(axis=-1, out=out[states])
+
+    def compute_v_vector(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                         target_residual=None, full_output=False):
+        """See `LinearProgramming.compute_q_table` for the arguments."""
+        v_buffers = _PingPongBuffers((self.num_states,), np.float64)
+        with concurrent.futures.ThreadPoolExecutor(self.num_workers) as executor:
+            def iterate(v_vector):
+                out = v_buffers.other(v_vector)
+                if self.schedule == 'asynchronous':
+                    # All chunks read and write the same V vector.
+                    np.copyto(out, v_vector)
+                    v_vector = out
+                for future in [executor.submit(self._backup, chunk, v_vector, out) for chunk in self.chunks]:
+                    future.result()
+                return out
+
+            value, info = fix_point_iterate(np.zeros(self.num_states), iterate, max_iterations=max_iterations,
+                                            all_close=all_close, callback=callback, time_budget=time_budget,
+                                            target_residual=target_residual, discount=self.discount)
+        if full_output:
+            return value, info
+        return value
+
+    def compute_q_table(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                        target_residual=None, full_output=False):
+        """Compute the Q-table from the V vector of `compute_v_vector`."""
+        v_vector, info = self.compute_v_vector(max_iterations, all_close, callback, time_budget, target_residual,
+                                               full_output=True)
+        q_table = self.compiled_mdp.expected_rewards + self.discount * (
+            self.compiled_mdp.transition_matrix() @ v_vector).reshape((self.num_states, self.num_actions))
+        if full_output:
+            return q_table, info
         return q_table
 
 
-def _fix_point_iterate(initial, iterate, max_iterations, all_close=None):
-    if not all_close:
-        all_close = np.allclose
+class StreamingValueIteration(object):
+    """Value iteration on `compiled.MemmappedTransitions` for transition tables that do not fit in memory.
+
+    Each sweep streams the memory-mapped rows in blocks of `block_size` states, so the working memory is
+    bounded by one block plus the V vectors. `transitions` is a `MemmappedTransitions` or its directory.
+    """
+
+    def __init__(self, transitions, block_size=65536):
+        if not isinstance(transitions, compiled.MemmappedTransitions):
+            transitions = compiled.MemmappedTransitions(transitions)
+        self.transitions = transitions
+        self.discount = transitions.discount
+        self.num_states = transitions.num_states
+        self.num_actions = transitions.num_actions
+        self.block_size = block_size
+
+    def _blocks(self, v_vector):
+        """Yield (states, Q-table of the states) block by block."""
+        for start in range(0, self.num_states, self.block_size):
+            stop = min(start + self.block_size, self.num_states)
+            block_transitions, block_rewards = self.transitions.block(start, stop)
+            q_table = (block_transitions @ v_vector).reshape(block_rewards.shape)
+            q_table *= self.discount
+            q_table += block_rewards
+            yield slice(start, stop), q_table
+
+    def compute_v_vector(self, max_iterations=100, all_close=None, callback=None, time_budget=None,
+                         target_residual=None, full_output=False):
+        """See `LinearProgramming.compute_q_table` for the arguments."""
+        v_buffers = _PingPongBuffers((self.num_states,), np.float64)
+
+        def iterate(v_vector):
+            out = v_buffers.other(v_vector)
+            for states, q_table in self._blocks(v_vector):
+                q_table.max(axis=-1, out=out[states])
+            return out
+
+        value, info = fix_point_iterate(np.zeros(self.num_states), iterate, max_iterations=max_iterations,
+                                        all_close=all_close, callback=callback, time_budget=time_budget,
+                                        target_residual=target_residual, discount=self.discount)
+        if full_output:
+            return value, info
+        return value
+
+    def compute_greedy_policy(self, v_vector):
+        """Return the action indices that are greedy with respect to `v_vector` in one streaming sweep."""
+        policy = np.empty(self.num_states, dtype=np.int64)
+        for states, q_table in self._blocks(np.asarray(v_vector, dtype=np.float64)):
+            q_table.argmax(axis=-1, out=policy[states])
+        return policy
+
+
+def evaluate_policy(mdp_spec, policy):
+    """Compute the exact V vector of a (stochastic) policy.
+
+    `policy` is a (num_states, num_actions) matrix of action probabilities or a vector of action indices.
+    Solves (I - discount P^pi) V = r^pi restricted to the non-terminal states with a sparse direct solver.
+    Terminal states are absorbing, so for discount 1 this is the absorbing Markov chain solution, which
+    exists iff the policy reaches a terminal state with probability 1 from every state.
+    """
+    compiled_mdp = compiled.compile_mdp(mdp_spec)
+    policy_matrix = compiled_mdp.policy_matrix(policy)
+    policy_transitions = (policy_matrix @ compiled_mdp.transition_matrix()).tocsr()
+    policy_rewards = policy_matrix @ compiled_mdp.expected_rewards.ravel()
+
+    v_vector = np.zeros(compiled_mdp.num_states)
+    transient = np.flatnonzero(~compiled_mdp.terminal_states)
+    if len(transient):
+        v_vector[transient] = solve_transient(policy_transitions[transient][:, transient], policy_rewards[transient],
+                                              compiled_mdp.discount)
+    return v_vector
+
+
+def compute_occupancy(mdp_spec, policy, start_distribution=None, method='direct', max_iterations=1000,
+                      all_close=None, callback=None, time_budget=None, target_residual=None, full_output=False):
+    """Compute the discounted state-action occupancy d(s, a) = sum_t discount^t P(s_t = s, a_t = a).
+
+    `policy` is a (num_states, num_actions) matrix of action probabilities or a vector of action indices,
+    and `start_distribution` is anything `compiled.get_start_distribution` accepts. Terminal states end
+    episodes and have occupancy 0, so for discount 1 the occupancy is the expected number of visits.
+    Normalize by the sum to get the (normalized) occupancy measure.
+
+    The state occupancy solves d = mu + discount P^pi^T d, either with a sparse direct solver ('direct') or
+    by fix point iteration ('power', see `LinearProgramming.compute_q_table` for the remaining arguments).
+    """
+    compiled_mdp = compiled.compile_mdp(mdp_spec)
+    start_distribution = compiled.get_start_distribution(compiled_mdp.num_states, start_distribution)
+    policy_matrix = compiled_mdp.policy_matrix(policy)
+    transient = ~compiled_mdp.terminal_states
+    reverse_transitions = (policy_matrix @ compiled_mdp.transition_matrix()).T.tocsr()[transient][:, transient]
+    start_distribution = start_distribution[transient]
+
+    info = None
+    if method == 'direct':
+        transient_occupancy = solve_transient(reverse_transitions, start_distribution, compiled_mdp.discount)
+    elif method == 'power':
+        transient_occupancy, info = fix_point_iterate(
+            start_distribution, lambda occupancy: start_distribution + compiled_mdp.discount * (
+                reverse_transitions @ occupancy), max_iterations=max_iterations, all_close=all_close,
+            callback=callback, time_budget=time_budget, target_residual=target_residual)
+    else:
+        raise ValueError('Unknown method %s! Must be direct or power.' % method)
+
+    state_occupancy = np.zeros(compiled_mdp.num_states)
+    state_occupancy[transient] = transient_occupancy
+    occupancy = (policy_matrix.T @ state_occupancy).reshape((compiled_mdp.num_states, compiled_mdp.num_actions))
+    if full_output:
+        return occupancy, info
+    return occupancy
+
+
+def compute_stationary_distribution(mdp_spec, policy, start_distribution=None, max_iterations=10000,
+                                    all_close=None, callback=None, time_budget=None, target_residual=None,
+                                    full_output=False):
+    """Compute the long-run distribution over states when following `policy` forever from `start_distribution`.
+
+    Episodes that reach a terminal state restart from `start_distribution` immediately (like
+    `compiled.BatchEnv`), so terminal states have probability 0. Uses power iteration on the lazy
+    chain (I + P) / 2, which has the same stationary distributions and also converges for periodic chains.
+    See `LinearProgramming.compute_q_table` for the remaining arguments.
+    """
+    compiled_mdp = compiled.compile_mdp(mdp_spec)
+    terminal_states = compiled_mdp.terminal_states
+    # Episodes that start in a terminal state end immediately, so restarts only go to non-terminal states.
+    restart_distribution = compiled.get_start_distribution(compiled_mdp.num_states, start_distribution)
+    restart_distribution[terminal_states] = 0.
+    if not restart_distribution.sum():
+        raise ValueError('All start states are terminal!')
+    restart_distribution /= restart_distribution.sum()
+    reverse_transitions = (compiled_mdp.policy_matrix(policy) @ compiled_mdp.transition_matrix()).T.tocsr()
+
+    def iterate(distribution):
+        next_distribution = reverse_transitions @ distribution
+        restarts = next_distribution[terminal_states].sum()
+        next_distribution[terminal_states] = 0.
+        next_distribution += restarts * restart_distribution
+        next_distribution += distribution
+        next_distribution *= 0.5
+        return next_distribution
+
+    distribution, info = fix_point_iterate(restart_distribution, iterate, max_iterations=max_iterations,
+                                           all_close=all_close, callback=callback, time_budget=time_budget,
+                                           target_residual=target_residual)
+    if full_output:
+        return distribution, info
+    return distribution
+
+
+def _proper_policy(compiled_mdp: compiled.CompiledMDP):
+    """Return a deterministic policy that terminates with probability 1 from every state.
+
+    States are added in layers going backwards from the terminal states: a state joins with an action that
+    reaches an earlier layer with positive probability. Raises ValueError for states that cannot terminate.
+    """
+    transitions = compiled_mdp.transition_matrix()
+    policy = np.zeros(compiled_mdp.num_states, dtype=np.int64)
+    reached = compiled_mdp.terminal_states.copy()
+    while not reached.all():
+        reaches_layer = (transitions @ reached.astype(np.float64)).reshape(
+            (compiled_mdp.num_states, compiled_mdp.num_actions)) > 0
+        new_states = ~reached & reaches_layer.any(axis=-1)
+        if not new_states.any():
+            raise ValueError('States %s cannot reach a terminal state!' % [
+                compiled_mdp.mdp_spec.states[i] for i in np.flatnonzero(~reached)])
+        policy[new_states] = reaches_layer[new_states].argmax(axis=-1)
+        reached |= new_states
+    return policy
+
+
+def _improper_states(compiled_mdp: compiled.CompiledMDP, policy):
+    """Return a mask of the states from which `policy` never reaches a terminal state."""
+    policy_transitions = compiled_mdp.policy_matrix(policy) @ compiled_mdp.transition_matrix()
+    reached = compiled_mdp.terminal_states.copy()
+    while True:
+        new_reached = reached | (policy_transitions @ reached.astype(np.float64) > 0)
+        if (new_reached == reached).all():
+            return ~reached
+        reached = new_reached
+
+
+def solve_transient(transitions, rewards, discount):
+    """Solve (I - discount * transitions) v = rewards with a sparse direct solver."""
+    import scipy.sparse
+    import scipy.sparse.linalg
+
+    system = scipy.sparse.identity(transitions.shape[0], format='csc') - discount * transitions
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', scipy.sparse.linalg.MatrixRankWarning)
+        solution = np.atleast_1d(scipy.sparse.linalg.spsolve(system.tocsc(), rewards))
+    if not np.all(np.isfinite(solution)):
+        raise ValueError('Singular system: the policy does not terminate with probability 1!')
+    return solution
+
+
+class _ConvergenceCheck(object):
+    """Same as `np.allclose` (plus the max-norm residual) but computed in preallocated buffers."""
+
+    def __init__(self, like, rtol=1e-05, atol=1e-08):
+        self.rtol = rtol
+        self.atol = atol
+        self._difference = np.empty_like(like)
+        self._tolerance = np.empty_like(like)
+        self._close = np.empty(np.shape(like), dtype=bool)
+
+    def __call__(self, value, next_value):
+        if not self._difference.size:
+            return 0., True
+        np.subtract(next_value, value, out=self._difference)
+        np.abs(self._difference, out=self._difference)
+        np.abs(next_value, out=self._tolerance)
+        self._tolerance *= self.rtol
+        self._tolerance += self.atol
+        np.less_equal(self._difference, self._tolerance, out=self._close)
+        return float(self._difference.max()), bool(self._close.all())
+
+
+FixPointInfo = collections.namedtuple('FixPointInfo', ['iterations', 'residual', 'error_bound', 'converged'])
+FixPointInfo.__doc__ = """Progress of a fix point iteration.
+
+`residual` is the max-norm change of the last iteration. For a discount < 1, `error_bound` bounds the
+max-norm distance of the returned value to the fix point (discount / (1 - discount) * residual);
+otherwise it is infinite.
+"""
+
+
+def fix_point_iterate(initial, iterate, max_iterations, all_close=None, callback=None, time_budget=None,
+                      target_residual=None, discount=1.):
+    """Apply `iterate` from `initial` until convergence and return (value, FixPointInfo).
+
+    Shared by all iterative solvers. Stops early without raising if `callback` returns True,
+    `time_budget` runs out or the residual drops below `target_residual`.
+    """
+    convergence_check = _ConvergenceCheck(initial) if not all_close else None
+    if time_budget is not None:
+        deadline = time.perf_counter() + time_budget
+
+    def info(iterations, residual, converged):
+        error_bound = discount / (1. - discount) * residual if discount < 1. else np.inf
+        return FixPointInfo(iterations, residual, error_bound, converged)
 
     value = initial
-    for _ in range(max_iterations):
-        next_value = iterate(value)
-        if all_close(value, next_value):
-            return next_value
+    for iteration in range(1, max_iterations + 1):
+        if instrumentation.enabled:
+            start_time = time.perf_counter()
+            next_value = iterate(value)
+            instrumentation.record_time('solver.iteration', time.perf_counter() - start_time)
+        else:
+            next_value = iterate(value)
+        if convergence_check:
+            residual, converged = convergence_check(value, next_value)
+        else:
+            residual = float(np.abs(next_value - value).max()) if np.size(value) else 0.
+            converged = all_close(value, next_value)
+        if instrumentation.enabled:
+            instrumentation.gauge('solver.residual', residual)
+
+        if converged or (target_residual is not None and residual <= target_residual):
+            return next_value, info(iteration, residual, True)
+        if callback is not None and callback(iteration, next_value, residual):
+            return next_value, info(iteration, residual, False)
+        if time_budget is not None and time.perf_counter() >= deadline:
+            return next_value, info(iteration, residual, False)
         value = next_value
     raise ValueError('No convergence after %s iterations!\n%s' % (max_iterations, value))
@@ -0,0 +1,164 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Off-policy evaluation of target policies from trajectories logged under a behavior policy.
+
+Policies are (num_states, num_actions) matrices of action probabilities; target policies can also be
+vectors of action indices. Target policies can have leading batch dimensions, e.g.
+(num_policies, num_states, num_actions), to evaluate many policies at once; the estimates then have
+the batch shape.
+"""
+import numpy as np
+
+
+class Trajectories(object):
+    """Episodes padded to (num_episodes, max_length) arrays of states, actions and rewards."""
+
+    def __init__(self, states, actions, rewards, lengths):
+        self.states = np.asarray(states)
+        self.actions = np.asarray(actions)
+        self.lengths = np.asarray(lengths)
+        self.mask = np.arange(self.states.shape[1]) < self.lengths[:, np.newaxis]
+        # Padding has no reward.
+        self.rewards = np.where(self.mask, rewards, 0.)
+
+    @property
+    def num_episodes(self):
+        return len(self.lengths)
+
+    @classmethod
+    def from_episodes(cls, episodes):
+        """Pad a list of episodes, each a list of (state, action, reward) tuples."""
+        lengths = np.array([len(episode) for episode in episodes], dtype=np.int64)
+        shape = (len(episodes), lengths.max(initial=0))
+        states = np.zeros(shape, dtype=np.int64)
+        actions = np.zeros(shape, dtype=np.int64)
+        rewards = np.zeros(shape)
+        for i, episode in enumerate(episodes):
+            if episode:
+                states[i, :len(episode)], actions[i, :len(episode)], rewards[i, :len(episode)] = zip(*episode)
+        return cls(states, actions, rewards, lengths)
+
+    @classmethod
+    def from_transitions(cls, states, actions, rewards, dones):
+        """Split consecutive logged transitions (e.g. `recording.TrajectoryReader` columns) at the dones.
+
+        A trailing episode without done is kept as a truncated episode.
+        """
+        dones = np.asarray(dones, dtype=bool)
+        episode_starts = np.concatenate([[0], np.flatnonzero(dones[:-1]) + 1])
+        episode_ids = np.cumsum(np.concatenate([[False], dones[:-1]]))
+        lengths = np.diff(np.concatenate([episode_starts, [len(dones)]]))
+        if not len(dones):
+            episode_starts, lengths = episode_starts[:0], lengths[:0]
+        steps = np.arange(len(dones)) - episode_starts[episode_ids]
+
+        shape = (len(lengths), lengths.max(initial=0))
+        padded = []
+        for column in (states, actions, rewards):
+            column = np.asarray(column)
+            padded_column = np.zeros(shape, dtype=column.dtype)
+            padded_column[episode_ids, steps] = column
+            padded.append(padded_column)
+        return cls(*padded, lengths=lengths)
+
+
+def _policy_matrix(policy, num_actions):
+    policy = np.asarray(policy)
+    if np.issubdtype(policy.dtype, np.integer):
+        return np.eye(num_actions)[policy]
+    return policy.astype(np.float64)
+
+
+def _take_padded(table, indices, padding_value):
+    """Look up `indices` into the flattened last two axes of `table`; index -1 returns `padding_value`."""
+    flat_table = table.reshape(table.shape[:-2] + (-1,))
+    flat_table = np.concatenate([flat_table, np.full(flat_table.shape[:-1] + (1,), padding_value)], axis=-1)
+    return np.take(flat_table, indices, axis=-1)
+
+
+def _row_indices(trajectories, num_actions):
+    return np.where(trajectories.mask, trajectories.states * num_actions + trajectories.actions, -1)
+
+
+def likelihood_ratios(trajectories: Trajectories, target_policy, behavior_policy):
+    """Return the per-step ratios target(a_t | s_t) / behavior(a_t | s_t), which are 1 for padding."""
+    behavior_policy = np.asarray(behavior_policy, dtype=np.float64)
+    target_policy = _policy_matrix(target_policy, behavior_policy.shape[-1])
+    rows = _row_indices(trajectories, behavior_policy.shape[-1])
+    if np.any(behavior_policy == 0) and np.any(_take_padded(behavior_policy, rows, 1.) == 0):
+        raise ValueError('Logged actions have probability 0 under the behavior policy!')
+    # Divide the small policy tables instead of the logged probabilities.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_table = target_policy / behavior_policy
+    return _take_padded(ratio_table, rows, 1.)
+
+
+def _final_ratios(trajectories, target_policy, behavior_policy):
+    """Return w_{0:T}, the products of all ratios of each episode."""
+    return np.prod(likelihood_ratios(trajectories, target_policy, behavior_policy), axis=-1)
+
+
+def _cumulative_ratios(trajectories, target_policy, behavior_policy):
+    """Return w_{0:t}, the products of the ratios up to and including step t."""
+    return np.cumprod(likelihood_ratios(trajectories, target_policy, behavior_policy), axis=-1)
+
+
+def _discounts(trajectories, discount):
+    return discount ** np.arange(trajectories.states.shape[1])
+
+
+def _returns(trajectories, discount):
+    return trajectories.rewards @ _discounts(trajectories, discount)
+
+
+def importance_sampling(trajectories: Trajectories, target_policy, behavior_policy, discount=1.):
+    """Trajectory-wise importance sampling: the mean of w_{0:T} G."""
+    weights = _final_ratios(trajectories, target_policy, behavior_policy)
+    return (weights * _returns(trajectories, discount)).mean(axis=-1)
+
+
+def weighted_importance_sampling(trajectories: Trajectories, target_policy, behavior_policy, discount=1.):
+    """Self-normalized trajectory-wise importance sampling: sum(w_{0:T} G) / sum(w_{0:T}).
+
+    Biased but consistent, and usually of much lower variance. Returns NaN if all weights are 0.
+    """
+    weights = _final_ratios(trajectories, target_policy, behavior_policy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (weights * _returns(trajectories, discount)).sum(axis=-1) / weights.sum(axis=-1)
+
+
+def per_decision_importance_sampling(trajectories: Trajectories, target_policy, behavior_policy, discount=1.):
+    """Per-decision importance sampling: the mean of sum_t discount^t w_{0:t} r_t."""
+    weights = _cumulative_ratios(trajectories, target_policy, behavior_policy)
+    return ((weights * trajectories.rewards) @ _discounts(trajectories, discount)).mean(axis=-1)
+
+
+def doubly_robust(trajectories: Trajectories, target_policy, behavior_policy, q_table, discount=1.):
+    """Doubly robust estimate with a model Q-table of the target policy.
+
+    The mean of sum_t discount^t (w_{0:t} (r_t - Q(s_t, a_t)) + w_{0:t-1} V(s_t)) with
+    V(s) = sum_a target(a | s) Q(s, a). It is unbiased like per-decision importance sampling and has low
+    variance if the Q-table is accurate. `q_table` needs the same batch dimensions as `target_policy` and
+    can come from `distributional.compute_return_moments` on an estimated model, for example.
+    """
+    q_table = np.asarray(q_table, dtype=np.float64)
+    target_policy = _policy_matrix(target_policy, q_table.shape[-1])
+    weights = _cumulative_ratios(trajectories, target_policy, behavior_policy)
+    previous_weights = np.concatenate([np.ones(weights.shape[:-1] + (1,)), weights[..., :-1]], axis=-1)
+
+    v_vector = (target_policy * q_table).sum(axis=-1)
+    q_values = _take_padded(q_table, _row_indices(trajectories, q_table.shape[-1]), 0.)
+    v_values = _take_padded(v_vector[..., np.newaxis], np.where(trajectories.mask, trajectories.states, -1), 0.)
+    terms = weights * (trajectories.rewards - q_values) + previous_weights * v_values
+    return (terms @ _discounts(trajectories, discount)).mean(axis=-1)
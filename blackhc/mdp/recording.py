@@ -0,0 +1,231 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Recording of (state, action, reward, next state, done) transitions to disk for offline RL.
+
+Transitions are written into preallocated columnar chunks. Full chunks are saved as shards of
+one .npy file per column by a background thread, and `TrajectoryReader` memory-maps the shards:
+
+    with recording.RecordingEnv(env, 'transitions') as env:
+        ...
+    batch = recording.TrajectoryReader('transitions').sample(256)
+"""
+import glob
+import os
+import queue
+import threading
+
+import gym
+import numpy as np
+
+from blackhc.mdp import compiled
+
+COLUMNS = (('states', np.int32), ('actions', np.int32), ('rewards', np.float32), ('next_states', np.int32),
+           ('dones', np.bool_))
+
+
+class _Chunk(object):
+    def __init__(self, chunk_size):
+        self.size = 0
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.empty(chunk_size, dtype=dtype))
+
+
+class TrajectoryRecorder(object):
+    """Record transitions into `num_buffers` chunks of `chunk_size` transitions that are flushed to `directory`.
+
+    Memory use is constant: when all chunks are waiting to be saved, recording blocks until one is free.
+    """
+
+    def __init__(self, directory, chunk_size=65536, num_buffers=2):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.num_shards = len(_shard_prefixes(directory))
+
+        self._free_chunks = queue.Queue()
+        for _ in range(num_buffers):
+            self._free_chunks.put(_Chunk(chunk_size))
+        self._full_chunks = queue.Queue()
+        self._error = None
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+        self._chunk = self._free_chunks.get()
+
+    def record(self, state, action, reward, next_state, done):
+        chunk = self._chunk
+        index = chunk.size
+        chunk.states[index] = state
+        chunk.actions[index] = action
+        chunk.rewards[index] = reward
+        chunk.next_states[index] = next_state
+        chunk.dones[index] = done
+        chunk.size = index + 1
+        if chunk.size == self.chunk_size:
+            self.flush()
+
+    def record_batch(self, states, actions, rewards, next_states, dones):
+        """Record arrays of transitions."""
+        columns = [np.broadcast_to(column, np.shape(states)) for column in
+                   (states, actions, rewards, next_states, dones)]
+        start = 0
+        while start < len(states):
+            chunk = self._chunk
+            stop = min(start + self.chunk_size - chunk.size, len(states))
+            for (name, _), column in zip(COLUMNS, columns):
+                getattr(chunk, name)[chunk.size:chunk.size + stop - start] = column[start:stop]
+            chunk.size += stop - start
+            start = stop
+            if chunk.size == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Hand the current chunk to the writer thread, even if it is not full."""
+        self._raise_writer_error()
+        if not self._chunk.size:
+            return
+        self._full_chunks.put((self.num_shards, self._chunk))
+        self.num_shards += 1
+        self._chunk = self._free_chunks.get()
+
+    def close(self):
+        """Flush and wait until all shards are saved."""
+        if not self._writer.is_alive():
+            return
+        self.flush()
+        self._full_chunks.put(None)
+        self._writer.join()
+        self._raise_writer_error()
+
+    def _write_chunks(self):
+        while True:
+            item = self._full_chunks.get()
+            if item is None:
+                return
+            shard, chunk = item
+            try:
+                if self._error is None:
+                    prefix = os.path.join(self.directory, 'shard_%06d' % shard)
+                    # The states column is saved last because it marks a shard as complete for readers.
+                    for name, _ in reversed(COLUMNS):
+                        np.save('%s.%s.npy' % (prefix, name), getattr(chunk, name)[:chunk.size])
+            except Exception as error:
+                self._error = error
+            chunk.size = 0
+            self._free_chunks.put(chunk)
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            raise IOError('Writing shards to %s failed!' % self.directory) from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingEnv(gym.Wrapper):
+    """Record every transition of a wrapped `MDPEnv`. Call `close()` to save the last shard."""
+
+    def __init__(self, env, directory, chunk_size=65536, num_buffers=2):
+        super().__init__(env)
+        self.recorder = TrajectoryRecorder(directory, chunk_size, num_buffers)
+        self._observation = None
+
+    def reset(self):
+        self._observation = self.env.reset()
+        return self._observation
+
+    def step(self, action):
+        observation, reward, is_done, info = self.env.step(action)
+        self.recorder.record(self._observation, action, reward, observation, is_done)
+        self._observation = observation
+        return observation, reward, is_done, info
+
+    def close(self):
+        self.recorder.close()
+        self.env.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingBatchEnv(object):
+    """Record every transition of a wrapped `compiled.BatchEnv`. Call `close()` to save the last shard."""
+
+    def __init__(self, batch_env: compiled.BatchEnv, directory, chunk_size=65536, num_buffers=2):
+        self.batch_env = batch_env
+        self.num_envs = batch_env.num_envs
+        self.recorder = TrajectoryRecorder(directory, chunk_size, num_buffers)
+
+    @property
+    def states(self):
+        return self.batch_env.states
+
+    def reset(self):
+        return self.batch_env.reset()
+
+    def step(self, actions):
+        states = self.batch_env.states
+        next_states, rewards, dones = self.batch_env.step(actions)
+        self.recorder.record_batch(states, actions, rewards, next_states, dones)
+        return next_states, rewards, dones
+
+    def close(self):
+        self.recorder.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TrajectoryReader(object):
+    """Memory-mapped access to the shards in `directory` for replay sampling."""
+
+    def __init__(self, directory):
+        self.shards = [{name: np.load('%s.%s.npy' % (prefix, name), mmap_mode='r') for name, _ in COLUMNS}
+                       for prefix in _shard_prefixes(directory)]
+        self.shard_offsets = np.cumsum([0] + [len(shard['states']) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    def column(self, name):
+        """Return a whole column as one in-memory array."""
+        return np.concatenate([shard[name] for shard in self.shards] or [np.zeros(0, dtype=dict(COLUMNS)[name])])
+
+    def get(self, indices):
+        """Return a dict of columns with the transitions at `indices`."""
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_ids = np.searchsorted(self.shard_offsets, indices, side='right') - 1
+        batch = {name: np.empty(len(indices), dtype=dtype) for name, dtype in COLUMNS}
+        for shard_id in np.unique(shard_ids):
+            picks = shard_ids == shard_id
+            shard_indices = indices[picks] - self.shard_offsets[shard_id]
+            for name, _ in COLUMNS:
+                batch[name][picks] = self.shards[shard_id][name][shard_indices]
+        return batch
+
+    def sample(self, batch_size, random_state=None):
+        """Sample `batch_size` transitions uniformly with replacement."""
+        return self.get(compiled.get_random_state(random_state).randint(len(self), size=batch_size))
+
+
+def _shard_prefixes(directory):
+    return sorted(path[:-len('.states.npy')] for path in glob.glob(os.path.join(directory, 'shard_*.states.npy')))
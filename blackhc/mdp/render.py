@@ -0,0 +1,370 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental rendering of MDP graphs.
+
+Graphviz is only run once per graph to lay it out. The static graph and every highlighted
+node or edge are rasterized once in-process; frames are then composed from these cached
+pixels into a preallocated buffer.
+"""
+import collections
+import io
+import shlex
+
+import networkx as nx
+import numpy as np
+from networkx.utils import make_str
+
+NodeLayout = collections.namedtuple('NodeLayout', ['x', 'y', 'width', 'height', 'shape', 'label'])
+EdgeLayout = collections.namedtuple('EdgeLayout', ['points', 'label', 'label_position'])
+
+
+class GraphLayout(object):
+    """Node positions and edge splines (in inches) of a laid out graph."""
+
+    def __init__(self, width, height, nodes: dict, edges: dict):
+        self.width = width
+        self.height = height
+        self.nodes = nodes
+        self.edges = edges
+
+    @staticmethod
+    def from_graph(graph: nx.MultiDiGraph, prog='dot'):
+        plain = nx.nx_pydot.to_pydot(graph).create(prog=prog, format='plain')
+        return GraphLayout.from_plain(graph, plain)
+
+    @staticmethod
+    def from_plain(graph: nx.MultiDiGraph, plain):
+        """Parse the output of `dot -Tplain` for `graph`."""
+        if isinstance(plain, bytes):
+            plain = plain.decode('utf-8')
+
+        nodes_by_name = {make_str(node): node for node in graph.nodes()}
+        keys_by_name = collections.defaultdict(collections.deque)
+        for u, v, key in graph.edges(keys=True):
+            keys_by_name[make_str(u), make_str(v)].append(key)
+
+        width = height = 0.
+        nodes = {}
+        edges = {}
+        for line in plain.splitlines():
+            tokens = shlex.split(line)
+            if not tokens:
+                continue
+            if tokens[0] == 'graph':
+                width, height = float(tokens[2]), float(tokens[3])
+            elif tokens[0] == 'node':
+                node = nodes_by_name[tokens[1]]
+                attributes = graph.node[node]
+                nodes[node] = NodeLayout(float(tokens[2]), float(tokens[3]), float(tokens[4]), float(tokens[5]),
+                                         attributes.get('shape', 'ellipse'), attributes.get('label', tokens[6]))
+            elif tokens[0] == 'edge':
+                u, v = nodes_by_name[tokens[1]], nodes_by_name[tokens[2]]
+                key = keys_by_name[tokens[1], tokens[2]].popleft()
+                num_points = int(tokens[3])
+                points = np.array(tokens[4:4 + 2 * num_points], dtype=np.float64).reshape((num_points, 2))
+                rest = tokens[4 + 2 * num_points:]
+                label_position = (float(rest[1]), float(rest[2])) if len(rest) == 5 else None
+                edges[u, v, key] = EdgeLayout(points, graph.edge[u][v][key].get('label'), label_position)
+        return GraphLayout(width, height, nodes, edges)
+
+
+class GraphRenderer(object):
+    """Draws a `GraphLayout` once and then only redraws highlighted elements per frame."""
+
+    def __init__(self, layout: GraphLayout, dpi=72):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.layout = layout
+        self.figure = Figure(figsize=(max(layout.width, 0.1), max(layout.height, 0.1)), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_axes([0, 0, 1, 1])
+        self.axes.set_xlim(0, max(layout.width, 0.1))
+        self.axes.set_ylim(0, max(layout.height, 0.1))
+        self.axes.axis('off')
+
+        self.node_artists = {node: self._draw_node(node_layout) for node, node_layout in layout.nodes.items()}
+        self.edge_artists = {edge: self._draw_edge(edge_layout) for edge, edge_layout in layout.edges.items()}
+
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._background_frame = self._canvas_frame().copy()
+        self._sprites = {}
+        self.frame = np.empty_like(self._background_frame)
+
+    def _draw_node(self, node_layout: NodeLayout):
+        from matplotlib.patches import Ellipse
+
+        center = (node_layout.x, node_layout.y)
+        if node_layout.shape == 'point':
+            patches = [Ellipse(center, 0.05, 0.05, facecolor='black', edgecolor='black')]
+            text = None
+        else:
+            patches = [Ellipse(center, node_layout.width, node_layout.height, facecolor='white', edgecolor='black')]
+            if node_layout.shape == 'doublecircle':
+                patches.append(Ellipse(center, node_layout.width - 0.08, node_layout.height - 0.08,
+                                       facecolor='none', edgecolor='black'))
+            text = self.axes.text(node_layout.x, node_layout.y, node_layout.label, ha='center', va='center',
+                                  fontsize=14)
+        for patch in patches:
+            self.axes.add_patch(patch)
+        return patches, text
+
+    def _draw_edge(self, edge_layout: EdgeLayout):
+        from matplotlib.patches import FancyArrowPatch
+        from matplotlib.path import Path
+
+        codes = [Path.MOVETO] + [Path.CURVE4] * (len(edge_layout.points) - 1)
+        arrow = FancyArrowPatch(path=Path(edge_layout.points, codes), arrowstyle='-|>', mutation_scale=10,
+                                color='black', linewidth=1)
+        self.axes.add_patch(arrow)
+        if edge_layout.label and edge_layout.label_position:
+            self.axes.text(edge_layout.label_position[0], edge_layout.label_position[1], edge_layout.label,
+                           ha='center', va='center', fontsize=14)
+        return arrow
+
+    def render(self, node_highlights: dict = None, edge_highlights: dict = None):
+        """Return a RGB uint8 frame with the given graph attributes (see `MDPSpec.graph_highlights`).
+
+        The frame is written into a preallocated buffer that is reused for every frame,
+        so copy it if you need to keep it around.
+        """
+        np.copyto(self.frame, self._background_frame)
+        flat_frame = self.frame.reshape((-1, 3))
+        for element, attributes in self._sorted_highlights(node_highlights, edge_highlights):
+            indices, colors = self._sprite(element, attributes)
+            flat_frame[indices] = colors
+        return self.frame
+
+    def _sorted_highlights(self, node_highlights, edge_highlights):
+        # Nodes are drawn on top of edges.
+        for edge, attributes in (edge_highlights or {}).items():
+            if edge in self.edge_artists:
+                yield edge, attributes
+        for node, attributes in (node_highlights or {}).items():
+            if node in self.node_artists:
+                yield node, attributes
+
+    def _sprite(self, element, attributes):
+        """Return the pixels that change when `element` is highlighted with `attributes`.
+
+        Sprites are rasterized with matplotlib on first use and cached as (flat indices, colors).
+        """
+        key = (element, tuple(sorted(attributes.items())))
+        if key not in self._sprites:
+            self.canvas.restore_region(self._background)
+            if element in self.node_artists:
+                self._draw_highlighted_node(element, attributes)
+            else:
+                self._draw_highlighted_edge(element, attributes)
+            flat_canvas = self._canvas_frame().reshape((-1, 3))
+            indices = np.flatnonzero((flat_canvas != self._background_frame.reshape((-1, 3))).any(axis=-1))
+            self._sprites[key] = (indices, flat_canvas[indices].copy())
+        return self._sprites[key]
+
+    def _draw_highlighted_edge(self, edge, attributes):
+        arrow = self.edge_artists[edge]
+        arrow.set_color(attributes.get('color', 'black'))
+        arrow.set_linewidth(2 if attributes.get('style') == 'bold' else 1)
+        self.axes.draw_artist(arrow)
+        arrow.set_color('black')
+        arrow.set_linewidth(1)
+
+    def _draw_highlighted_node(self, node, attributes):
+        patches, text = self.node_artists[node]
+        outer = patches[0]
+        facecolor, linewidth = outer.get_facecolor(), outer.get_linewidth()
+        if attributes.get('style') == 'filled':
+            outer.set_facecolor(attributes.get('fillcolor', 'lightgrey'))
+        if attributes.get('style') == 'bold':
+            outer.set_linewidth(2)
+        for artist in patches + ([text] if text else []):
+            self.axes.draw_artist(artist)
+        outer.set_facecolor(facecolor)
+        outer.set_linewidth(linewidth)
+
+    def _canvas_frame(self):
+        width, height = self.canvas.get_width_height()
+        rgba = np.frombuffer(self.canvas.buffer_rgba(), dtype=np.uint8).reshape((height, width, 4))
+        return rgba[:, :, :3]
+
+    def render_png(self, node_highlights: dict = None, edge_highlights: dict = None):
+        from matplotlib import image
+
+        png_file = io.BytesIO()
+        image.imsave(png_file, self.render(node_highlights, edge_highlights), format='png')
+        return png_file.getvalue()
+
+
+# Specs with more states than this are rendered through a `GraphView` by `MDPEnv.render`.
+LARGE_MDP_NUM_STATES = 100
+
+
+class StateGroup(object):
+    """A node that stands for a cluster of states in a `GraphView`."""
+
+    def __init__(self, name, states):
+        self.name = name
+        self.states = states
+
+    @property
+    def terminal_state(self):
+        return all(state.terminal_state for state in self.states)
+
+    def __repr__(self):
+        return 'StateGroup(%s, %s)' % (self.name, len(self.states))
+
+
+class GraphView(object):
+    """Reduced graph of a large MDP for rendering.
+
+    Parallel action edges between two nodes are collapsed into one edge, edges with a
+    transition probability below `min_probability` are pruned, and states can be clustered
+    into `StateGroup`s, either by strongly connected component (`cluster_sccs`) or by
+    `groups`, a Dict[State, name] or a callable State -> name (None keeps the state).
+    With `radius` set, only the nodes within `radius` hops of the center state are shown.
+    """
+
+    def __init__(self, mdp_spec, radius=None, min_probability=0., groups=None, cluster_sccs=False,
+                 transitions=None, max_cached_layouts=16):
+        from blackhc import mdp
+
+        self.mdp_spec = mdp_spec
+        self.radius = radius
+        self.max_cached_layouts = max_cached_layouts
+        self._renderers = collections.OrderedDict()
+
+        transitions = transitions or mdp.Transitions(mdp_spec)
+        # successors[state][next_state] = (max probability, action names)
+        successors = collections.defaultdict(dict)
+        for (state, action), next_states in transitions.next_states.items():
+            for next_state, prob in next_states.items():
+                if prob < min_probability or not prob:
+                    continue
+                max_prob, action_names = successors[state].get(next_state, (0., []))
+                successors[state][next_state] = (max(max_prob, prob), action_names + [action.name])
+
+        if cluster_sccs:
+            state_graph = nx.DiGraph()
+            state_graph.add_nodes_from(mdp_spec.states)
+            state_graph.add_edges_from((state, next_state) for state, next_states in successors.items()
+                                       for next_state in next_states)
+            components = sorted(nx.strongly_connected_components(state_graph),
+                                key=lambda component: min(state.index for state in component))
+            group_names = {state: 'C%s' % i for i, component in enumerate(components) if len(component) > 1
+                           for state in component}
+            group_of = group_names.get
+        elif isinstance(groups, dict):
+            group_of = groups.get
+        else:
+            group_of = groups or (lambda state: None)
+
+        members = collections.defaultdict(list)
+        for state in mdp_spec.states:
+            name = group_of(state)
+            if name is not None:
+                members[name].append(state)
+        group_nodes = {name: StateGroup(name, states) for name, states in members.items()}
+        self.node_of = {state: state for state in mdp_spec.states}
+        for group in group_nodes.values():
+            for state in group.states:
+                self.node_of[state] = group
+
+        self.successors = collections.defaultdict(dict)
+        self.predecessors = collections.defaultdict(set)
+        for state, next_states in successors.items():
+            node = self.node_of[state]
+            for next_state, (prob, action_names) in next_states.items():
+                next_node = self.node_of[next_state]
+                if node is next_node and isinstance(node, StateGroup):
+                    continue
+                max_prob, all_action_names = self.successors[node].get(next_node, (0., []))
+                self.successors[node][next_node] = (max(max_prob, prob), all_action_names + action_names)
+                self.predecessors[next_node].add(node)
+
+    def neighborhood(self, center_state):
+        """Return the nodes within `radius` hops (in either direction) of `center_state`."""
+        if self.radius is None or center_state is None:
+            return set(self.node_of.values())
+
+        center = self.node_of[center_state]
+        nodes = {center}
+        frontier = [center]
+        for _ in range(self.radius):
+            next_frontier = []
+            for node in frontier:
+                for neighbor in list(self.successors[node]) + list(self.predecessors[node]):
+                    if neighbor not in nodes:
+                        nodes.add(neighbor)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        return nodes
+
+    def to_graph(self, center_state=None):
+        nodes = self.neighborhood(center_state)
+
+        graph = nx.MultiDiGraph()
+        for node in sorted(nodes, key=_node_order):
+            if isinstance(node, StateGroup):
+                graph.add_node(node, label='%s (%s)' % (node.name, len(node.states)), shape='box')
+            else:
+                graph.add_node(node, label=node.name)
+            if node.terminal_state:
+                graph.node[node]['shape'] = 'doublecircle'
+
+        for node in sorted(nodes, key=_node_order):
+            for next_node, (prob, action_names) in self.successors[node].items():
+                if next_node not in nodes:
+                    continue
+                action_names = sorted(set(action_names))
+                label = ','.join(action_names[:3]) + (',...' if len(action_names) > 3 else '')
+                if prob < 1.:
+                    label += ' %3.2f%%' % (prob * 100)
+                graph.add_edge(node, next_node, key=0, label=label)
+        return graph
+
+    def graph_highlights(self, highlight_state=None, highlight_action=None, highlight_next_state=None):
+        """Same as `MDPSpec.graph_highlights` but for the nodes and edges of this view."""
+        node = self.node_of.get(highlight_state)
+        next_node = self.node_of.get(highlight_next_state)
+
+        node_highlights = {}
+        edge_highlights = {}
+        if node is not None:
+            node_highlights[node] = dict(fillcolor='yellow', style='filled')
+        if next_node is not None:
+            node_highlights[next_node] = dict(fillcolor='red', style='filled')
+        if node is not None and next_node is not None and highlight_action is not None:
+            edge_highlights[node, next_node, 0] = dict(style='bold', color='red')
+        return node_highlights, edge_highlights
+
+    def renderer(self, center_state=None):
+        """Return a `GraphRenderer` for the neighborhood of `center_state`.
+
+        Layouts are cached per neighborhood, so Graphviz only runs when a new region is entered.
+        """
+        key = frozenset(self.neighborhood(center_state))
+        if key in self._renderers:
+            self._renderers.move_to_end(key)
+        else:
+            self._renderers[key] = GraphRenderer(GraphLayout.from_graph(self.to_graph(center_state)))
+            if len(self._renderers) > self.max_cached_layouts:
+                self._renderers.popitem(last=False)
+        return self._renderers[key]
+
+
+def _node_order(node):
+    if isinstance(node, StateGroup):
+        return 0, str(node.name)
+    return 1, node.index
@@ -0,0 +1,250 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Heuristic search solvers that only back up states reachable from the start state.
+
+RTDP, Labeled RTDP and LAO* start from optimistic (admissible) upper bounds on the values and
+only touch the states that the greedy policy can reach, which is often a small fraction of the
+state space. They work on compiled MDPs and on lazily expanded `implicit.ImplicitMDP`s.
+"""
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+from blackhc.mdp import implicit
+
+
+class _CompiledModel(object):
+    def __init__(self, compiled_mdp: compiled.CompiledMDP):
+        self.compiled_mdp = compiled_mdp
+        self.discount = compiled_mdp.discount
+        self.num_actions = compiled_mdp.num_actions
+        self.reward_range = (compiled_mdp.reward_values.min(initial=0.), compiled_mdp.reward_values.max(initial=0.))
+
+    def is_terminal(self, state):
+        return self.compiled_mdp.terminal_states[state]
+
+    def expand(self, state):
+        """Return (next states, probs, expected reward) per action."""
+        compiled_mdp = self.compiled_mdp
+        expansion = []
+        for action in range(self.num_actions):
+            row = state * self.num_actions + action
+            entries = slice(compiled_mdp.next_state_indptr[row], compiled_mdp.next_state_indptr[row + 1])
+            expansion.append((compiled_mdp.next_state_indices[entries], compiled_mdp.next_state_probs[entries],
+                              compiled_mdp.expected_rewards[state, action]))
+        return expansion
+
+
+class _ImplicitModel(object):
+    def __init__(self, implicit_mdp: implicit.ImplicitMDP):
+        self.implicit_mdp = implicit_mdp
+        self.discount = implicit_mdp.discount
+        self.num_actions = implicit_mdp.num_actions
+        self.reward_range = None
+
+    def is_terminal(self, state):
+        return self.implicit_mdp.is_terminal(state)
+
+    def expand(self, state):
+        return [(next_states, probs, probs @ rewards) for next_states, probs, rewards in
+                self.implicit_mdp.expand(state)]
+
+
+class HeuristicSearch(object):
+    """RTDP, Labeled RTDP and LAO* on a compiled or implicit MDP.
+
+    `values` maps the touched states to upper bounds on their optimal values. Untouched states are bounded
+    by `upper_bound`, a number or a function of the state index. By default it is derived from the reward
+    range as max(reward_max, 0) / (1 - discount); for discount 1 this requires reward_max <= 0.
+    `reward_range` is computed for compiled MDPs and has to be given for implicit MDPs.
+
+    The values persist between calls, so the algorithms can be resumed or combined.
+    """
+
+    def __init__(self, mdp_spec, start_state=None, upper_bound=None, reward_range=None, random_state=None):
+        if isinstance(mdp_spec, implicit.ImplicitMDP):
+            self.model = _ImplicitModel(mdp_spec)
+            self.start_state = mdp_spec.start_state if start_state is None else start_state
+        else:
+            self.model = _CompiledModel(compiled.compile_mdp(mdp_spec))
+            self.start_state = 0 if start_state is None else start_state
+        if isinstance(self.start_state, mdp.State):
+            self.start_state = self.start_state.index
+        self.discount = self.model.discount
+        self.random_state = compiled.get_random_state(random_state)
+
+        if upper_bound is None:
+            reward_range = reward_range or self.model.reward_range
+            if reward_range is None:
+                raise ValueError('Implicit MDPs need a reward_range or an upper_bound!')
+            reward_max = max(reward_range[1], 0.)
+            if self.discount < 1.:
+                upper_bound = reward_max / (1. - self.discount)
+            elif reward_max == 0.:
+                upper_bound = 0.
+            else:
+                raise ValueError('Positive rewards without discount need an explicit upper_bound!')
+        self.upper_bound = upper_bound if callable(upper_bound) else (lambda state: upper_bound)
+
+        self.values = {}
+        self.solved = set()
+        self.expanded = set()
+        self.num_backups = 0
+
+    def value(self, state):
+        value = self.values.get(state)
+        if value is None:
+            value = 0. if self.model.is_terminal(state) else self.upper_bound(state)
+            self.values[state] = value
+        return value
+
+    def q_values(self, state):
+        return np.array([expected_reward + self.discount * sum(prob * self.value(next_state)
+                                                               for next_state, prob in zip(next_states, probs))
+                         for next_states, probs, expected_reward in self.model.expand(state)])
+
+    def greedy_action(self, state):
+        return int(np.argmax(self.q_values(state)))
+
+    def _residual(self, state):
+        """Return the Bellman residual, the greedy action and its Q value without updating the value."""
+        if self.model.is_terminal(state):
+            return 0., 0, 0.
+        q_values = self.q_values(state)
+        action = int(np.argmax(q_values))
+        return abs(q_values[action] - self.value(state)), action, q_values[action]
+
+    def backup(self, state):
+        """Update the value of `state` and return (residual, greedy action)."""
+        residual, action, q_value = self._residual(state)
+        if not self.model.is_terminal(state):
+            self.values[state] = q_value
+            self.num_backups += 1
+        return residual, action
+
+    def _sample_next_state(self, state, action):
+        next_states, probs, _ = self.model.expand(state)[action]
+        index = np.searchsorted(np.cumsum(probs), self.random_state.random_sample() * probs.sum(), side='right')
+        return int(next_states[min(index, len(next_states) - 1)])
+
+    def rtdp(self, num_trials=1000, max_depth=1000):
+        """Run RTDP trials: follow the greedy policy from the start state and back up the visited states."""
+        for _ in range(num_trials):
+            state = self.start_state
+            for _ in range(max_depth):
+                if self.model.is_terminal(state):
+                    break
+                _, action = self.backup(state)
+                state = self._sample_next_state(state, action)
+        return self.value(self.start_state)
+
+    def _check_solved(self, state, epsilon):
+        """Label the greedy graph below `state` as solved if all its residuals are at most `epsilon`."""
+        solved = True
+        open_states = [] if state in self.solved else [state]
+        seen = set(open_states)
+        closed_states = []
+        while open_states:
+            state = open_states.pop()
+            closed_states.append(state)
+            if self.model.is_terminal(state):
+                continue
+            residual, action, _ = self._residual(state)
+            if residual > epsilon:
+                solved = False
+                continue
+            for next_state in self.model.expand(state)[action][0]:
+                next_state = int(next_state)
+                if next_state not in self.solved and next_state not in seen:
+                    seen.add(next_state)
+                    open_states.append(next_state)
+        if solved:
+            self.solved.update(closed_states)
+        else:
+            for state in reversed(closed_states):
+                self.backup(state)
+        return solved
+
+    def lrtdp(self, epsilon=1e-6, max_trials=100000, max_depth=1000):
+        """Run Labeled RTDP until the start state is solved to residual `epsilon`. Returns its value."""
+        for _ in range(max_trials):
+            if self.start_state in self.solved:
+                break
+            visited = []
+            state = self.start_state
+            while state not in self.solved and len(visited) < max_depth:
+                visited.append(state)
+                if self.model.is_terminal(state):
+                    break
+                _, action = self.backup(state)
+                state = self._sample_next_state(state, action)
+            while visited and self._check_solved(visited.pop(), epsilon):
+                pass
+        return self.value(self.start_state)
+
+    def lao_star(self, epsilon=1e-6, max_iterations=100000):
+        """Run (improved) LAO* until the greedy solution graph is fully expanded and has residuals below `epsilon`.
+
+        Every iteration expands the tips of the greedy solution graph and backs up its states in depth-first
+        postorder. Returns the value of the start state.
+        """
+        for _ in range(max_iterations):
+            num_expanded = 0
+            max_residual = 0.
+            visited = {self.start_state}
+            stack = [(self.start_state, False)]
+            while stack:
+                state, children_done = stack.pop()
+                if children_done:
+                    residual, _ = self.backup(state)
+                    max_residual = max(max_residual, residual)
+                    continue
+                if self.model.is_terminal(state):
+                    continue
+                if state not in self.expanded:
+                    # Expanding a tip initializes its successors; they are traversed in the next iteration.
+                    self.expanded.add(state)
+                    num_expanded += 1
+                    self.backup(state)
+                    max_residual = np.inf
+                    continue
+                stack.append((state, True))
+                for next_state in self.model.expand(state)[self.greedy_action(state)][0]:
+                    next_state = int(next_state)
+                    if next_state not in visited:
+                        visited.add(next_state)
+                        stack.append((next_state, False))
+            if not num_expanded and max_residual <= epsilon:
+                break
+        return self.value(self.start_state)
+
+    def solution_states(self):
+        """Return the states that the greedy policy can reach from the start state."""
+        states = {self.start_state}
+        stack = [self.start_state]
+        while stack:
+            state = stack.pop()
+            if self.model.is_terminal(state):
+                continue
+            for next_state in self.model.expand(state)[self.greedy_action(state)][0]:
+                next_state = int(next_state)
+                if next_state not in states:
+                    states.add(next_state)
+                    stack.append(next_state)
+        return states
+
+    def greedy_policy(self):
+        """Return the greedy actions of the non-terminal states in the solution graph as a dict."""
+        return {state: self.greedy_action(state) for state in self.solution_states()
+                if not self.model.is_terminal(state)}
@@ -0,0 +1,93 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batched Monte Carlo simulation of whole episodes under a fixed policy."""
+import collections
+
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+
+EpisodeStatistics = collections.namedtuple('EpisodeStatistics', ['returns', 'lengths', 'visit_counts', 'truncated'])
+EpisodeStatistics.__doc__ = """Results of `PolicySimulator.simulate`.
+
+`returns` and `lengths` are the discounted return and number of steps of every episode, `visit_counts`
+counts how often every state was acted in over all episodes, and `truncated` marks the episodes that
+hit `max_length` before reaching a terminal state.
+"""
+
+
+class PolicySimulator(object):
+    """Simulate the Markov chain induced by a fixed `policy` for many episodes at once.
+
+    `policy` is a (num_states, num_actions) matrix of action probabilities or a vector of action indices.
+    All episodes are advanced together, one vectorized step at a time, and finished episodes are dropped.
+    """
+
+    def __init__(self, mdp_spec, policy):
+        self.compiled_mdp = compiled.compile_mdp(mdp_spec)
+        policy = np.asarray(policy)
+        if policy.ndim == 1:
+            self.actions = policy.astype(np.int64)
+            self.action_cumprobs = None
+        else:
+            self.actions = None
+            # Validates the shape.
+            self.compiled_mdp.policy_matrix(policy)
+            self.action_cumprobs = np.cumsum(policy, axis=-1)
+            self.action_cumprobs[:, -1] = 1.
+
+    def _sample_actions(self, states, random_state):
+        if self.actions is not None:
+            return self.actions[states]
+        uniforms = random_state.random_sample((len(states), 1))
+        return (self.action_cumprobs[states] <= uniforms).sum(axis=-1)
+
+    def simulate(self, num_episodes, start_state=0, max_length=1000, random_state=None) -> EpisodeStatistics:
+        random_state = compiled.get_random_state(random_state)
+        if isinstance(start_state, mdp.State):
+            start_state = start_state.index
+        compiled_mdp = self.compiled_mdp
+
+        returns = np.zeros(num_episodes)
+        lengths = np.zeros(num_episodes, dtype=np.int64)
+        visit_counts = np.zeros(compiled_mdp.num_states, dtype=np.int64)
+
+        episodes = np.arange(num_episodes)
+        if compiled_mdp.terminal_states[start_state]:
+            episodes = episodes[:0]
+        states = np.full(len(episodes), start_state, dtype=np.int64)
+        discount_factor = 1.
+        for _ in range(max_length):
+            if not len(episodes):
+                break
+            visit_counts += np.bincount(states, minlength=compiled_mdp.num_states)
+            next_states, rewards = compiled_mdp.sample(states, self._sample_actions(states, random_state),
+                                                       random_state=random_state)
+            returns[episodes] += discount_factor * rewards
+            lengths[episodes] += 1
+            discount_factor *= compiled_mdp.discount
+
+            running = ~compiled_mdp.terminal_states[next_states]
+            episodes, states = episodes[running], next_states[running]
+
+        truncated = np.zeros(num_episodes, dtype=bool)
+        truncated[episodes] = True
+        return EpisodeStatistics(returns, lengths, visit_counts, truncated)
+
+
+def simulate_episodes(mdp_spec, policy, num_episodes, start_state=0, max_length=1000,
+                      random_state=None) -> EpisodeStatistics:
+    """Shorthand for `PolicySimulator(mdp_spec, policy).simulate(...)`."""
+    return PolicySimulator(mdp_spec, policy).simulate(num_episodes, start_state, max_length, random_state)
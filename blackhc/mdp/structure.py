@@ -0,0 +1,95 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Structural analysis of compiled MDPs: reachability, SCCs and the condensation DAG."""
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from blackhc import mdp
+from blackhc.mdp import compiled
+
+
+class StructuralIndex(object):
+    """Graph structure of a compiled MDP (an edge s -> s' exists if any action can lead from s to s').
+
+    `layers` lists the strongly connected components that are reachable from `start_state` in reverse
+    topological order, grouped so that all successors of a layer's components are in earlier layers.
+    All components in a layer can thus be solved together once the earlier layers are solved.
+    """
+
+    def __init__(self, mdp_spec, start_state=None):
+        self.compiled_mdp = compiled.compile_mdp(mdp_spec)
+        num_states = self.compiled_mdp.num_states
+
+        indptr = self.compiled_mdp.next_state_indptr
+        sources = np.repeat(np.arange(self.compiled_mdp.num_rows), np.diff(indptr)) // self.compiled_mdp.num_actions
+        targets = self.compiled_mdp.next_state_indices
+        nonzero = self.compiled_mdp.next_state_probs > 0
+        sources, targets = sources[nonzero], targets[nonzero]
+        self.state_graph = _binary_csr(sources, targets, (num_states, num_states))
+
+        self.reachable = np.ones(num_states, dtype=bool)
+        if start_state is not None:
+            if isinstance(start_state, mdp.State):
+                start_state = start_state.index
+            self.reachable[:] = False
+            self.reachable[scipy.sparse.csgraph.breadth_first_order(self.state_graph, start_state, directed=True,
+                                                                    return_predecessors=False)] = True
+
+        self.num_components, self.component_labels = scipy.sparse.csgraph.connected_components(
+            self.state_graph, directed=True, connection='strong')
+        component_sizes = np.bincount(self.component_labels, minlength=self.num_components)
+        self._states_by_component = np.argsort(self.component_labels, kind='mergesort')
+        self._component_starts = np.concatenate([[0], np.cumsum(component_sizes)])
+        self_loops = np.zeros(self.num_components, dtype=bool)
+        self_loops[self.component_labels[sources[sources == targets]]] = True
+        self.cyclic_components = (component_sizes > 1) | self_loops
+
+        between = self.component_labels[sources] != self.component_labels[targets]
+        self.condensation = _binary_csr(self.component_labels[sources[between]],
+                                        self.component_labels[targets[between]],
+                                        (self.num_components, self.num_components))
+
+        reachable_components = np.zeros(self.num_components, dtype=bool)
+        reachable_components[self.component_labels[self.reachable]] = True
+        self.layers = [layer[reachable_components[layer]] for layer in _reverse_topological_layers(self.condensation)]
+        self.layers = [layer for layer in self.layers if len(layer)]
+
+    def component_states(self, components):
+        """Return the indices of the states in `components`."""
+        return np.concatenate([self._states_by_component[self._component_starts[component]:
+                                                         self._component_starts[component + 1]]
+                               for component in components])
+
+
+def _binary_csr(rows, columns, shape):
+    matrix = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.
+    return matrix
+
+
+def _reverse_topological_layers(dag):
+    """Peel off the sinks of `dag` layer by layer."""
+    remaining_successors = np.diff(dag.indptr)
+    predecessors = dag.T.tocsr()
+    layers = []
+    layer = np.flatnonzero(remaining_successors == 0)
+    while len(layer):
+        layers.append(layer)
+        layer_predecessors = predecessors[layer].indices
+        np.add.at(remaining_successors, layer_predecessors, -1)
+        layer_predecessors = np.unique(layer_predecessors)
+        layer = layer_predecessors[remaining_successors[layer_predecessors] == 0]
+    return layers
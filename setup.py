@@ -82,7 +82,17 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['gym>=0.9.2', 'numpy', 'matplotlib', 'networkx>=1.11.0,<2.0.0', 'pydotplus', 'ipython>=6.1.0', 'ipywidgets', 'typing'],
+    install_requires=[
+        'gym>=0.9.2',
+        'numpy',
+        'matplotlib',
+        'networkx>=1.11.0,<2.0.0',
+        'pydotplus',
+        'ipython>=6.1.0',
+        'ipywidgets',
+        'typing',
+        'scipy',
+    ],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
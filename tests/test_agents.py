@@ -0,0 +1,64 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import agents
+from blackhc.mdp import compiled
+from blackhc.mdp import example
+from blackhc.mdp import lp
+
+
+@pytest.mark.parametrize('agent_class', [agents.QLearning, agents.Sarsa, agents.ExpectedSarsa])
+def test_convergence(agent_class):
+    spec = example.TWO_ROUND_NMDP
+    compiled_mdp = compiled.CompiledMDP(spec)
+    exact_q_table = lp.LinearProgramming(spec).compute_q_table()
+
+    agent = agent_class(spec.num_states, spec.num_actions, spec.discount, epsilon=0.05, random_state=0)
+    env = compiled.BatchEnv(compiled_mdp, num_envs=256, random_state=1)
+    distances = agents.train(agent, env, num_steps=2000, exact_q_table=exact_q_table)
+
+    assert len(distances) == 20
+    # The SARSA variants learn the Q-table of the epsilon-greedy policy, which is close for a small epsilon.
+    assert distances[-1][1] < 0.2
+
+
+def test_repeated_pairs_in_a_batch_are_averaged():
+    states = np.zeros(10, dtype=np.int64)
+    actions = np.zeros(10, dtype=np.int64)
+    rewards = np.arange(10.)
+    dones = np.ones(10, dtype=bool)
+
+    agent = agents.QLearning(2, 2, 0.9, learning_rate=0.5)
+    agent.update(states, actions, rewards, states, dones, actions)
+    assert agent.q_table[0, 0] == pytest.approx(0.5 * 4.5)
+
+    agent = agents.QLearning(2, 2, 0.9)
+    agent.update(states[:4], actions[:4], rewards[:4], states[:4], dones[:4], actions[:4])
+    agent.update(states, actions, rewards, states, dones, actions)
+    # The sample average of all 14 rewards.
+    assert agent.q_table[0, 0] == pytest.approx((6. + 45.) / 14)
+    assert agent.visits[0, 0] == 14
+
+
+def test_policy_matches_act_on_ties():
+    agent = agents.QLearning(1, 3, 0.9, epsilon=0.3, random_state=0)
+    agent.q_table[0] = [1., 1., 0.]
+    np.testing.assert_allclose(agent.policy([0]), [[0.45, 0.45, 0.1]])
+    counts = np.bincount(agent.act(np.zeros(20000, dtype=np.int64)), minlength=3)
+    np.testing.assert_allclose(counts / 20000, agent.policy([0])[0], atol=0.02)
+
+    with pytest.raises(TypeError):
+        agents.TabularAgent(1, 3, 0.9)
@@ -0,0 +1,53 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc.mdp import aggregation
+from blackhc.mdp import dsl
+from blackhc.mdp import example
+from blackhc.mdp import lp
+
+
+# noinspection PyStatementEffect
+def test_minimize_merges_bisimilar_states():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        left = dsl.state()
+        right = dsl.state()
+        other = dsl.state()
+        end = dsl.terminal_state()
+        action_0 = dsl.action()
+        action_1 = dsl.action()
+
+        start & action_0 > left | right
+        start & action_1 > other
+        (left | right) & (action_0 | action_1) > end | dsl.reward(1)
+        other & (action_0 | action_1) > end | dsl.reward(2)
+
+    minimized = aggregation.minimize(new_mdp)
+
+    assert minimized.mdp_spec.num_states == 4
+    assert minimized.state_mapping[1] == minimized.state_mapping[2]
+    assert minimized.state_mapping[1] != minimized.state_mapping[3]
+
+    original_q_table = lp.LinearProgramming(new_mdp).compute_q_table()
+    q_table = lp.LinearProgramming(minimized.mdp_spec).compute_q_table()
+    assert np.allclose(minimized.lift(q_table), original_q_table)
+
+
+def test_minimize_keeps_minimal_mdps():
+    minimized = aggregation.minimize(example.TWO_ROUND_NMDP)
+
+    assert minimized.mdp_spec.num_states == 4
+    assert list(minimized.state_mapping) == [0, 1, 2, 3]
@@ -0,0 +1,50 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+from blackhc.mdp import benchmark
+
+
+def test_run_benchmarks(tmpdir):
+    output = str(tmpdir.join('report.json'))
+    benchmark.main(['--output', output, '--config', '{"generator": "chain", "num_states": 10}',
+                    '--env-steps', '100', '--batch-envs', '10'])
+
+    with open(output) as report_file:
+        report = json.load(report_file)
+    result, = report['results']
+    assert result['config'] == dict(generator='chain', num_states=10)
+    assert result['num_states'] == 10
+    assert result['solve_converged']
+    assert result['solve_iterations'] > 0
+    assert result['env_steps_per_second'] > 0
+    assert result['batch_env_steps_per_second'] > 0
+
+
+def test_measure_times_without_tracing():
+    calls = []
+
+    def function():
+        calls.append(benchmark.tracemalloc.is_tracing())
+        return len(calls)
+
+    result, seconds, peak_bytes = benchmark._measure(function)
+    assert calls == [True, False]
+    assert result == 2
+    assert seconds >= 0
+    assert peak_bytes is not None
+
+    _, _, peak_bytes = benchmark._measure(function, trace_memory=False)
+    assert calls[-1] is False
+    assert peak_bytes is None
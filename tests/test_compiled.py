@@ -0,0 +1,110 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import compiled
+from blackhc.mdp import example
+
+
+def test_compiled_arrays():
+    compiled_mdp = compiled.CompiledMDP(example.MULTI_ROUND_NDMP)
+
+    assert compiled_mdp.num_rows == 4
+    assert np.allclose(compiled_mdp.expected_rewards, [[5, 3], [0, 0]])
+    assert list(compiled_mdp.terminal_states) == [False, True]
+    # Terminal states are absorbing.
+    assert list(compiled_mdp.next_state_indices[compiled_mdp.next_state_indptr[2]:]) == [1, 1]
+
+
+def test_sample_frequencies():
+    compiled_mdp = compiled.CompiledMDP(example.MULTI_ROUND_NDMP)
+    random_state = compiled.get_random_state(0)
+
+    rows = np.zeros(100000, dtype=np.int64)
+    next_states = compiled_mdp.sample_next_states(rows, random_state.random_sample(len(rows)))
+    rewards = compiled_mdp.sample_rewards(rows, random_state.random_sample(len(rows)))
+
+    assert np.isclose((next_states == 1).mean(), 2 / 3, atol=0.01)
+    assert np.all(rewards == 5)
+
+
+def test_batch_env_resets_done_envs():
+    compiled_mdp = compiled.CompiledMDP(example.ONE_ROUND_DMDP)
+    env = compiled.BatchEnv(compiled_mdp, num_envs=3, random_state=0)
+
+    assert list(env.reset()) == [0, 0, 0]
+    next_states, rewards, dones = env.step(np.array([0, 1, 1]))
+    assert list(next_states) == [1, 1, 1]
+    assert list(rewards) == [0, 1, 1]
+    assert dones.all()
+    assert list(env.states) == [0, 0, 0]
+
+
+def test_memmapped_transitions_round_trip(tmpdir):
+    compiled_mdp = compiled.CompiledMDP(example.MULTI_ROUND_NDMP)
+    compiled.save_transitions(compiled_mdp, str(tmpdir))
+    transitions = compiled.MemmappedTransitions(str(tmpdir))
+
+    assert (transitions.num_states, transitions.num_actions) == (2, 2)
+    assert transitions.discount == compiled_mdp.discount
+    matrix, rewards = transitions.block(0, 2)
+    assert np.allclose(matrix.toarray(), compiled_mdp.transition_matrix().toarray())
+    assert np.allclose(rewards, compiled_mdp.expected_rewards)
+    matrix, rewards = transitions.block(1, 2)
+    assert np.allclose(matrix.toarray(), [[0, 1], [0, 1]])
+    assert np.allclose(rewards, [[0, 0]])
+
+
+def test_transition_writer_requires_all_rows(tmpdir):
+    with pytest.raises(ValueError):
+        with compiled.TransitionWriter(str(tmpdir), num_states=2, num_actions=1, discount=1.) as writer:
+            writer.write_rows([1], [1], [1.], [0.])
+
+
+def test_sample_generative_model():
+    compiled_mdp = compiled.CompiledMDP(example.MULTI_ROUND_NDMP)
+
+    next_states, rewards = compiled_mdp.sample(np.zeros(2, dtype=np.int64), np.array([0, 1]), n=50000,
+                                               random_state=0)
+
+    assert next_states.shape == rewards.shape == (2, 50000)
+    assert np.isclose((next_states[0] == 1).mean(), 2 / 3, atol=0.01)
+    assert np.allclose(rewards.mean(axis=-1), compiled_mdp.expected_rewards[0])
+    next_state, reward = compiled_mdp.sample(1, 0)
+    assert next_state.shape == reward.shape == ()
+    assert (next_state, reward) == (1, 0)
+
+
+def test_batch_env_start_distribution():
+    compiled_mdp = compiled.CompiledMDP(example.ONE_ROUND_DMDP)
+    with pytest.raises(ValueError):
+        compiled.BatchEnv(compiled_mdp, num_envs=1, start_distribution=[0.5, 0.6])
+
+    # Starting in the terminal state half of the time.
+    env = compiled.BatchEnv(compiled_mdp, num_envs=10000, random_state=0, start_distribution=[0.5, 0.5])
+    assert np.isclose(env.reset().mean(), 0.5, atol=0.02)
+    next_states, _, dones = env.step(np.zeros(10000, dtype=np.int64))
+    assert np.all(next_states == 1) and dones.all()
+    assert np.isclose(env.states.mean(), 0.5, atol=0.02)
+
+
+def test_sample_uses_the_global_random_state_by_default():
+    compiled_mdp = compiled.CompiledMDP(example.TWO_ROUND_NMDP)
+    np.random.seed(0)
+    first = compiled_mdp.sample(0, 0, n=100)
+    np.random.seed(0)
+    second = compiled_mdp.sample(0, 0, n=100)
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
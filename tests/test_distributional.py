@@ -0,0 +1,55 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import distributional
+from blackhc.mdp import example
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+from blackhc.mdp import simulation
+
+
+def test_one_round_distributions_are_exact_on_integer_atoms():
+    evaluation = distributional.CategoricalEvaluation(example.ONE_ROUND_NMDP, np.zeros(2, dtype=np.int64),
+                                                      num_atoms=11, v_min=-1, v_max=9)
+    q_distributions = evaluation.compute_q_distributions()
+
+    assert list(evaluation.atoms) == list(range(-1, 10))
+    assert np.allclose(q_distributions[0, 0], np.eye(11)[1] / 2 + np.eye(11)[6] / 2)
+    assert np.allclose(q_distributions[0, 1], np.eye(11)[2] / 2 + np.eye(11)[4] / 2)
+    # Terminal states return 0.
+    assert np.allclose(evaluation.v_distributions_from_q_distributions(q_distributions)[1], np.eye(11)[1])
+
+
+def test_discount_one_requires_support():
+    with pytest.raises(ValueError):
+        distributional.CategoricalEvaluation(example.ONE_ROUND_NMDP, np.zeros(2, dtype=np.int64))
+
+
+def test_distributions_and_moments_agree_with_sampled_returns():
+    spec = generators.gridworld(3, 3, slip=0.3, step_reward=-0.1, discount=0.9)
+    policy = lp.LinearProgramming(spec).compute_q_table(max_iterations=1000).argmax(axis=-1)
+
+    evaluation = distributional.CategoricalEvaluation(spec, policy, num_atoms=201)
+    q_distributions = evaluation.compute_q_distributions()
+    moments = distributional.compute_return_moments(spec, policy)
+    returns = simulation.simulate_episodes(spec, policy, num_episodes=50000, random_state=0).returns
+
+    # The projection keeps means exact but adds some variance.
+    assert np.allclose(evaluation.mean(q_distributions), moments.q_mean, atol=1e-4)
+    assert np.allclose(evaluation.variance(q_distributions), moments.q_variance, atol=0.01)
+    assert np.isclose(moments.v_mean[0], returns.mean(), atol=0.01)
+    assert np.isclose(moments.v_variance[0], returns.var(), rtol=0.05)
+    assert moments.v_variance[-1] == 0
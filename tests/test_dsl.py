@@ -155,3 +155,23 @@ def test_missing_terminal_state_fail():
             dsl.action()
 
             new_mdp.validate()
+
+
+# noinspection PyStatementEffect
+def test_factored_conditions():
+    with dsl.new_factored() as new_mdp:
+        x = dsl.variable('x', 2)
+        y = dsl.variable('y', ['off', 'on'])
+        toggle = dsl.action('toggle')
+
+        x[0] & y['off'] & toggle > y['on']
+        x[1] & toggle > y['off'] * 0.5 | y['on'] * 0.5 | dsl.reward(1)
+
+        with pytest.raises(ValueError):
+            x[0] & x[1]
+        with pytest.raises(ValueError):
+            x[0] & toggle > (x[1] & y['on'])
+
+        assert len(new_mdp.value_outcomes) == 2
+        assert len(new_mdp.reward_outcomes) == 1
+        return new_mdp.validate()
@@ -0,0 +1,256 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc import mdp
+from blackhc.mdp import dsl
+from blackhc.mdp import compiled
+from blackhc.mdp import factored
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+
+
+# noinspection PyStatementEffect
+def key_corridor():
+    """Walk right along x and grab the key y at x = 1; done at x = 2 with the key."""
+    with dsl.new_factored() as spec:
+        x = dsl.variable('x', 3)
+        y = dsl.variable('y', ['no key', 'key'])
+        right = dsl.action('right')
+        grab = dsl.action('grab')
+
+        x[0] & right > x[1] * 0.9 | x[0] * 0.1
+        x[1] & right > x[2] * 0.9 | x[1] * 0.1
+        x[1] & grab > y['key'] * 0.5 | y['no key'] * 0.5
+        y['no key'] & (right | grab) > dsl.reward(-1)
+        y['key'] & (right | grab) > dsl.reward(-1)
+        x[1] & y['key'] & right > dsl.reward(5)
+        dsl.terminal(x[2] & y['key'])
+        dsl.discount(0.9)
+    return spec
+
+
+def joint_key_corridor():
+    """`key_corridor` with every joint state and transition spelled out."""
+    spec = mdp.MDPSpec()
+    states = {(x, y): spec.state('%s%s' % (x, y), terminal_state=(x, y) == (2, 1)) for x in range(3) for y in range(2)}
+    right = spec.action('right')
+    grab = spec.action('grab')
+    for (x, y), state in sorted(states.items()):
+        if state.terminal_state:
+            continue
+        next_x = min(x + 1, 2) if x < 2 else x
+        spec.transition(state, right, mdp.NextState(states[next_x, y], 0.9 if x < 2 else 1.))
+        if x < 2:
+            spec.transition(state, right, mdp.NextState(states[x, y], 0.1))
+        spec.transition(state, right, mdp.Reward(-1 + (5 if (x, y) == (1, 1) else 0)))
+        if x == 1:
+            spec.transition(state, grab, mdp.NextState(states[x, 1], 0.5))
+            spec.transition(state, grab, mdp.NextState(states[x, 0], 0.5))
+        else:
+            spec.transition(state, grab, mdp.NextState(state))
+        spec.transition(state, grab, mdp.Reward(-1))
+    spec.discount = 0.9
+    return spec
+
+
+def test_state_indices():
+    spec = key_corridor()
+    x, y = spec.variables
+    assert spec.shape == (3, 2)
+    assert spec.num_states == 6
+    assert spec.state_index({x: 2, y: 'key'}) == 5
+    assert spec.assignment(3) == {x: 1, y: 'key'}
+    with pytest.raises(ValueError):
+        spec.state_index({x: 1})
+
+
+def test_factors_are_normalized_and_default_to_identity():
+    compiled_mdp = factored.CompiledFactoredMDP(key_corridor())
+    x_factor, y_factor = compiled_mdp.factors
+    assert [parent.name for parent in y_factor.parents] == ['x', 'y']
+    np.testing.assert_allclose(x_factor.probs.sum(axis=-1), 1.)
+    # Grabbing never moves and moving never changes the key.
+    np.testing.assert_allclose(x_factor.probs[1], np.eye(3))
+    np.testing.assert_allclose(y_factor.probs[0, 2], np.eye(2))
+    np.testing.assert_allclose(y_factor.probs[1, 1], [[0.5, 0.5], [0.5, 0.5]])
+    assert compiled_mdp.terminal_states.tolist() == [False] * 5 + [True]
+    assert compiled_mdp.expected_rewards[3].tolist() == [4., -1.]
+
+
+def test_value_iteration_matches_joint_spec():
+    q_table = factored.FactoredValueIteration(key_corridor()).compute_q_table(max_iterations=1000)
+    expected_q_table = lp.LinearProgramming(joint_key_corridor()).compute_q_table(max_iterations=1000)
+    np.testing.assert_allclose(q_table, expected_q_table, atol=1e-4)
+
+
+def test_sample_matches_factors():
+    compiled_mdp = factored.CompiledFactoredMDP(key_corridor())
+    next_states, rewards = compiled_mdp.sample(2, 1, n=20000, random_state=0)
+    assert next_states.shape == (20000,)
+    assert set(np.unique(next_states)) == {2, 3}
+    assert np.mean(next_states == 3) == pytest.approx(0.5, abs=0.02)
+    assert np.all(rewards == -1)
+
+    next_states, _ = compiled_mdp.sample([5, 0], [0, 0], n=3, random_state=0)
+    assert next_states.shape == (2, 3)
+    assert np.all(next_states[0] == 5)
+
+
+# noinspection PyStatementEffect
+def test_sample_draws_rewards():
+    with dsl.new_factored() as spec:
+        x = dsl.variable('x', 2)
+        y = dsl.variable('y', 1)
+        coin = dsl.action('coin')
+        x[0] & coin > dsl.reward(0) | dsl.reward(5)
+        # Rewards of different conditions add up.
+        y[0] & coin > dsl.reward(1)
+        dsl.terminal(x[1])
+    compiled_mdp = factored.CompiledFactoredMDP(spec)
+    assert compiled_mdp.expected_rewards[0, 0] == 3.5
+
+    _, rewards = compiled_mdp.sample(0, 0, n=10000, random_state=0)
+    assert set(np.unique(rewards)) == {1., 6.}
+    assert rewards.mean() == pytest.approx(3.5, abs=0.1)
+    _, rewards = compiled_mdp.sample(1, 0, n=10, random_state=0)
+    assert np.all(rewards == 0)
+
+    env = spec.to_env()
+    env.reset()
+    assert env.step(0)[1] in (1., 6.)
+
+
+def test_env():
+    spec = key_corridor()
+    x, y = spec.variables
+    env = spec.to_env()
+    env.random_state.seed(0)
+    state = env.reset()
+    assert state == 0
+    for _ in range(100):
+        assignment = spec.assignment(state)
+        action = 1 if assignment[x] == 1 and assignment[y] == 'no key' else 0
+        state, reward, done, _ = env.step(action)
+        if done:
+            break
+    assert done
+    assert spec.assignment(state) == {x: 2, y: 'key'}
+
+
+def joint_product(product: factored.ProductMDP, terminal):
+    """The joint MDPSpec of `product`, built by enumerating all joint states and actions."""
+    spec = mdp.MDPSpec()
+    spec.discount = product.discount
+    component_terminals = [component.terminal_states for component in product.components]
+    states = []
+    for state in range(product.num_states):
+        terminals = [terminal_states[index] for terminal_states, index in
+                     zip(component_terminals, product.component_states(state))]
+        states.append(spec.state(terminal_state=any(terminals) if terminal == 'any' else all(terminals)))
+    actions = [spec.action() for _ in range(product.num_actions)]
+    transition_matrices = [component.transition_matrix().toarray() for component in product.components]
+    for state in states:
+        if state.terminal_state:
+            continue
+        component_states = product.component_states(state.index)
+        for action in actions:
+            component_actions = product.action_table[action.index]
+            probs = np.ones(())
+            reward = 0.
+            for i, component in enumerate(product.components):
+                row = component.rows(component_states[i], component_actions[i])
+                probs = np.multiply.outer(probs, transition_matrices[i][row])
+                reward += component.expected_rewards[component_states[i], component_actions[i]]
+            for next_state in np.flatnonzero(probs):
+                spec.transition(state, action, mdp.NextState(states[next_state], probs.ravel()[next_state]))
+            spec.transition(state, action, mdp.Reward(reward))
+    return spec
+
+
+def product_components():
+    return [generators.random_mdp(3, 2, seed=0), generators.chain(3, slip=0.2, discount=0.9)]
+
+
+@pytest.mark.parametrize('terminal', factored.ProductMDP.TERMINALS)
+@pytest.mark.parametrize('actions', factored.ProductMDP.ACTIONS)
+def test_product_value_iteration_matches_joint_spec(actions, terminal):
+    product = factored.ProductMDP(product_components(), actions=actions, terminal=terminal)
+    assert product.num_states == 9
+    assert product.num_actions == (4 if actions == 'product' else 2)
+
+    q_table = factored.FactoredValueIteration(product).compute_q_table(max_iterations=1000)
+    expected_q_table = lp.LinearProgramming(joint_product(product, terminal)).compute_q_table(max_iterations=1000)
+    np.testing.assert_allclose(q_table, expected_q_table, atol=1e-3)
+
+
+@pytest.mark.parametrize('actions', factored.ProductMDP.ACTIONS)
+def test_product_values_by_hand(actions):
+    # Action 0 moves forward, action 1 resets with reward 0.01; reaching the end gives reward 1.
+    chains = [generators.chain(2, discount=0.9), generators.chain(3, discount=0.9)]
+
+    product = factored.ProductMDP(chains, actions=actions, terminal='all', start_states=np.array([0, 0]))
+    assert product.start_state == 0
+    v_vector = factored.FactoredValueIteration(product).compute_v_vector(max_iterations=1000)
+    # Finished chains wait for the other one, so the values add up: 1 + 0.9 * 1.
+    assert v_vector[product.state_index([0, 0])] == pytest.approx(1.9, abs=1e-3)
+    assert v_vector[product.state_index([1, 1])] == pytest.approx(1., abs=1e-3)
+    assert v_vector[product.state_index([1, 2])] == 0.
+
+    product = factored.ProductMDP(chains, actions=actions, terminal='any')
+    v_vector = factored.FactoredValueIteration(product).compute_v_vector(max_iterations=1000)
+    assert v_vector[product.state_index([0, 1])] == pytest.approx(2., abs=1e-3)
+    if actions == 'product':
+        # Resetting the short chain while the long one moves forward: 0.01 + 0.9 * 2.
+        assert v_vector[product.state_index([0, 0])] == pytest.approx(1.81, abs=1e-3)
+    else:
+        # Moving forward ends the episode in the short chain after reward 1.
+        assert v_vector[product.state_index([0, 0])] == pytest.approx(1., abs=1e-3)
+
+
+def test_product_sample_matches_joint_spec():
+    product = factored.ProductMDP(product_components())
+    joint_mdp = compiled.CompiledMDP(joint_product(product, 'any'))
+    next_states, rewards = product.sample(product.state_index([1, 0]), 2, n=20000, random_state=0)
+    row = joint_mdp.rows(product.state_index([1, 0]), 2)
+    np.testing.assert_allclose(np.bincount(next_states, minlength=9) / 20000,
+                               joint_mdp.transition_matrix()[row].toarray()[0], atol=0.02)
+    assert rewards.mean() == pytest.approx(joint_mdp.expected_rewards[product.state_index([1, 0]), 2], abs=0.02)
+
+    terminal_state = product.state_index([1, 2])
+    next_states, rewards = product.sample(terminal_state, 0, n=3, random_state=0)
+    assert np.all(next_states == terminal_state)
+    assert np.all(rewards == 0)
+
+
+def test_product_env():
+    product = factored.ProductMDP(product_components(), actions='shared', start_states=[2, 0])
+    env = product.to_env(random_state=0)
+    assert env.reset() == product.state_index([2, 0])
+    for _ in range(100):
+        _, _, done, _ = env.step(0)
+        if done:
+            break
+    assert done
+
+
+def test_product_errors():
+    with pytest.raises(ValueError):
+        factored.ProductMDP([generators.chain(3, discount=0.9), generators.chain(3, discount=0.5)])
+    with pytest.raises(ValueError):
+        factored.ProductMDP([generators.chain(3, num_actions=2), generators.chain(3, num_actions=3)],
+                            actions='shared')
+    with pytest.raises(ValueError):
+        factored.ProductMDP(product_components(), terminal='first')
@@ -0,0 +1,48 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+
+
+def test_random_mdp():
+    spec = generators.random_mdp(20, 3, branching=4, seed=0).validate()
+
+    assert spec.num_states == 20
+    assert spec.num_actions == 3
+    assert len(spec.state_outcomes[spec.states[0], spec.actions[0]]) == 4
+
+    same_spec = generators.random_mdp(20, 3, branching=4, seed=0)
+    assert np.allclose(lp.LinearProgramming(spec).expected_rewards,
+                       lp.LinearProgramming(same_spec).expected_rewards)
+
+
+def test_gridworld():
+    spec = generators.gridworld(4, 3).validate()
+
+    assert spec.num_states == 12
+    assert spec.num_actions == 4
+    assert spec.states[-1].terminal_state
+
+    v_vector = lp.LinearProgramming(spec).compute_v_vector(max_iterations=1000)
+    assert v_vector[-2] > v_vector[0] > 0
+
+
+def test_chain():
+    spec = generators.chain(5).validate()
+
+    assert spec.num_states == 5
+    assert spec.is_deterministic
+    assert np.allclose(lp.LinearProgramming(spec).compute_episodic_v_vector()[:4], 0.95 ** np.arange(3, -1, -1))
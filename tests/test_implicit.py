@@ -0,0 +1,63 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import implicit
+from blackhc.mdp import lp
+
+
+def _counter_successors(n):
+    if n == 5:
+        return {}
+    return {'inc': [(0.5, n + 1, -1.), (0.5, n, -1.)], 'stay': [(1., n, -2.)]}
+
+
+def test_states_are_interned_lazily():
+    counter = implicit.ImplicitMDP(_counter_successors, start_state=0, actions=['inc', 'stay'], cache_size=2)
+    assert counter.num_states == 1
+
+    next_states, probs, rewards = counter.expand(0)[0]
+    assert list(next_states) == [1, 0] and list(probs) == [0.5, 0.5] and list(rewards) == [-1, -1]
+    assert counter.states == [0, 1]
+
+    assert counter.explore() == 6
+    assert counter.is_terminal(5)
+    assert len(counter._expansions) == 2
+    # Evicted states are expanded again.
+    num_expansions = counter.num_expansions
+    counter.expand(0)
+    assert counter.num_expansions == num_expansions + 1
+
+    with pytest.raises(ValueError):
+        implicit.ImplicitMDP(lambda n: {'inc': [(1., n + 1, 0.)]}, start_state=0, actions=['inc']).explore(100)
+
+
+def test_solvers_and_env_accept_implicit_mdps():
+    counter = implicit.ImplicitMDP(_counter_successors, start_state=0, actions=['inc', 'stay'])
+
+    v_vector = lp.LinearProgramming(counter).compute_v_vector(max_iterations=1000)
+    # Every increment takes 2 steps in expectation.
+    assert np.allclose(v_vector, [-10, -8, -6, -4, -2, 0], atol=1e-3)
+    assert np.allclose(lp.evaluate_policy(counter, np.zeros(6, dtype=np.int64)), [-10, -8, -6, -4, -2, 0])
+
+    env = counter.to_env()
+    np.random.seed(0)
+    assert env.reset() == 0
+    total_reward, is_done = 0, False
+    while not is_done:
+        state, reward, is_done, _ = env.step(0)
+        total_reward += reward
+    assert state == 5
+    assert total_reward <= -5
@@ -0,0 +1,84 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import example
+from blackhc.mdp import instrumentation
+from blackhc.mdp import lp
+
+
+@pytest.fixture
+def instrumented():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_env_metrics(instrumented):
+    env = example.ONE_ROUND_DMDP.to_env()
+    env.reset()
+    env.step(0)
+    env.reset()
+    env.step(1)
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['counters'] == {'env.steps': 2, 'env.resets': 2}
+    assert snapshot['timers']['env.sample']['count'] == 2
+    assert snapshot['timers']['transitions.compile']['count'] == 1
+
+
+def test_solver_observer(instrumented):
+    events = []
+    observer = lambda name, value: events.append((name, value))
+    instrumentation.add_observer(observer)
+    try:
+        lp.LinearProgramming(example.MULTI_ROUND_NDMP).compute_v_vector()
+    finally:
+        instrumentation.remove_observer(observer)
+
+    residuals = [value for name, value in events if name == 'solver.residual']
+    iterations = [value for name, value in events if name == 'solver.iteration']
+    assert len(residuals) == len(iterations) > 1
+    assert residuals[-1] < residuals[0]
+    assert np.isclose(instrumentation.snapshot()['gauges']['solver.residual'], residuals[-1])
+
+
+def test_disabled_by_default():
+    assert not instrumentation.enabled
+
+    env = example.ONE_ROUND_DMDP.to_env()
+    env.reset()
+    env.step(0)
+
+    assert instrumentation.snapshot() == dict(counters={}, timers={}, gauges={})
+
+
+def test_removing_the_last_observer_disables_instrumentation():
+    observer = lambda name, value: None
+    instrumentation.add_observer(observer)
+    assert instrumentation.enabled
+    instrumentation.remove_observer(observer)
+    assert not instrumentation.enabled
+
+    instrumentation.enable()
+    try:
+        instrumentation.add_observer(observer)
+        instrumentation.remove_observer(observer)
+        # Instrumentation that was enabled explicitly stays enabled.
+        assert instrumentation.enabled
+    finally:
+        instrumentation.disable()
@@ -1,4 +1,3 @@
-from blackhc.mdp import dsl
 # Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
@@ -14,8 +13,13 @@ from blackhc.mdp import dsl
 # limitations under the License.
 import numpy as np
 import pytest
-from blackhc.mdp import lp
+
+from blackhc.mdp import compiled
 from blackhc.mdp import dsl
+from blackhc.mdp import example
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+from blackhc.mdp import simulation
 
 
 # noinspection PyStatementEffect
@@ -81,3 +85,236 @@ def test_terminal_state():
 
     solver = lp.LinearProgramming(new_mdp)
     assert np.isclose(solver.compute_q_table(), [0])
+
+
+def test_evaluate_policy():
+    spec = example.TWO_ROUND_NMDP
+
+    assert np.allclose(lp.evaluate_policy(spec, [0, 1, 1, 0]), [3, 3, 2.5, 0])
+    assert np.allclose(lp.evaluate_policy(spec, np.full((4, 2), 0.5)), [1.625, 1.5, 1.75, 0])
+    assert np.allclose(lp.evaluate_policy(spec, [0, 1, 1, 0]),
+                       lp.LinearProgramming(spec).compute_v_vector())
+
+
+def test_evaluate_policy_discounted():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        action = dsl.action()
+
+        start & action > dsl.reward(1) | start
+
+        dsl.discount(0.5)
+
+    assert np.allclose(lp.evaluate_policy(new_mdp, [0]), [2.0])
+
+
+def test_evaluate_policy_improper_raises():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        dsl.terminal_state()
+        action = dsl.action()
+
+        start & action > start | dsl.reward(1)
+
+    with pytest.raises(ValueError):
+        lp.evaluate_policy(new_mdp, [0, 0])
+
+
+def test_episodic():
+    solver = lp.LinearProgramming(example.TWO_ROUND_NMDP)
+
+    assert np.allclose(solver.compute_episodic_v_vector(), [3, 3, 2.5, 0])
+    assert np.allclose(solver.compute_episodic_q_table(), solver.compute_q_table())
+
+
+def test_episodic_with_cycles():
+    solver = lp.LinearProgramming(example.MULTI_ROUND_NDMP)
+
+    assert np.allclose(solver.compute_episodic_q_table(), solver.compute_q_table())
+
+
+def test_episodic_unreachable_terminal_raises():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        action = dsl.action()
+
+        start & action > start
+
+    with pytest.raises(ValueError):
+        lp.LinearProgramming(new_mdp).compute_episodic_v_vector()
+
+
+def test_episodic_reward_cycle_raises():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        end = dsl.terminal_state()
+        stay = dsl.action()
+        leave = dsl.action()
+
+        start & stay > start | dsl.reward(1)
+        start & leave > end
+
+    with pytest.raises(ValueError):
+        lp.LinearProgramming(new_mdp).compute_episodic_v_vector()
+
+
+def test_finite_horizon():
+    solver = lp.LinearProgramming(example.TWO_ROUND_DMDP)
+
+    q_tables = solver.compute_finite_horizon_q_table(3)
+    assert q_tables.shape == (3, 4, 2)
+    assert np.allclose(q_tables[2], solver.expected_rewards)
+    assert np.allclose(q_tables[1][0], [3, 2])
+    assert np.allclose(q_tables[0], solver.compute_q_table())
+
+    first_slice = solver.compute_finite_horizon_q_table(3, num_slices=1, dtype=np.float32)
+    assert first_slice.shape == (1, 4, 2)
+    assert first_slice.dtype == np.float32
+    assert np.allclose(first_slice[0], q_tables[0])
+
+
+def test_finite_horizon_discounted():
+    solver = lp.LinearProgramming(example.MULTI_ROUND_NDMP)
+
+    assert np.allclose(solver.compute_finite_horizon_q_table(200)[0], solver.compute_q_table())
+
+
+def test_by_components():
+    for spec in [example.TWO_ROUND_NMDP, example.MULTI_ROUND_NDMP]:
+        solver = lp.LinearProgramming(spec)
+
+        assert np.allclose(solver.compute_v_vector_by_components(), solver.compute_v_vector())
+        assert np.allclose(solver.compute_q_table_by_components(), solver.compute_q_table())
+
+
+def test_by_components_skips_unreachable():
+    solver = lp.LinearProgramming(example.TWO_ROUND_DMDP)
+
+    v_vector = solver.compute_v_vector_by_components(start_state=1)
+    assert np.isnan(v_vector[[0, 2]]).all()
+    assert np.allclose(v_vector[[1, 3]], [3, 0])
+
+
+def test_callback_and_full_output():
+    solver = lp.LinearProgramming(example.MULTI_ROUND_NDMP)
+    residuals = []
+
+    def callback(iteration, v_vector, residual):
+        residuals.append(residual)
+        return iteration == 3
+
+    v_vector, info = solver.compute_v_vector(callback=callback, full_output=True)
+
+    assert len(residuals) == 3
+    assert info.iterations == 3
+    assert not info.converged
+    assert info.residual == residuals[-1]
+    assert np.abs(v_vector - solver.compute_v_vector()).max() <= info.error_bound
+
+
+def test_target_residual():
+    solver = lp.LinearProgramming(example.MULTI_ROUND_NDMP)
+
+    q_table, info = solver.compute_q_table(target_residual=0.1, full_output=True)
+
+    assert info.converged
+    assert info.residual <= 0.1
+    assert np.abs(q_table - solver.compute_q_table()).max() <= info.error_bound
+
+
+def test_time_budget_returns_best_so_far():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        action = dsl.action()
+
+        start & action > start | dsl.reward(1)
+
+    solver = lp.LinearProgramming(new_mdp)
+    v_vector, info = solver.compute_v_vector(max_iterations=10 ** 9, time_budget=0.01, full_output=True)
+
+    assert not info.converged
+    assert v_vector[0] == info.iterations
+    assert info.error_bound == np.inf
+
+
+def test_float32():
+    solver = lp.LinearProgramming(example.MULTI_ROUND_NDMP, dtype=np.float32)
+
+    q_table = solver.compute_q_table()
+    v_vector = solver.compute_v_vector()
+
+    assert solver.next_states.dtype == np.float32
+    assert q_table.dtype == v_vector.dtype == np.float32
+    assert np.allclose(q_table, lp.LinearProgramming(example.MULTI_ROUND_NDMP).compute_q_table(), atol=1e-4)
+
+
+@pytest.mark.parametrize('schedule', ['synchronous', 'asynchronous'])
+def test_parallel_value_iteration(schedule):
+    spec = generators.random_mdp(50, 3, branching=3, seed=0)
+    expected_v_vector = lp.LinearProgramming(spec).compute_v_vector(max_iterations=1000)
+
+    solver = lp.ParallelValueIteration(spec, num_workers=3, chunk_size=7, schedule=schedule)
+    v_vector, info = solver.compute_v_vector(max_iterations=1000, full_output=True)
+
+    assert len(solver.chunks) == 8
+    assert info.converged
+    # Both solvers stop once the values change by less than np.allclose tolerances.
+    assert np.allclose(v_vector, expected_v_vector, atol=1e-3)
+    assert np.allclose(lp.ParallelValueIteration(example.TWO_ROUND_NMDP, schedule=schedule).compute_q_table(),
+                       lp.LinearProgramming(example.TWO_ROUND_NMDP).compute_q_table())
+
+
+def test_parallel_value_iteration_unknown_schedule():
+    with pytest.raises(ValueError):
+        lp.ParallelValueIteration(example.TWO_ROUND_NMDP, schedule='random')
+
+
+def test_streaming_value_iteration(tmpdir):
+    spec = generators.random_mdp(50, 3, branching=3, seed=0)
+    compiled.save_transitions(compiled.CompiledMDP(spec), str(tmpdir))
+    expected_q_table = lp.LinearProgramming(spec).compute_q_table(max_iterations=1000)
+
+    solver = lp.StreamingValueIteration(str(tmpdir), block_size=7)
+    v_vector, info = solver.compute_v_vector(max_iterations=1000, full_output=True)
+
+    assert info.converged
+    assert np.allclose(v_vector, expected_q_table.max(axis=-1), atol=1e-3)
+    assert np.all(solver.compute_greedy_policy(v_vector) == expected_q_table.argmax(axis=-1))
+
+
+def test_occupancy_counts_expected_visits():
+    spec = generators.chain(5, slip=0.2, discount=1.)
+    policy = np.zeros(5, dtype=np.int64)
+
+    occupancy = lp.compute_occupancy(spec, policy)
+    power_occupancy, info = lp.compute_occupancy(spec, policy, method='power', full_output=True)
+    statistics = simulation.simulate_episodes(spec, policy, num_episodes=20000, random_state=0)
+
+    assert info.converged
+    assert np.allclose(occupancy, power_occupancy, atol=1e-4)
+    assert np.all(occupancy[:, 1] == 0) and np.all(occupancy[4] == 0)
+    assert np.allclose(occupancy[:, 0], statistics.visit_counts / 20000, rtol=0.03)
+    # The expected return is the occupancy-weighted expected reward.
+    spec = generators.gridworld(3, 3, slip=0.3)
+    policy = np.full((9, 4), 0.25)
+    start_distribution = np.full(9, 1 / 9)
+    assert np.isclose((lp.compute_occupancy(spec, policy, start_distribution) *
+                       compiled.CompiledMDP(spec).expected_rewards).sum(),
+                      start_distribution @ lp.evaluate_policy(spec, policy))
+
+
+def test_stationary_distribution():
+    # Continuing MDP without terminal states: the distribution is invariant under the chain.
+    spec = generators.random_mdp(20, 2, branching=3, seed=0)
+    policy = np.full((20, 2), 0.5)
+    distribution, info = lp.compute_stationary_distribution(spec, policy, full_output=True)
+    transitions = compiled.CompiledMDP(spec).policy_matrix(policy) @ compiled.CompiledMDP(spec).transition_matrix()
+    assert info.converged
+    assert np.isclose(distribution.sum(), 1)
+    assert np.allclose(transitions.T @ distribution, distribution, atol=1e-5)
+
+    # With restarts after termination, it is proportional to the expected visits per episode.
+    spec = generators.chain(5, slip=0.2, discount=1.)
+    distribution = lp.compute_stationary_distribution(spec, np.zeros(5, dtype=np.int64))
+    occupancy = lp.compute_occupancy(spec, np.zeros(5, dtype=np.int64)).sum(axis=-1)
+    assert np.allclose(distribution, occupancy / occupancy.sum(), atol=1e-4)
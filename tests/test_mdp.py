@@ -11,6 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import numpy as np
+import pytest
+
 from blackhc import mdp
 from blackhc.mdp import dsl
 
@@ -55,4 +58,32 @@ def test_without_dsl():
     spec.transition(start, action_1, mdp.NextState(end))
     spec.transition(start, action_1, mdp.Reward(1))
 
-    spec.validate()
\ No newline at end of file
+    spec.validate()
+
+
+def test_named_states_and_actions_are_unique():
+    spec = mdp.MDPSpec()
+
+    assert spec.state('start') is spec.state('start')
+    assert spec.action('go') is spec.action('go')
+    assert spec.num_states == len(spec.states) == 1
+    assert spec.num_actions == len(spec.actions) == 1
+
+
+def test_env_start_distribution():
+    spec = mdp.MDPSpec()
+    a = spec.state('a')
+    b = spec.state('b')
+    end = spec.state('end', terminal_state=True)
+    action = spec.action()
+    for state in (a, b):
+        spec.transition(state, action, mdp.NextState(end))
+
+    env = mdp.MDPEnv(spec, start_distribution={a: 0.25, b: 0.75})
+    assert env.start_state is b
+    np.random.seed(0)
+    start_states = [env.reset() for _ in range(4000)]
+    assert np.isclose(np.mean(start_states), 0.75, atol=0.03)
+
+    with pytest.raises(ValueError):
+        mdp.MDPEnv(spec, start_distribution={a: 0.5})
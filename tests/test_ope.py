@@ -0,0 +1,79 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc.mdp import compiled
+from blackhc.mdp import distributional
+from blackhc.mdp import generators
+from blackhc.mdp import ope
+
+
+def _log_trajectories(spec, behavior_policy, num_episodes, seed):
+    """Run `num_episodes` episodes side by side under `behavior_policy` and pad them."""
+    compiled_mdp = compiled.CompiledMDP(spec)
+    random_state = compiled.get_random_state(seed)
+    cumprobs = np.cumsum(behavior_policy, axis=-1)
+
+    states = np.zeros(num_episodes, dtype=np.int64)
+    lengths = np.zeros(num_episodes, dtype=np.int64)
+    running = np.ones(num_episodes, dtype=bool)
+    columns = []
+    while running.any():
+        actions = (cumprobs[states] <= random_state.random_sample((num_episodes, 1))).sum(axis=-1)
+        next_states, rewards = compiled_mdp.sample(states, actions, random_state=random_state)
+        columns.append((states, actions, rewards))
+        lengths += running
+        running &= ~compiled_mdp.terminal_states[next_states]
+        states = next_states
+    return ope.Trajectories(*[np.stack(column, axis=1) for column in zip(*columns)], lengths=lengths)
+
+
+def test_estimators_recover_target_value():
+    spec = generators.gridworld(3, 3, slip=0.2, step_reward=-0.1, discount=0.9)
+    behavior_policy = np.full((9, 4), 0.25)
+    target_policies = np.stack([np.full((9, 4), 0.1) + 0.6 * np.eye(4)[[1, 1, 1, 3, 3, 1, 3, 3, 0]],
+                                behavior_policy])
+    moments = [distributional.compute_return_moments(spec, policy) for policy in target_policies]
+    true_values = np.array([moment.v_mean[0] for moment in moments])
+    trajectories = _log_trajectories(spec, behavior_policy, num_episodes=20000, seed=0)
+
+    estimates = [ope.importance_sampling(trajectories, target_policies, behavior_policy, 0.9),
+                 ope.weighted_importance_sampling(trajectories, target_policies, behavior_policy, 0.9),
+                 ope.per_decision_importance_sampling(trajectories, target_policies, behavior_policy, 0.9)]
+    for estimate in estimates:
+        assert estimate.shape == (2,)
+        assert np.allclose(estimate, true_values, atol=0.05)
+
+    # With the exact Q-tables, doubly robust is exact up to the randomness of the rewards and transitions.
+    doubly_robust = ope.doubly_robust(trajectories, target_policies, behavior_policy,
+                                      [moment.q_mean for moment in moments], 0.9)
+    assert np.allclose(doubly_robust, true_values, atol=0.01)
+    # On-policy, all weights are 1.
+    assert np.isclose(estimates[0][1], _log_returns(trajectories, 0.9).mean())
+
+
+def _log_returns(trajectories, discount):
+    return (trajectories.rewards * discount ** np.arange(trajectories.rewards.shape[1])).sum(axis=-1)
+
+
+def test_trajectories_from_transitions():
+    trajectories = ope.Trajectories.from_transitions(states=[0, 1, 0, 0, 2], actions=[1, 0, 0, 1, 1],
+                                                     rewards=[1., 2., 3., 4., 5.], dones=[0, 1, 1, 0, 0])
+
+    assert list(trajectories.lengths) == [2, 1, 2]
+    assert trajectories.states.tolist() == [[0, 1], [0, 0], [0, 2]]
+    assert trajectories.rewards.tolist() == [[1, 2], [3, 0], [4, 5]]
+    assert trajectories.mask.tolist() == [[True, True], [True, False], [True, True]]
+    assert ope.Trajectories.from_episodes([[(0, 1, 1.), (1, 0, 2.)], [(0, 0, 3.)]]).rewards.tolist() == [
+        [1, 2], [3, 0]]
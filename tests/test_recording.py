@@ -0,0 +1,72 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc.mdp import compiled
+from blackhc.mdp import example
+from blackhc.mdp import recording
+
+
+def test_recording_env_writes_shards(tmpdir):
+    env = example.MULTI_ROUND_NDMP.to_env()
+    closed = []
+    env.close = lambda: closed.append(True)
+    with recording.RecordingEnv(env, str(tmpdir), chunk_size=4) as recording_env:
+        for _ in range(3):
+            recording_env.reset()
+            is_done = False
+            while not is_done:
+                _, _, is_done, _ = recording_env.step(0)
+
+    assert closed == [True]
+
+    reader = recording.TrajectoryReader(str(tmpdir))
+    num_transitions = len(reader)
+    assert len(reader.shards) == -(-num_transitions // 4)
+    assert reader.column('dones').sum() == 3
+    assert np.all(reader.column('actions') == 0)
+    assert reader.column('states').dtype == np.int32
+    assert reader.column('rewards').dtype == np.float32
+    # Consecutive transitions within an episode are chained.
+    states, next_states, dones = reader.column('states'), reader.column('next_states'), reader.column('dones')
+    assert np.all(states[1:][~dones[:-1]] == next_states[:-1][~dones[:-1]])
+
+
+def test_recording_batch_env_and_sampling(tmpdir):
+    batch_env = compiled.BatchEnv(compiled.CompiledMDP(example.ONE_ROUND_DMDP), num_envs=5, random_state=0)
+    with recording.RecordingBatchEnv(batch_env, str(tmpdir), chunk_size=3, num_buffers=2) as recording_env:
+        recording_env.reset()
+        for _ in range(4):
+            recording_env.step(np.array([0, 1, 0, 1, 1]))
+
+    reader = recording.TrajectoryReader(str(tmpdir))
+    assert len(reader) == 20
+    assert len(reader.shards) == 7
+    assert list(reader.column('actions')[:5]) == [0, 1, 0, 1, 1]
+    assert list(reader.column('rewards')[:5]) == [0, 1, 0, 1, 1]
+
+    batch = reader.sample(100, random_state=0)
+    assert np.all(batch['rewards'] == batch['actions'])
+    assert np.all(batch['dones'])
+    assert np.all(batch['next_states'] == 1)
+
+
+def test_recorder_appends_to_existing_shards(tmpdir):
+    for _ in range(2):
+        with recording.TrajectoryRecorder(str(tmpdir), chunk_size=10) as recorder:
+            recorder.record_batch(np.arange(3), 0, 1., np.arange(1, 4), False)
+
+    reader = recording.TrajectoryReader(str(tmpdir))
+    assert list(reader.column('states')) == [0, 1, 2, 0, 1, 2]
+    assert list(reader.get([1, 5])['next_states']) == [2, 3]
@@ -0,0 +1,119 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import dsl
+from blackhc.mdp import render
+
+# Output of `dot -Tplain` for the spec below.
+PLAIN = b'''graph 1 1.6944 2.9444
+node "State(S0, 0, False)" 0.84722 2.6944 0.75 0.5 S0 solid ellipse black lightgrey
+node "State(T1, 1, True)" 0.84722 0.40278 0.80556 0.80556 T1 solid doublecircle black lightgrey
+edge "State(S0, 0, False)" "State(T1, 1, True)" 4 0.84722 2.4432 0.84722 2.0958 0.84722 1.5741 0.84722 1.1992 "A0 +1.00" 1.2708 1.8056 solid black
+stop
+'''
+
+
+# noinspection PyStatementEffect
+def _one_round_mdp():
+    with dsl.new() as new_mdp:
+        start = dsl.state()
+        end = dsl.terminal_state()
+        action = dsl.action()
+
+        start & action > end | dsl.reward(1)
+
+        return new_mdp, start.state, end.state, action.action
+
+
+def test_layout_from_plain():
+    new_mdp, start, end, action = _one_round_mdp()
+
+    layout = render.GraphLayout.from_plain(new_mdp.to_graph(), PLAIN)
+
+    assert np.isclose(layout.width, 1.6944)
+    assert np.isclose(layout.height, 2.9444)
+    assert layout.nodes[start].label == 'S0'
+    assert layout.nodes[end].shape == 'doublecircle'
+    assert layout.edges[start, end, action].points.shape == (4, 2)
+    assert layout.edges[start, end, action].label == 'A0 +1.00'
+
+
+def test_renderer_only_changes_highlights():
+    new_mdp, start, end, action = _one_round_mdp()
+    renderer = render.GraphRenderer(render.GraphLayout.from_plain(new_mdp.to_graph(), PLAIN))
+
+    plain_frame = renderer.render().copy()
+    highlighted_frame = renderer.render(*new_mdp.graph_highlights(start, action, end))
+
+    assert plain_frame.dtype == np.uint8
+    assert plain_frame.shape == highlighted_frame.shape
+    assert (plain_frame != highlighted_frame).any()
+    # The frame buffer is reused.
+    assert renderer.render() is highlighted_frame
+    assert (highlighted_frame == plain_frame).all()
+    assert renderer.render_png().startswith(b'\x89PNG')
+
+
+def _chain_mdp(num_states):
+    spec = mdp.MDPSpec()
+    states = [spec.state() for _ in range(num_states)]
+    forward = spec.action('forward')
+    backward = spec.action('backward')
+    for i, state in enumerate(states):
+        spec.transition(state, forward, mdp.NextState(states[min(i + 1, num_states - 1)]))
+        spec.transition(state, backward, mdp.NextState(states[max(i - 1, 0)], 0.99))
+        spec.transition(state, backward, mdp.NextState(state, 0.01))
+    return spec, states
+
+
+def test_graph_view_neighborhood():
+    spec, states = _chain_mdp(1000)
+
+    view = render.GraphView(spec, radius=2)
+    graph = view.to_graph(states[500])
+
+    assert set(graph.nodes()) == set(states[498:503])
+    # Parallel action edges are collapsed.
+    assert graph.number_of_edges(states[500], states[500]) == 1
+
+    node_highlights, edge_highlights = view.graph_highlights(states[500], spec.actions[0], states[501])
+    assert set(node_highlights) == {states[500], states[501]}
+    assert list(edge_highlights) == [(states[500], states[501], 0)]
+
+
+def test_graph_view_min_probability():
+    spec, states = _chain_mdp(10)
+
+    graph = render.GraphView(spec, min_probability=0.1).to_graph()
+
+    assert not graph.has_edge(states[5], states[5])
+    assert graph.has_edge(states[5], states[4])
+
+
+def test_graph_view_clusters():
+    spec, states = _chain_mdp(10)
+    end = spec.state('end', terminal_state=True)
+    stop = spec.action('stop')
+    spec.transition(states[-1], stop, mdp.NextState(end))
+    for state in states[:-1]:
+        spec.transition(state, stop, mdp.NextState(state))
+
+    sccs = render.GraphView(spec, cluster_sccs=True).to_graph()
+    assert len(sccs.nodes()) == 2
+
+    halves = render.GraphView(spec, groups=lambda state: state.index // 5 if state != end else None).to_graph()
+    assert len(halves.nodes()) == 3
+    assert len(halves.edges()) == 3
@@ -0,0 +1,88 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from blackhc.mdp import generators
+from blackhc.mdp import implicit
+from blackhc.mdp import lp
+from blackhc.mdp import search
+
+
+def _unbounded_counter():
+    """Counter that has to reach 5; action 'down' from 0 leads into an infinite chain of states that never ends."""
+    def successors(n):
+        if n == 5:
+            return {}
+        if n < 0:
+            return {'inc': [(1., n - 1, -1.)], 'down': [(1., n - 1, -1.)]}
+        return {'inc': [(0.5, n + 1, -1.), (0.5, n, -1.)], 'down': [(1., n - 1, -1.)]}
+
+    return implicit.ImplicitMDP(successors, start_state=0, actions=['inc', 'down'])
+
+
+@pytest.mark.parametrize('algorithm', ['lrtdp', 'lao_star'])
+def test_search_on_compiled_mdp_matches_value_iteration(algorithm):
+    spec = generators.gridworld(6, 6, slip=0.1)
+    v_vector = lp.LinearProgramming(spec).compute_v_vector(max_iterations=1000)
+
+    solver = search.HeuristicSearch(spec, random_state=0)
+    assert np.isclose(getattr(solver, algorithm)(epsilon=1e-8), v_vector[0], atol=1e-5)
+    policy = solver.greedy_policy()
+    assert np.allclose([v_vector[state] for state in policy], [solver.values[state] for state in policy], atol=1e-4)
+
+
+def test_rtdp_upper_bounds_converge():
+    spec = generators.gridworld(4, 4, slip=0.1)
+    v_vector = lp.LinearProgramming(spec).compute_v_vector(max_iterations=1000)
+
+    solver = search.HeuristicSearch(spec, random_state=0)
+    assert solver.rtdp(num_trials=10) >= v_vector[0] - 1e-8
+    assert np.isclose(solver.rtdp(num_trials=2000), v_vector[0], atol=1e-3)
+
+
+# Trials follow the optimistic greedy policy down the infinite chain until `max_depth`.
+@pytest.mark.parametrize('algorithm,kwargs', [('lrtdp', dict(max_depth=10)), ('lao_star', {})])
+def test_search_on_infinite_implicit_mdp(algorithm, kwargs):
+    counter = _unbounded_counter()
+    solver = search.HeuristicSearch(counter, reward_range=(-1, -1), random_state=0)
+
+    # Every increment takes 2 steps in expectation.
+    assert np.isclose(getattr(solver, algorithm)(**kwargs), -10, atol=1e-4)
+    assert solver.greedy_policy() == {counter.intern(n): 0 for n in range(5)}
+    # Only a few states of the infinite chain are touched before it is ruled out.
+    assert counter.num_states < 30
+
+
+def test_implicit_mdps_need_bounds():
+    with pytest.raises(ValueError):
+        search.HeuristicSearch(_unbounded_counter())
+    with pytest.raises(ValueError):
+        search.HeuristicSearch(_unbounded_counter(), reward_range=(0, 1))
+
+
+def test_backup_computes_q_values_once():
+    heuristic_search = search.HeuristicSearch(generators.chain(5, discount=0.9))
+    q_values = heuristic_search.q_values
+    calls = []
+
+    def counting_q_values(state):
+        calls.append(state)
+        return q_values(state)
+
+    heuristic_search.q_values = counting_q_values
+    expected_value = q_values(0).max()
+    _, action = heuristic_search.backup(0)
+    assert calls == [0]
+    assert heuristic_search.value(0) == pytest.approx(expected_value)
@@ -0,0 +1,58 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc.mdp import example
+from blackhc.mdp import generators
+from blackhc.mdp import lp
+from blackhc.mdp import simulation
+
+
+def test_returns_match_exact_policy_evaluation():
+    spec = generators.gridworld(4, 4, slip=0.2)
+    policy = lp.LinearProgramming(spec).compute_q_table(max_iterations=1000).argmax(axis=-1)
+
+    statistics = simulation.simulate_episodes(spec, policy, num_episodes=20000, random_state=0)
+
+    assert not statistics.truncated.any()
+    assert np.isclose(statistics.returns.mean(), lp.evaluate_policy(spec, policy)[0], atol=0.01)
+    # Every step acts in exactly one state.
+    assert statistics.visit_counts.sum() == statistics.lengths.sum()
+    assert statistics.visit_counts[spec.num_states - 1] == 0
+
+
+def test_stochastic_policy_keeps_rewards_and_next_states_correlated():
+    # Action 0 gives reward 5 and ends with probability 2/3, action 1 gives reward 3 and ends with probability 1/3.
+    spec = example.MULTI_ROUND_NDMP
+    policy = np.array([[0.5, 0.5], [0.5, 0.5]])
+
+    statistics = simulation.simulate_episodes(spec, policy, num_episodes=20000, random_state=0)
+
+    assert np.isclose(statistics.returns.mean(), lp.evaluate_policy(spec, policy)[0], rtol=0.02)
+    # Episodes of length 1 ended after their first action, which is more likely for action 0.
+    assert np.isclose(statistics.returns[statistics.lengths == 1].mean(), (5 * 2 / 3 + 3 / 3) / (2 / 3 + 1 / 3),
+                      rtol=0.02)
+
+
+def test_truncation_and_terminal_start():
+    spec = generators.chain(5)
+    # Always resetting never terminates.
+    statistics = simulation.simulate_episodes(spec, np.ones(5, dtype=np.int64), num_episodes=10, max_length=7)
+    assert statistics.truncated.all()
+    assert np.all(statistics.lengths == 7)
+    assert statistics.visit_counts[0] == 70
+
+    statistics = simulation.simulate_episodes(spec, np.zeros(5, dtype=np.int64), num_episodes=10, start_state=4)
+    assert np.all(statistics.lengths == 0)
+    assert not statistics.truncated.any()
@@ -0,0 +1,44 @@
+# Copyright 2017 Andreas Kirsch <blackhc@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from blackhc import mdp
+from blackhc.mdp import example
+from blackhc.mdp import structure
+
+
+def test_structural_index():
+    index = structure.StructuralIndex(example.TWO_ROUND_DMDP)
+
+    assert index.num_components == 4
+    # The terminal state is a cyclic component (its absorbing self-loop) and is solved first.
+    assert [len(layer) for layer in index.layers] == [1, 2, 1]
+    assert index.cyclic_components[index.layers[0]].all()
+    assert not index.cyclic_components[index.layers[1]].any()
+
+
+def test_reachability():
+    spec = mdp.MDPSpec()
+    start = spec.state()
+    unreachable = spec.state()
+    end = spec.state(terminal_state=True)
+    action = spec.action()
+    spec.transition(start, action, mdp.NextState(start))
+    spec.transition(start, action, mdp.NextState(end))
+    spec.transition(unreachable, action, mdp.NextState(start))
+
+    index = structure.StructuralIndex(spec, start_state=start)
+
+    assert list(index.reachable) == [True, False, True]
+    assert sorted(index.component_states(np.concatenate(index.layers))) == [0, 2]